@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+A catalog of the bill XML files in the data directory, in SQLite: billnumber_version, path, size, mtime,
+Congress, bill type and version of each file, indexed by billnumber_version and by (Congress, bill type, mtime).
+Once the catalog is refreshed, bills can be looked up and listed without walking the directory tree.
+
+A refresh scans the directories (all of them, or those of some Congresses) and only writes the entries
+of files that are new or whose size or mtime changed, and removes the entries of files that no longer exist.
+
+>>> from billsim.bill_catalog import BillCatalog
+>>> catalog = BillCatalog()
+>>> catalog.refresh(congresses=[117])
+>>> catalog.getBillPath('117hr200ih')
+>>> # All 117 hr bills changed since June 1, 2022
+>>> billPaths = catalog.iterBillPaths(congresses=[117], bill_types=['hr'], changed_since=datetime(2022, 6, 1))
+
+Or, to refresh from the command line:
+$ python -m billsim.bill_catalog --congress 117 116
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import logging
+import argparse
+from contextlib import closing
+from datetime import datetime
+from typing import Iterator, Optional, Union
+
+from billsim import constants
+from billsim.pymodels import BillPath, CatalogEntry
+from billsim.utils import iterBillXmlPaths
+
+logger = logging.getLogger(constants.LOGGER_NAME)
+logger.addHandler(logging.StreamHandler(sys.stdout))
+
+# Rows written at a time during a refresh
+CATALOG_BATCH_SIZE = 1000
+CATALOG_COLUMNS = 'billnumber_version, file_path, file_name, size, mtime, congress, bill_type, version'
+
+
+def makeCatalogEntry(billPath: BillPath, stat: os.stat_result) -> CatalogEntry:
+    match = constants.BILL_NUMBER_PART_REGEX_COMPILED.match(
+        billPath.billnumber_version)
+    parts = match.groupdict() if match else {}
+    return CatalogEntry(billnumber_version=billPath.billnumber_version,
+                        filePath=billPath.filePath,
+                        fileName=billPath.fileName,
+                        size=stat.st_size,
+                        mtime=stat.st_mtime,
+                        congress=int(parts['congress']) if parts else None,
+                        bill_type=parts.get('stage') or '',
+                        version=parts.get('version') or '')
+
+
+class BillCatalog:
+    """
+    The catalog at path (created if it does not exist). Each operation uses its own connection,
+    so the catalog can be used from several threads and processes.
+    """
+
+    def __init__(self, path: str = constants.BILL_CATALOG_PATH):
+        self.path = path
+        with closing(self.connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS bills (
+                billnumber_version TEXT NOT NULL,
+                file_path TEXT PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                congress INTEGER,
+                bill_type TEXT NOT NULL,
+                version TEXT NOT NULL)''')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS bills_billnumber_version ON bills (billnumber_version)'
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS bills_congress_type_mtime ON bills (congress, bill_type, mtime)'
+            )
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=60)
+
+    def __len__(self) -> int:
+        with closing(self.connect()) as conn:
+            return conn.execute('SELECT count(*) FROM bills').fetchone()[0]
+
+    def refresh(self,
+                congressDataDir: str = constants.PATH_TO_CONGRESSDATA_DIR,
+                pathType: str = constants.PATHTYPE_DEFAULT,
+                congresses: Optional[list[int]] = None,
+                workers: int = constants.SCAN_WORKERS) -> tuple[int, int]:
+        """
+        Scans the data directory (with congresses, only the directories of those Congresses) and updates the catalog.
+
+        Returns:
+            tuple[int, int]: the number of new or changed files, and the number of entries removed
+        """
+        start_time = time.time()
+        if congresses:
+            rootDirs = [
+                os.path.join(congressDataDir, str(congress))
+                for congress in congresses
+            ]
+        else:
+            rootDirs = [congressDataDir]
+        changed = 0
+        where, params = self.getFilter(congresses=congresses)
+        with closing(self.connect()) as conn, conn:
+            existing = {
+                filePath: (size, mtime)
+                for filePath, size, mtime in conn.execute(
+                    'SELECT file_path, size, mtime FROM bills' + where, params)
+            }
+            seen = set()
+            rows = []
+            for rootDir in rootDirs:
+                if not os.path.isdir(rootDir):
+                    logger.warning(f'No bill directory at {rootDir}')
+                    continue
+                for billPath in iterBillXmlPaths(congressDataDir=rootDir,
+                                                 pathType=pathType,
+                                                 workers=workers):
+                    try:
+                        stat = os.stat(billPath.filePath)
+                    except FileNotFoundError:
+                        continue
+                    seen.add(billPath.filePath)
+                    if existing.get(billPath.filePath) == (stat.st_size,
+                                                           stat.st_mtime):
+                        continue
+                    rows.append(makeCatalogEntry(billPath, stat))
+                    if len(rows) >= CATALOG_BATCH_SIZE:
+                        changed += self.saveEntries(conn, rows)
+                        rows = []
+            changed += self.saveEntries(conn, rows)
+            removed = [(filePath,) for filePath in existing if filePath not in seen]
+            conn.executemany('DELETE FROM bills WHERE file_path = ?', removed)
+        logger.info(
+            f'Bill catalog refreshed in {time.time() - start_time:.1f} seconds: {changed} new or changed, {len(removed)} removed'
+        )
+        return changed, len(removed)
+
+    @staticmethod
+    def saveEntries(conn: sqlite3.Connection, entries: list[CatalogEntry]) -> int:
+        conn.executemany(
+            f'INSERT OR REPLACE INTO bills ({CATALOG_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            entries)
+        return len(entries)
+
+    @staticmethod
+    def getFilter(
+        congresses: Optional[list[int]] = None,
+        bill_types: Optional[list[str]] = None,
+        changed_since: Optional[Union[float, datetime]] = None
+    ) -> tuple[str, list]:
+        """
+        Returns the WHERE clause (or '') and its parameters for the filters.
+        """
+        clauses = []
+        params = []
+        if congresses:
+            clauses.append(f'congress IN ({", ".join("?" * len(congresses))})')
+            params.extend(int(congress) for congress in congresses)
+        if bill_types:
+            clauses.append(f'bill_type IN ({", ".join("?" * len(bill_types))})')
+            params.extend(bill_types)
+        if changed_since is not None:
+            if isinstance(changed_since, datetime):
+                changed_since = changed_since.timestamp()
+            clauses.append('mtime >= ?')
+            params.append(changed_since)
+        if not clauses:
+            return '', params
+        return ' WHERE ' + ' AND '.join(clauses), params
+
+    def iterEntries(
+        self,
+        congresses: Optional[list[int]] = None,
+        bill_types: Optional[list[str]] = None,
+        changed_since: Optional[Union[float, datetime]] = None
+    ) -> Iterator[CatalogEntry]:
+        """
+        Yields the entries of the catalog, by billnumber_version.
+
+        Args:
+            congresses (list[int], optional): only bills of these Congresses
+            bill_types (list[str], optional): only bills of these types (e.g. ['hr', 's'])
+            changed_since (float | datetime, optional): only files modified at or after this time (mtime)
+        """
+        where, params = self.getFilter(congresses=congresses,
+                                       bill_types=bill_types,
+                                       changed_since=changed_since)
+        with closing(self.connect()) as conn:
+            for row in conn.execute(
+                    f'SELECT {CATALOG_COLUMNS} FROM bills{where} ORDER BY billnumber_version',
+                    params):
+                yield CatalogEntry(*row)
+
+    def iterBillPaths(
+        self,
+        congresses: Optional[list[int]] = None,
+        bill_types: Optional[list[str]] = None,
+        changed_since: Optional[Union[float, datetime]] = None
+    ) -> Iterator[BillPath]:
+        """
+        The same as iterEntries, as BillPath objects (as returned by utils.getBillXmlPaths).
+        """
+        for entry in self.iterEntries(congresses=congresses,
+                                      bill_types=bill_types,
+                                      changed_since=changed_since):
+            yield BillPath(billnumber_version=entry.billnumber_version,
+                           filePath=entry.filePath,
+                           fileName=entry.fileName)
+
+    def get(self, billnumber_version: str) -> Optional[CatalogEntry]:
+        with closing(self.connect()) as conn:
+            row = conn.execute(
+                f'SELECT {CATALOG_COLUMNS} FROM bills WHERE billnumber_version = ? LIMIT 1',
+                (billnumber_version,)).fetchone()
+        return CatalogEntry(*row) if row else None
+
+    def getBillPath(self, billnumber_version: str) -> Optional[BillPath]:
+        """
+        The catalogued file of the bill; unlike utils.billNumberVersionToBillPath, the file is known to exist
+        (as of the last refresh).
+        """
+        entry = self.get(billnumber_version)
+        if entry is None:
+            return None
+        return BillPath(billnumber_version=entry.billnumber_version,
+                        filePath=entry.filePath,
+                        fileName=entry.fileName)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Refresh the catalog of bill files.')
+    parser.add_argument('--congress',
+                        type=int,
+                        nargs='+',
+                        default=None,
+                        help='congresses to scan (default: all)')
+    parser.add_argument('--path',
+                        default=constants.BILL_CATALOG_PATH,
+                        help='path to the catalog')
+    args = parser.parse_args()
+    BillCatalog(args.path).refresh(congresses=args.congress)
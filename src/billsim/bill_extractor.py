@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Extracts the metadata (dublinCore, date, congress, session, legisnum, title and headers) and the sections of a
+bill in one traversal of its tree, for USLM2 and for non-namespaced (bill dtd) documents.
+utils.getBillMeta and utils.getSectionRecords each search the whole tree, with one `//` XPath query per field;
+extractBill visits the elements of interest once, in document order, with a tag-filtered lxml iterator.
+
+The result is the same as that of getBillMeta and getSectionRecords:
+
+>>> from billsim.bill_extractor import extractBill
+>>> billTree = parseFilePath(filePath)
+>>> extracted = extractBill(billTree, getDefaultNamespace(billTree), filePath)
+>>> extracted.meta.legisnum, len(extracted.sections)
+"""
+
+import re
+import json
+from collections import OrderedDict
+from typing import Optional
+
+from lxml import etree
+
+from billsim.constants import NAMESPACE_DC, NAMESPACE_USLM2
+from billsim.pymodels import BillMeta, ExtractedBill, SectionRecord
+from billsim.xpath_extractor import getFirstText
+
+DC_DATE = f'{{{NAMESPACE_DC}}}date'
+DC_TITLE = f'{{{NAMESPACE_DC}}}title'
+DC_TYPE = f'{{{NAMESPACE_DC}}}type'
+
+
+def getQualifiedName(tag: str, namespace: Optional[str] = None) -> str:
+    if namespace:
+        return f'{{{namespace}}}{tag}'
+    return tag
+
+
+def getElementText(element) -> Optional[str]:
+    """
+    The text of the element, as utils.getText returns it for the first result of a query ('' when there is none).
+    """
+    if element is None:
+        return ''
+    return element.text
+
+
+def getNumber(text: Optional[str]) -> str:
+    # e.g. '117th CONGRESS' -> '117'
+    return re.sub(r'[a-zA-Z ]+$', '', text or '')
+
+
+def getDateFromDataJson(filePath: str) -> Optional[str]:
+    # TODO find date for enr bills in the bill status (for the flat congress directory structure)
+    if not filePath or '/data.xml' not in filePath:
+        return None
+    metadata_path = filePath.replace('/data.xml', '/data.json')
+    try:
+        with open(metadata_path, 'rb') as f:
+            return json.load(f).get('issued_on', None)
+    except Exception:
+        return None
+
+
+class BillMetaExtractor:
+    """
+    Collects the metadata of a bill from its elements, as extractBill visits them or as they are parsed
+    (utils.iterSectionRecords). Only the values are kept, so that parsed elements can be freed.
+    The namespace of the bill is set (setNamespace) before the elements are added.
+    """
+
+    def __init__(self, filePath: str = ''):
+        self.filePath = filePath
+        self.defaultNS = None
+        self.tags = set()
+        self.found = {}
+        self.headers = []
+
+    def setNamespace(self, defaultNS: Optional[str] = None):
+        self.defaultNS = defaultNS
+        self.isUSLM = bool(defaultNS) and defaultNS == NAMESPACE_USLM2
+        # The metadata of a USLM2 bill is in the USLM2 namespace; otherwise it is looked up without a namespace
+        metaNS = defaultNS if self.isUSLM else None
+        metaTag = getQualifiedName('meta', metaNS)
+        self.prefaceTag = getQualifiedName('preface', metaNS)
+        formTag = getQualifiedName('form', metaNS)
+        self.dublinCoreTag = getQualifiedName('dublinCore', metaNS)
+        self.congressTag = getQualifiedName('congress', metaNS)
+        self.sessionTag = getQualifiedName('session', metaNS)
+        self.docNumberTag = getQualifiedName('docNumber', metaNS)
+        self.legisnumTag = getQualifiedName('legis-num', metaNS)
+        self.headersTag = getQualifiedName(
+            'heading' if self.isUSLM else 'header', metaNS)
+        # The parent of the date and title: uslm:meta, or dublinCore
+        self.dcParentTag = metaTag if self.isUSLM else self.dublinCoreTag
+        # The parent of congress and session: uslm:meta, or form
+        self.congressParentTag = metaTag if self.isUSLM else formTag
+        self.tags = {
+            DC_DATE, DC_TITLE, DC_TYPE, self.dublinCoreTag, self.congressTag,
+            self.sessionTag, self.docNumberTag, self.legisnumTag,
+            self.headersTag
+        }
+
+    def add(self, element):
+        """
+        Adds an element with one of self.tags (once it has been parsed, with its children).
+        """
+        tag = element.tag
+        if tag == self.headersTag:
+            self.headers.append(element.text)
+            return
+        if tag in self.found:
+            return
+        parent = element.getparent()
+        parentTag = parent.tag if parent is not None else None
+        if tag in (DC_DATE, DC_TITLE) and parentTag != self.dcParentTag:
+            return
+        if tag in (self.congressTag,
+                   self.sessionTag) and parentTag != self.congressParentTag:
+            return
+        if tag in (DC_TYPE, self.docNumberTag) and parentTag != self.prefaceTag:
+            return
+        if tag == self.dublinCoreTag:
+            self.found[tag] = '' if self.isUSLM else etree.tostring(
+                element, method="xml", encoding="unicode")
+        else:
+            self.found[tag] = getElementText(element)
+
+    def keeps(self, element) -> bool:
+        """
+        Whether a parsed element must not be freed yet: it is in the dublinCore, which is kept as XML.
+        """
+        return not self.isUSLM and next(
+            element.iterancestors(self.dublinCoreTag), None) is not None
+
+    def getMeta(self) -> BillMeta:
+        found = self.found
+        dcdate = found.get(DC_DATE, '')
+        dublinCore = None
+        if self.isUSLM:
+            if DC_TYPE in found and self.docNumberTag in found:
+                docType = found[DC_TYPE] or ''
+                legisnum = docType + ' ' + (found[self.docNumberTag] or '')
+            else:
+                legisnum = ''
+        else:
+            dublinCore = found.get(self.dublinCoreTag, '')
+            if not dcdate:
+                dcdate = getDateFromDataJson(self.filePath)
+            if not dcdate:
+                dcdate = None
+            legisnum = found.get(self.legisnumTag, '')
+
+        return BillMeta(
+            congress=getNumber(found.get(self.congressTag, '')),
+            session=getNumber(found.get(self.sessionTag, '')),
+            dctitle=found.get(DC_TITLE, ''),
+            date=dcdate,
+            legisnum=legisnum,
+            # Uses an OrderedDict to deduplicate headers
+            headers=list(OrderedDict.fromkeys(self.headers)),
+            dublinCore=dublinCore)
+
+
+def extractBill(billTree,
+                defaultNS: Optional[str] = None,
+                filePath: str = '',
+                withXml: bool = True) -> ExtractedBill:
+    """
+    Extracts the metadata and the top-level, non-withdrawn sections of a bill in one traversal.
+
+    Args:
+        billTree: parsed bill (e.g. from utils.parseFilePath)
+        defaultNS (str, optional): default namespace of the bill. Defaults to None.
+        filePath (str, optional): path to the bill XML, to find the date of a 'data.xml' bill in its
+            'data.json'. Defaults to ''.
+        withXml (bool, optional): whether to include the section XML. Defaults to True.
+
+    Returns:
+        ExtractedBill: the BillMeta (as from utils.getBillMeta) and the SectionRecords (as from
+            utils.getSectionRecords) of the bill
+    """
+    metaExtractor = BillMetaExtractor(filePath)
+    metaExtractor.setNamespace(defaultNS)
+
+    sectionTag = getQualifiedName('section', defaultNS)
+    # NOTE: USLM uses 'num' and 'heading', bill dtd uses 'enum' and 'header'
+    enumTags = {
+        getQualifiedName('enum', defaultNS),
+        getQualifiedName('num', defaultNS)
+    }
+    headerTags = {
+        getQualifiedName('header', defaultNS),
+        getQualifiedName('heading', defaultNS)
+    }
+
+    # (section, enum elements, header elements) of each top-level, non-withdrawn section
+    sections = []
+    tags = metaExtractor.tags | {sectionTag} | enumTags | headerTags
+    for element in billTree.iter(*tags):
+        tag = element.tag
+        if tag == sectionTag:
+            if element.get('status') != 'withdrawn' and next(
+                    element.iterancestors(sectionTag), None) is None:
+                sections.append((element, [], []))
+            continue
+        if tag in metaExtractor.tags:
+            metaExtractor.add(element)
+        if tag in enumTags or tag in headerTags:
+            if sections and element.getparent() is sections[-1][0]:
+                sections[-1][1 if tag in enumTags else 2].append(element)
+
+    return ExtractedBill(meta=metaExtractor.getMeta(),
+                         sections=[
+                             makeSectionRecord(section, enums, sectionHeaders,
+                                               withXml)
+                             for section, enums, sectionHeaders in sections
+                         ])
+
+
+def makeSectionRecord(section, enums: list, headers: list,
+                      withXml: bool = True) -> SectionRecord:
+    text = etree.tostring(section, method="text", encoding="unicode")
+    xml = etree.tostring(section, method="xml",
+                         encoding="unicode") if withXml else None
+    return SectionRecord(section_id=section.get('id', ''),
+                         enum=getFirstText(enums),
+                         header=getFirstText(headers),
+                         text=text,
+                         length=len(text),
+                         xml=xml)
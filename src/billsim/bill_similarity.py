@@ -2,35 +2,109 @@
 
 import sys
 import logging
-from elasticsearch import Elasticsearch
+from typing import Optional
 
-from billsim.pymodels import BillPath, BillSections, SimilarSection, BillToBillModel, QuerySection
-from billsim.elastic_load import getDefaultNamespace
-from billsim.utils import getBillnumberversionParts, getSections
-from billsim.utils_es import getBill_es, esSourceToQueryData
-from lxml import etree
+from billsim.pymodels import BillPath, BillSections, SimilarSection, BillToBillModel, ParsedBill, QuerySection, SectionRecord
+from billsim.utils import getBillnumberversionParts, getParsedBill
+from billsim.utils_es import getBillQueryData_es
 
-es = Elasticsearch()
-from billsim import constants
-from billsim.utils import billNumberVersionToBillPath, deep_get, getBillLengthbyPath, getId, getHeader, getEnum
+from billsim import constants, local_index, minhash_index
+from billsim.utils import billNumberVersionToBillPath, deep_get
 from billsim.pymodels import SectionMeta, Section
-from billsim.utils_es import getHitsHits, moreLikeThis
+from billsim.utils_es import getHitsHits, moreLikeThis, moreLikeThisBatch
+from billsim.section_store import SectionCorpus, getSectionCorpus
+from billsim.deadline import Deadline
 
 #logging.basicConfig(filename='bill_similarity.log', filemode='w', level='INFO')
 logger = logging.getLogger(constants.LOGGER_NAME)
 logger.addHandler(logging.StreamHandler(sys.stdout))
 
 
-def getSimilarSections(
-        queryText: str,
-        index: str = constants.INDEX_SECTIONS,
-        min_score: int = constants.MIN_SCORE_DEFAULT) -> list[SimilarSection]:
+def getSimilarSections(queryText: str,
+                       index: str = constants.INDEX_SECTIONS,
+                       min_score: Optional[int] = None) -> list[SimilarSection]:
     """
   Runs query for sections with 'max' score_mode;
   return in the form of a list of SimilarSection
+  The query runs on Elasticsearch or, with SIMILARITY_BACKEND=local, on the local index (local_index).
+  With MINHASH_MERGE, the near-duplicates of the section are added to the results (see mergeNearDuplicates);
+  with MINHASH_SHORTCIRCUIT, the near-duplicates are returned without a query, if there are any.
+  If min_score is None, the default min_score of the backend is used (see getEsMinScore).
+  """
+
+    nearDuplicates = getNearDuplicateSections(queryText)
+    if isShortCircuited(nearDuplicates):
+        return nearDuplicates
+    if isLocalBackend():
+        res = local_index.moreLikeThis(queryText, index, min_score=min_score)
+    else:
+        res = moreLikeThis(queryText, index, min_score=getEsMinScore(min_score))
+    return mergeNearDuplicates(getSimilarSectionsFromResponse(res),
+                               nearDuplicates)
+
+
+def isLocalBackend() -> bool:
+    return constants.SIMILARITY_BACKEND == constants.SIMILARITY_BACKEND_LOCAL
+
+
+def getEsMinScore(min_score: Optional[int]) -> int:
+    """
+  The min_score of an Elasticsearch query: MIN_SCORE_DEFAULT (scaled by utils_es to the length of the query)
+  if min_score is None. The local index has its own default, relative to the query (see local_index).
   """
+    return constants.MIN_SCORE_DEFAULT if min_score is None else min_score
+
+
+def getNearDuplicateSections(queryText: str) -> list[SimilarSection]:
+    """
+  Near-duplicate sections from the MinHash index (minhash_index), if MINHASH_MERGE or MINHASH_SHORTCIRCUIT is set
+  """
+    if not (constants.MINHASH_MERGE or constants.MINHASH_SHORTCIRCUIT):
+        return []
+    return minhash_index.getMinHashIndex().getSimilarSections(queryText)
+
 
-    res = moreLikeThis(queryText, index, min_score=min_score)
+def isShortCircuited(nearDuplicates: list[SimilarSection],
+                     billnumber_version: Optional[str] = None) -> bool:
+    """
+  With MINHASH_SHORTCIRCUIT, a section is not queried if it has a near-duplicate (at least MINHASH_THRESHOLD)
+  in a bill other than its own (billnumber_version): the near-duplicates are its results.
+  """
+    return constants.MINHASH_SHORTCIRCUIT and any(
+        nearDuplicate.billnumber_version != billnumber_version
+        for nearDuplicate in nearDuplicates)
+
+
+def mergeNearDuplicates(
+        similarSections: list[SimilarSection],
+        nearDuplicates: list[SimilarSection]) -> list[SimilarSection]:
+    """
+  Adds the near-duplicates (from getNearDuplicateSections) to the similar sections of a query, which have
+  one section per bill. A near-duplicate that the query also found gets its similarity as the score;
+  one in a bill that the query did not find is added, with no score_es.
+  """
+    if not nearDuplicates:
+        return similarSections
+    merged = list(similarSections)
+    positions = {
+        similarSection.billnumber_version: i
+        for i, similarSection in enumerate(merged)
+    }
+    for nearDuplicate in nearDuplicates:
+        i = positions.get(nearDuplicate.billnumber_version)
+        if i is None:
+            merged.append(nearDuplicate)
+        elif merged[i].section_id == nearDuplicate.section_id and merged[
+                i].score is None:
+            merged[i] = merged[i].copy(update={'score': nearDuplicate.score})
+    return merged
+
+
+def getSimilarSectionsFromResponse(res: dict) -> list[SimilarSection]:
+    """
+  Converts the response of a more_like_this query (from moreLikeThis or one item of moreLikeThisBatch)
+  to a list of SimilarSection
+  """
     hitsHits = getHitsHits(res)
     similarSections = []
     for hitsHit in hitsHits:
@@ -58,11 +132,10 @@ def getSimilarSections(
 
 
 # This function is independent of any bill number and is the basis for searching similarity for arbitrary text
-def getSimilarSectionItem(
-        queryText: str,
-        sectionMeta: SectionMeta,
-        index: str = constants.INDEX_SECTIONS,
-        min_score: int = constants.MIN_SCORE_DEFAULT) -> Section:
+def getSimilarSectionItem(queryText: str,
+                          sectionMeta: SectionMeta,
+                          index: str = constants.INDEX_SECTIONS,
+                          min_score: Optional[int] = None) -> Section:
     similar_sections = getSimilarSections(queryText,
                                           index=index,
                                           min_score=min_score)
@@ -74,47 +147,158 @@ def getSimilarSectionItem(
                    length=sectionMeta.length)
 
 
-def getSimilarDocSections(filePath: str, docId: str) -> list[Section]:
-    try:
-        billTree = etree.parse(filePath, etree.XMLParser())
-
-    except Exception as e:
-        logger.error("Error parsing file: {}; {} ", filePath, e)
-        raise Exception('Could not parse bill: {}', filePath)
-    defaultNS = getDefaultNamespace(billTree)
-    sections = getSections(billTree, defaultNS)
-
-    sectionsList = []
-    for section in sections:
-        section_text = etree.tostring(section,
-                                      method="text",
-                                      encoding="unicode")
-        length = len(section_text)
-        logger.info("Section text length: {}".format(length))
-        header = getHeader(section, defaultNS)
-        enum = getEnum(section, defaultNS)
-        if (len(header) > 0 and len(enum) > 0):
-            section_meta = SectionMeta(billnumber_version=docId,
-                                       label=enum,
-                                       header=header,
-                                       section_id=getId(section),
-                                       length=length)
-        else:
-            section_meta = SectionMeta(billnumber_version=docId,
-                                       section_id=getId(section),
-                                       label=None,
-                                       header=None,
-                                       length=length)
-        sectionsList.append(
-            getSimilarSectionItem(queryText=section_text,
-                                  sectionMeta=section_meta))
-    return sectionsList
+def getSimilarSectionItems(
+        queryTexts: list[str],
+        sectionMetas: list[SectionMeta],
+        index: str = constants.INDEX_SECTIONS,
+        min_score: Optional[int] = None,
+        batch_size: int = constants.MSEARCH_BATCH_SIZE,
+        deadline: Optional[Deadline] = None) -> list[Section]:
+    """
+  Batched version of getSimilarSectionItem: queries for all of the texts with _msearch,
+  batch_size queries per request, and returns the Section items in the order of sectionMetas.
+  The queries stop, raising DeadlineExceeded, when the deadline expires.
+  Sections with near-duplicates in other bills are not queried with MINHASH_SHORTCIRCUIT (see isShortCircuited).
+  """
+    if len(queryTexts) != len(sectionMetas):
+        raise ValueError('queryTexts and sectionMetas must be the same length')
+    similarSectionsList = [
+        getNearDuplicateSections(queryText) for queryText in queryTexts
+    ]
+    # Query for the sections that are not short-circuited
+    toQuery = [
+        i for i in range(len(queryTexts)) if not isShortCircuited(
+            similarSectionsList[i], sectionMetas[i].billnumber_version)
+    ]
+    if isLocalBackend():
+        responses = local_index.moreLikeThisBatch(
+            [queryTexts[i] for i in toQuery],
+            index=index,
+            min_score=min_score,
+            deadline=deadline)
+    else:
+        responses = moreLikeThisBatch([queryTexts[i] for i in toQuery],
+                                      index=index,
+                                      min_score=getEsMinScore(min_score),
+                                      batch_size=batch_size,
+                                      deadline=deadline)
+    for i, res in zip(toQuery, responses):
+        similarSectionsList[i] = mergeNearDuplicates(
+            getSimilarSectionsFromResponse(res), similarSectionsList[i])
+    return [
+        Section(similar_sections=similar_sections,
+                billnumber_version=sectionMeta.billnumber_version,
+                section_id=sectionMeta.section_id,
+                label=sectionMeta.label,
+                header=sectionMeta.header,
+                length=sectionMeta.length)
+        for similar_sections, sectionMeta in zip(similarSectionsList,
+                                                 sectionMetas)
+    ]
+
+
+def getSimilarQuerySectionItems(
+        querySections: list[QuerySection],
+        index: str = constants.INDEX_SECTIONS,
+        min_score: Optional[int] = None,
+        batch_size: int = constants.MSEARCH_BATCH_SIZE,
+        deadline: Optional[Deadline] = None) -> list[Section]:
+    """
+  getSimilarSectionItems for QuerySection items. The texts of the sections (which may be read from the
+  section corpus) are materialized one batch of batch_size queries at a time.
+  """
+    if batch_size < 1:
+        raise ValueError('batch_size must be at least 1')
+    sections = []
+    for start in range(0, len(querySections), batch_size):
+        batch = querySections[start:start + batch_size]
+        sections.extend(
+            getSimilarSectionItems(
+                [querySection.getQueryText() for querySection in batch], [
+                    SectionMeta(
+                        billnumber_version=querySection.billnumber_version,
+                        section_id=querySection.section_id,
+                        label=querySection.label,
+                        header=querySection.header,
+                        length=querySection.length) for querySection in batch
+                ],
+                index=index,
+                min_score=min_score,
+                batch_size=batch_size,
+                deadline=deadline))
+    return sections
+
+
+def getDocQuerySections(filePath: str, docId: str) -> list[QuerySection]:
+    """
+  Parses the document and returns its sections as QuerySection items, ready to query.
+  This does not contact Elasticsearch, so it can run in a separate process.
+  """
+    return getParsedBillQuerySections(getParsedBill(filePath, withXml=False),
+                                      docId)
+
+
+def makeQuerySection(section: SectionRecord,
+                     docId: str,
+                     textRef=None) -> QuerySection:
+    """
+    The QuerySection of the section; with textRef (a section_store.SectionText), the text is not kept.
+    """
+    if (len(section.header) > 0 and len(section.enum) > 0):
+        label, header = section.enum, section.header
+    else:
+        label, header = None, None
+    return QuerySection(billnumber_version=docId,
+                        label=label,
+                        header=header,
+                        section_id=section.section_id,
+                        length=section.length,
+                        query_text=section.text if textRef is None else None,
+                        text_ref=textRef)
+
+
+def getParsedBillQuerySections(parsedBill: ParsedBill,
+                               docId: str) -> list[QuerySection]:
+    querySections = []
+    for section in parsedBill.sections:
+        logger.info("Section text length: {}".format(section.length))
+        querySections.append(makeQuerySection(section, docId))
+    return querySections
+
+
+def getCorpusQuerySections(
+        billnumber_version: str,
+        corpus: Optional[SectionCorpus] = None) -> Optional[list[QuerySection]]:
+    """
+    The QuerySection items of a bill in the section corpus (by default, that of the shared section store),
+    or None if the bill is not in the corpus. The sections refer to their texts in the corpus, which are
+    read when each query is made, so that the sections of many bills can be held at once.
+    """
+    if corpus is None:
+        corpus = getSectionCorpus()
+    sections = corpus.store.getSections(billnumber_version)
+    textRefs = corpus.getSectionTexts(billnumber_version)
+    if sections is None or textRefs is None or len(sections) != len(textRefs):
+        return None
+    return [
+        makeQuerySection(section, billnumber_version, textRef=textRef)
+        for section, textRef in zip(sections, textRefs)
+    ]
+
+
+def getSimilarDocSections(filePath: str,
+                          docId: str,
+                          deadline: Optional[Deadline] = None) -> list[Section]:
+    return getSimilarQuerySectionItems(getDocQuerySections(filePath=filePath,
+                                                           docId=docId),
+                                       deadline=deadline)
 
 
 def getSimilarBillSections(
         billnumber_version: str = None,
         bill_path: BillPath = None,
-        pathType: str = constants.PATHTYPE_DEFAULT) -> BillSections:
+        pathType: str = constants.PATHTYPE_DEFAULT,
+        deadline: Optional[Deadline] = None) -> BillSections:
     """
   Get similar sections for a bill.
   This function is a wrapper for getSimilarSectionItem and assumes a billnumber_version or BillPath 
@@ -123,6 +307,7 @@ def getSimilarBillSections(
   Args:
       billnumber_version (str): bill number and version.
       bill_path (BillPath): BillPath object, with billnumber_version and path 
+      deadline (Deadline): deadline of the queries for similar sections (optional)
   NOTE: Only one of billnumber_version and bill_path should be specified.
 
   Raises:
@@ -143,9 +328,10 @@ def getSimilarBillSections(
         else:
             raise Exception("bill_path or billnumber_version must be specified")
 
-    doc_length = getBillLengthbyPath(bill_path.filePath)
+    doc_length = getParsedBill(bill_path.filePath, withXml=False).length
     sectionsList = getSimilarDocSections(filePath=bill_path.filePath,
-                                         docId=bill_path.billnumber_version)
+                                         docId=bill_path.billnumber_version,
+                                         deadline=deadline)
 
     return BillSections(billnumber_version=bill_path.billnumber_version,
                         length=doc_length,
@@ -174,7 +360,7 @@ def getBillToBill(billsections: BillSections) -> dict:
                     similar_section.billnumber_version] = BillToBillModel(
                         billnumber_version=billsections.billnumber_version,
                         length=billsections.length,
-                        score_es=similar_section.score_es,
+                        score_es=similar_section.getScore(),
                         billnumber_version_to=billnumber_version,
                         sections_num=len(billsections.sections),
                         sections=[
@@ -194,9 +380,11 @@ def getBillToBill(billsections: BillSections) -> dict:
                             header=section.header,
                             length=section.length,
                             similar_sections=[similar_section]))
-                billToBills[
-                    similar_section.
-                    billnumber_version].score_es += similar_section.score_es
+                # The sum of the scores of the sections, as saved to SectionToSection
+                if similar_section.getScore() is not None:
+                    billToBill = billToBills[similar_section.billnumber_version]
+                    billToBill.score_es = (billToBill.score_es
+                                           or 0) + similar_section.getScore()
     for billToBillKey in billToBills:
         billToBills[billToBillKey].sections_match = len(
             billToBills[billToBillKey].sections)
@@ -207,15 +395,15 @@ def getBillToBill(billsections: BillSections) -> dict:
 # *****************************  Use ES document to get similar bills  ********
 # *****************************************************************************
 # Steps:
-# 1. Get bill by billnumber and version (utils_es.getBill_es)
-# 2. Convert es result to (utils_es.esSourceToQueryData)
+# 1. Get bill by billnumber and version and convert the es result to query sections
+#    (utils_es.getBillQueryData_es, with utils_es.getBill_es and utils_es.esSourceToQueryData)
 # 3. Get similar sections for each section in the bill (getSimilarSectionItemFromQuerySection)
 
 
 def getSimilarSectionItemFromQuerySection(
         querySection: QuerySection) -> Section:
     return getSimilarSectionItem(
-        queryText=querySection.query_text,
+        queryText=querySection.getQueryText(),
         sectionMeta=SectionMeta(
             billnumber_version=querySection.billnumber_version,
             section_id=querySection.section_id,
@@ -232,17 +420,17 @@ def getSimilarBillSections_es(billnumber_version: str = None) -> BillSections:
     version = bnv.get('version', '')
     logger.info(f"getSimilarBillSections_es for: {billnumber} {version} ")
     if billnumber and version:
-        bill = getBill_es(billnumber=billnumber, version=version)
-        if bill is None:
+        queryData = getBillQueryData_es(
+            billnumber,
+            version,
+            corpus=getSectionCorpus()
+            if constants.SECTION_STORE_ENABLED else None)
+        if queryData is None:
             raise Exception(f"Bill not found: {billnumber_version}")
-        billItem = bill[0]
-        return BillSections(
-            billnumber_version=billnumber_version,
-            length=billItem.get('length', 0),
-            sections=[
-                getSimilarSectionItemFromQuerySection(querySection)
-                for querySection in esSourceToQueryData(billItem)
-            ])
+        length, querySections = queryData
+        return BillSections(billnumber_version=billnumber_version,
+                            length=length,
+                            sections=getSimilarQuerySectionItems(querySections))
     else:
         raise Exception(
             f"billnumber_version is not of the correct form: {billnumber_version}"
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Async versions of the bill_similarity functions, for use in an async web service.
+Section queries run concurrently on the shared AsyncElasticsearch client (utils_es.getAsyncEsClient),
+with at most `concurrency` queries in flight per bill.
+Requires the async extra of the elasticsearch client (`pip install elasticsearch[async]`).
+
+>>> import asyncio
+>>> from billsim.bill_similarity_async import getSimilarBillSectionsAsync
+>>> s = asyncio.run(getSimilarBillSectionsAsync('116hr200ih'))
+"""
+
+import sys
+import asyncio
+import logging
+from typing import Optional
+
+from billsim import constants, local_index
+from billsim.pymodels import BillPath, BillSections, QuerySection, Section
+from billsim.bill_similarity import getEsMinScore, getNearDuplicateSections, getParsedBillQuerySections, getSimilarSectionsFromResponse, isLocalBackend, isShortCircuited, mergeNearDuplicates
+from billsim.utils import billNumberVersionToBillPath, getBillnumberversionParts, getParsedBill
+from billsim.utils_es import getBillQueryData_esAsync, moreLikeThisAsync
+from billsim.section_store import getSectionCorpus
+
+logger = logging.getLogger(constants.LOGGER_NAME)
+logger.addHandler(logging.StreamHandler(sys.stdout))
+
+
+async def getSimilarSectionItemAsync(
+        querySection: QuerySection,
+        semaphore: asyncio.Semaphore,
+        index: str = constants.INDEX_SECTIONS,
+        min_score: Optional[int] = None) -> Section:
+    queryText = querySection.getQueryText()
+    nearDuplicates = getNearDuplicateSections(queryText)
+    if isShortCircuited(nearDuplicates, querySection.billnumber_version):
+        return Section(similar_sections=nearDuplicates,
+                       billnumber_version=querySection.billnumber_version,
+                       section_id=querySection.section_id,
+                       label=querySection.label,
+                       header=querySection.header,
+                       length=querySection.length)
+    async with semaphore:
+        if isLocalBackend():
+            # The local index is in-process and CPU bound; query it in a thread
+            res = await asyncio.get_running_loop().run_in_executor(
+                None, local_index.moreLikeThis, queryText,
+                index, constants.SCORE_MODE_MAX, constants.MAX_BILLS_SECTION,
+                min_score)
+        else:
+            res = await moreLikeThisAsync(queryText,
+                                          index=index,
+                                          min_score=getEsMinScore(min_score))
+    return Section(similar_sections=mergeNearDuplicates(
+        getSimilarSectionsFromResponse(res), nearDuplicates),
+                   billnumber_version=querySection.billnumber_version,
+                   section_id=querySection.section_id,
+                   label=querySection.label,
+                   header=querySection.header,
+                   length=querySection.length)
+
+
+async def getSimilarQuerySectionItemsAsync(
+        querySections: list[QuerySection],
+        index: str = constants.INDEX_SECTIONS,
+        min_score: Optional[int] = None,
+        concurrency: int = constants.ES_ASYNC_CONCURRENCY) -> list[Section]:
+    """
+    Queries for similar sections of each of the querySections, with at most concurrency queries in flight.
+    Returns the Section items in the order of querySections.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    return list(await asyncio.gather(*[
+        getSimilarSectionItemAsync(
+            querySection, semaphore, index=index, min_score=min_score)
+        for querySection in querySections
+    ]))
+
+
+async def getSimilarBillSectionsAsync(
+        billnumber_version: str = None,
+        bill_path: BillPath = None,
+        pathType: str = constants.PATHTYPE_DEFAULT,
+        concurrency: int = constants.ES_ASYNC_CONCURRENCY) -> BillSections:
+    """
+  Async version of bill_similarity.getSimilarBillSections.
+  The bill is parsed in a thread, so that parsing does not block the event loop.
+
+  Args:
+      billnumber_version (str): bill number and version.
+      bill_path (BillPath): BillPath object, with billnumber_version and path
+      concurrency (int): maximum number of section queries in flight. Defaults to constants.ES_ASYNC_CONCURRENCY.
+  NOTE: Only one of billnumber_version and bill_path should be specified.
+
+  Raises:
+      Exception: exception upon incorrect args or upon parsing bill or opening the bill xml file
+
+  Returns:
+      BillSections: a BillSections object, with similar sections for the bill
+  """
+    if bill_path is not None and billnumber_version is not None and len(
+            billnumber_version) > 0 and billnumber_version.lower() != 'none':
+        raise Exception(
+            "bill_path and billnumber_version cannot be specified together")
+
+    if bill_path is None:
+        if billnumber_version is not None:
+            bill_path = billNumberVersionToBillPath(
+                billnumber_version=billnumber_version, pathType=pathType)
+        else:
+            raise Exception("bill_path or billnumber_version must be specified")
+
+    parsedBill = await asyncio.get_running_loop().run_in_executor(
+        None, getParsedBill, bill_path.filePath, False)
+    querySections = getParsedBillQuerySections(parsedBill,
+                                               bill_path.billnumber_version)
+    return BillSections(billnumber_version=bill_path.billnumber_version,
+                        length=parsedBill.length,
+                        sections=await getSimilarQuerySectionItemsAsync(
+                            querySections, concurrency=concurrency))
+
+
+async def getSimilarBillSections_esAsync(
+        billnumber_version: str = None,
+        concurrency: int = constants.ES_ASYNC_CONCURRENCY) -> BillSections:
+    """
+    Async version of bill_similarity.getSimilarBillSections_es
+    """
+    if billnumber_version is None:
+        raise Exception("billnumber_version must be specified")
+    bnv = getBillnumberversionParts(billnumber_version)
+    billnumber = bnv.get('billnumber', '')
+    version = bnv.get('version', '')
+    logger.info(f"getSimilarBillSections_esAsync for: {billnumber} {version} ")
+    if billnumber and version:
+        queryData = await getBillQueryData_esAsync(
+            billnumber,
+            version,
+            corpus=getSectionCorpus()
+            if constants.SECTION_STORE_ENABLED else None)
+        if queryData is None:
+            raise Exception(f"Bill not found: {billnumber_version}")
+        length, querySections = queryData
+        return BillSections(billnumber_version=billnumber_version,
+                            length=length,
+                            sections=await getSimilarQuerySectionItemsAsync(
+                                querySections, concurrency=concurrency))
+    else:
+        raise Exception(
+            f"billnumber_version is not of the correct form: {billnumber_version}"
+        )
@@ -1,53 +1,47 @@
 from re import T
 import sys
 import logging
-import subprocess
 import json
 import argparse
 import random
-from typing import List
+from typing import Iterable, List, Optional
 from billsim import pymodels
-from billsim.constants import LOGGER_NAME, COMPAREMATRIX_GO_CMD, TIMEOUT_SECONDS
-from billsim.utils import billNumberVersionToBillPath, getBillXmlPaths, getBillnumberversionParts
-from billsim.bill_similarity import getSimilarBillSections, getBillToBill
-from billsim.utils_db import save_bill_to_bill, save_bill_to_bill_sections
-from billsim.pymodels import BillToBillModel
+import os
+import threading
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from billsim.constants import LOGGER_NAME, COMPAREMATRIX_GO_CMD, TIMEOUT_SECONDS, TIMEOUT_SEARCH_SECONDS, TIMEOUT_SAVE_SECONDS, COMPARE_PARSE_WORKERS, COMPARE_IO_WORKERS, COMPARE_CHECKPOINT_PATH, COMPARE_REPORT_SECONDS, BILL_CATALOG_PATH
+from billsim.utils import billNumberVersionToBillPath, getBillnumberversionParts, iterBillXmlPaths, parseBill
+from billsim.bill_catalog import BillCatalog
+from billsim.compare_matrix import getCompareRow
+from billsim.database import session_scope, setStatementDeadline
+from billsim.deadline import Deadline, runProcess
+from billsim.bill_similarity import getSimilarBillSections, getBillToBill, getParsedBillQuerySections, getSimilarQuerySectionItems
+from billsim.utils_db import batch_save_bill_to_bill, batch_save_bill_to_bill_sections
+from billsim.pymodels import BillToBillModel, BillSections, QuerySection
+from sqlalchemy import exc
 
 #logging.basicConfig(filename='compare.log', filemode='w', level='INFO')
 logger = logging.getLogger(LOGGER_NAME)
 logger.addHandler(logging.StreamHandler(sys.stdout))
 logger.setLevel(logging.INFO)
 
-# See https://stackoverflow.com/a/63546765/628748
-# and https://stackoverflow.com/a/66515961/628748
-from contextlib import contextmanager
-import signal
 import time
 
 
-@contextmanager
-def timeout(duration):
-
-    def timeout_handler(signum, frame):
-        raise Exception(f'block timed out after {duration} seconds')
-
-    signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(duration)
-    yield
-    signal.alarm(0)
-
-
-def getCompareMatrix(billnumbers: list[str]) -> list[list]:
+def getCompareMatrixGo(billnumbers: list[str],
+                       deadline: Optional[Deadline] = None) -> list[list]:
+    # Calls comparematrix from bills (Golang), in a subprocess;
+    # kept to check the scores of compare_matrix.getCompareMatrix
     billPaths = [
         billNumberVersionToBillPath(billnumber).filePath
         for billnumber in billnumbers
     ]
     billPathsString = ",".join(billPaths)
     logger.debug(billPathsString)
-    result = subprocess.run(
-        [COMPAREMATRIX_GO_CMD, '-abspaths', billPathsString],
-        capture_output=True,
-        text=True)
+    # The process is killed if the deadline expires
+    result = runProcess([COMPAREMATRIX_GO_CMD, '-abspaths', billPathsString],
+                        deadline or Deadline(None, 'comparematrix'))
     logger.info(result.stdout)
     comparematrixContents = result.stdout.split(':compareMatrix:')
     if len(comparematrixContents) == 3 and comparematrixContents[1] != '':
@@ -62,37 +56,48 @@ def scoreBillToBills(billnumber_version: str,
                      similar_bills: list[str],
                      timeout_secs: int = TIMEOUT_SECONDS) -> list[str]:
     # Get similarity scores for bill-to-bill
-    # Calls comparematrix from bills (Golang);
+    # Computed in-process by compare_matrix.getCompareRow, from the bills' sections;
     # Saves bill-to-bill with scores for bill + similar bills
     # This function can be expanded, or replaced to use another scoring method (e.g. vector similarity)
+    # Scoring and saving the scores share one deadline; the scores are saved in one transaction,
+    # which is rolled back if the deadline expires
+    deadline = Deadline(timeout_secs, f'Scoring bill {billnumber_version}')
     try:
-        with timeout(timeout_secs):
-            c = getCompareMatrix(similar_bills)
+        # Only the row of the matrix where the 'from' bill is the bill to compare
+        row = getCompareRow(billnumber_version,
+                            similar_bills,
+                            deadline=deadline)
     except Exception as e:
         logger.error(
             f'Timed out getting Compare Matrix for bill {billnumber_version}: {e}'
         )
         return []
     try:
-        with timeout(timeout_secs):
-            for row in c:
-                for column in row:
-                    compare_bill, compare_bill_to = column[
-                        'ComparedDocs'].split('-')
-
-                    # Only stores the first row of the matrix
-                    # Where the 'from' bill is the bill to compare
-                    if compare_bill and compare_bill_to and compare_bill == billnumber_version:
-                        b2bModel = BillToBillModel(
-                            billnumber_version=compare_bill,
-                            billnumber_version_to=compare_bill_to,
-                            score=column['Score'],
-                            score_to=column['ScoreOther'],
-                            reasons=[
-                                reason.strip()
-                                for reason in column['Explanation'].split(', ')
-                            ])
-                        save_bill_to_bill(b2bModel)
+        b2bModels = []
+        for column in row:
+            compare_bill, compare_bill_to = column['ComparedDocs'].split('-')
+            if compare_bill and compare_bill_to:
+                # billnumber and version are used if a bill has to be saved (see batch_save_bill_to_bill)
+                bnv = getBillnumberversionParts(compare_bill)
+                bnv_to = getBillnumberversionParts(compare_bill_to)
+                b2bModels.append(
+                    BillToBillModel(
+                        billnumber_version=compare_bill,
+                        billnumber_version_to=compare_bill_to,
+                        billnumber=bnv['billnumber'],
+                        version=bnv['version'],
+                        billnumber_to=bnv_to['billnumber'],
+                        version_to=bnv_to['version'],
+                        score=column['Score'],
+                        score_to=column['ScoreOther'],
+                        reasons=[
+                            reason.strip()
+                            for reason in column['Explanation'].split(', ')
+                        ]))
+        deadline.check()
+        with session_scope() as db:
+            setStatementDeadline(db, deadline)
+            batch_save_bill_to_bill(b2bModels, db=db)
     except Exception as e:
         logger.error(
             f'Timed out processing bill-to-bill for bill {billnumber_version}: {e}'
@@ -103,7 +108,15 @@ def scoreBillToBills(billnumber_version: str,
 
 def processSimilarBills(billnumber_version: str,
                         timeout_secs: int = TIMEOUT_SECONDS,
-                        add_similarity_scores=False) -> list[str]:
+                        add_similarity_scores=False,
+                        search_timeout_secs: float = TIMEOUT_SEARCH_SECONDS,
+                        save_timeout_secs: float = TIMEOUT_SAVE_SECONDS) -> list[str]:
+    """
+    Finds, saves and (optionally) scores the similar bills of a bill. Each stage has its own deadline:
+    search_timeout_secs to find similar sections, save_timeout_secs to save them and timeout_secs to score
+    the similar bills. If scoring times out, the similar bills and sections that were saved are kept.
+    Works in any thread.
+    """
     logger.info(
         f'Processing similar bills for bill {billnumber_version} with timeout of {timeout_secs} seconds'
     )
@@ -116,47 +129,248 @@ def processSimilarBills(billnumber_version: str,
         return []
 
     try:
-        s = getSimilarBillSections(billnumber_version)
+        s = getSimilarBillSections(
+            billnumber_version,
+            deadline=Deadline(
+                search_timeout_secs,
+                f'Searching similar sections of {billnumber_version}'))
         b2b = getBillToBill(s)
     except Exception as e:
         logger.error(
-            f'Error getting similar bill sections for {billnumber_version}')
+            f'Error getting similar bill sections for {billnumber_version}: {e}')
         return []
-    for bill in b2b:
-        save_bill_to_bill(b2b[bill])
-        save_bill_to_bill_sections(b2b[bill])
+    return saveBillToBills(billnumber_version,
+                           b2b,
+                           timeout_secs=timeout_secs,
+                           add_similarity_scores=add_similarity_scores,
+                           save_timeout_secs=save_timeout_secs)
+
+
+def saveBillToBills(billnumber_version: str,
+                    b2b: dict,
+                    timeout_secs: int = TIMEOUT_SECONDS,
+                    add_similarity_scores=False,
+                    save_timeout_secs: float = TIMEOUT_SAVE_SECONDS) -> list[str]:
+    """
+    Saves the output of getBillToBill for a bill, in a single transaction, and, optionally, adds similarity scores.
+    The transaction is rolled back if it takes longer than save_timeout_secs. The similar bills are
+    returned (and stay saved) even if adding the scores fails or times out.
+
+    Raises:
+        DeadlineExceeded: if saving timed out
+
+    Returns:
+        list[str]: the billnumber_versions of the similar bills
+    """
+    deadline = Deadline(save_timeout_secs,
+                        f'Saving similar bills of {billnumber_version}')
+    try:
+        with session_scope() as db:
+            setStatementDeadline(db, deadline)
+            batch_save_bill_to_bill_sections(list(b2b.values()), db=db)
+    except exc.DBAPIError as e:
+        # The statement was cancelled by the server
+        if deadline.expired():
+            raise deadline.getError() from e
+        raise
     similar_bills = list(b2b.keys())
 
     if add_similarity_scores:
-        similar_bills = scoreBillToBills(billnumber_version,
-                                         similar_bills=similar_bills,
-                                         timeout_secs=timeout_secs)
+        scoreBillToBills(billnumber_version,
+                         similar_bills=similar_bills,
+                         timeout_secs=timeout_secs)
     return similar_bills
 
 
-def compareBills(maxBills: int = -1):
+def getBillQuerySections(
+        billPath: pymodels.BillPath) -> tuple[int, list[QuerySection]]:
+    """
+    Parses the bill XML and returns the bill length and its query sections.
+    Runs in the parsing process pool of compareBills. Each bill is parsed once, so the bill cache is not used.
+    """
+    parsedBill = parseBill(billPath.filePath, withXml=False)
+    return parsedBill.length, getParsedBillQuerySections(
+        parsedBill, docId=billPath.billnumber_version)
+
+
+def processQuerySections(billnumber_version: str,
+                         length: int,
+                         querySections: list[QuerySection],
+                         timeout_secs: int = TIMEOUT_SECONDS,
+                         add_similarity_scores=False,
+                         search_timeout_secs: float = TIMEOUT_SEARCH_SECONDS,
+                         save_timeout_secs: float = TIMEOUT_SAVE_SECONDS
+                        ) -> tuple[str, list[str]]:
+    """
+    Queries for similar sections of an already parsed bill and saves the results, with the stage deadlines
+    of processSimilarBills.
+    Runs in the I/O thread pool of compareBills; unlike processSimilarBills, errors (including DeadlineExceeded)
+    are raised so that they are counted as failures.
+
+    Returns:
+        tuple[str, list[str]]: the name of the worker thread and the similar bills
+    """
+    s = BillSections(billnumber_version=billnumber_version,
+                     length=length,
+                     sections=getSimilarQuerySectionItems(
+                         querySections,
+                         deadline=Deadline(
+                             search_timeout_secs,
+                             f'Searching similar sections of {billnumber_version}'
+                         )))
+    similar_bills = saveBillToBills(billnumber_version,
+                                    getBillToBill(s),
+                                    timeout_secs=timeout_secs,
+                                    add_similarity_scores=add_similarity_scores,
+                                    save_timeout_secs=save_timeout_secs)
+    return threading.current_thread().name, similar_bills
+
+
+def readCheckpoint(checkpoint_path: str) -> set[str]:
+    """
+    Returns the billnumber_versions recorded in the checkpoint file, one per line.
+    """
+    if not os.path.isfile(checkpoint_path):
+        return set()
+    with open(checkpoint_path, 'r') as f:
+        return set(line.strip() for line in f if line.strip())
+
+
+class CompareProgress:
+    """
+    Counts processed and failed bills, overall and per worker, and logs throughput
+    at most every report_secs seconds.
+    """
+
+    def __init__(self,
+                 total: Optional[int],
+                 report_secs: int = COMPARE_REPORT_SECONDS):
+        self.total = total
+        self.report_secs = report_secs
+        self.start_time = time.time()
+        self.last_report = self.start_time
+        self.processed = 0
+        self.failed = 0
+        self.by_worker = Counter()
+
+    def success(self, worker: str):
+        self.processed += 1
+        self.by_worker[worker] += 1
+
+    def failure(self):
+        self.failed += 1
+
+    def report(self, force=False):
+        now = time.time()
+        if not force and now - self.last_report < self.report_secs:
+            return
+        self.last_report = now
+        elapsed = now - self.start_time
+        done = self.processed + self.failed
+        rate = done / elapsed if elapsed > 0 else 0
+        # The total is not known while the bills are being found
+        total = '' if self.total is None else f'/{self.total}'
+        logger.info(
+            f'Processed {self.processed}{total} bills ({self.failed} failed) in {elapsed:.0f}s; {rate:.2f} bills/s'
+        )
+        logger.info(f'Bills per worker: {dict(self.by_worker)}')
+
+
+def compareBills(maxBills: int = -1,
+                 parse_workers: int = COMPARE_PARSE_WORKERS,
+                 io_workers: int = COMPARE_IO_WORKERS,
+                 checkpoint_path: str = COMPARE_CHECKPOINT_PATH,
+                 resume: bool = True,
+                 timeout_secs: int = TIMEOUT_SECONDS,
+                 add_similarity_scores=False,
+                 search_timeout_secs: float = TIMEOUT_SEARCH_SECONDS,
+                 save_timeout_secs: float = TIMEOUT_SAVE_SECONDS,
+                 billPaths: Optional[Iterable[pymodels.BillPath]] = None):
+    """
+    Finds and saves similar bills for all bills in the data directory, or for billPaths
+    (e.g. from bill_catalog.BillCatalog.iterBillPaths, so that the data directory is not scanned).
+    Bill XML is parsed in a pool of parse_workers processes; the Elasticsearch queries and
+    database saves run in a pool of io_workers threads.
+    Each completed billnumber_version is appended to checkpoint_path; with resume=True,
+    bills already in the checkpoint are skipped.
+    Unless maxBills bills are sampled, billPaths are consumed as they are found, so that comparison starts
+    while the data directory is being scanned.
+    """
     start_time = time.time()
-    billPaths = getBillXmlPaths()
+    billPaths = iterBillXmlPaths() if billPaths is None else billPaths
+    total = None
     if maxBills > 0:
-        billPaths = random.sample(billPaths, maxBills)
+        billPaths = list(billPaths)
+        billPaths = random.sample(billPaths, min(maxBills, len(billPaths)))
+        total = len(billPaths)
         logger.info(f'Sampled {len(billPaths)} bills to process')
-    else:
-        maxBills = len(billPaths)
-    for i, billPath in enumerate(billPaths):
-        if i % 100 == 0:
-            logger.info(f'Processed {i} bills')
-        try:
-            similar_bills = processSimilarBills(billPath.billnumber_version)
-            logger.debug(
-                f'{billPath.billnumber_version} has {len(similar_bills)} similar bills: {similar_bills}'
-            )
-        except Exception as e:
-            logger.error(
-                f'Error processing similarbills for bill {billPath.billnumber_version}: {e}'
-            )
+    completed = set()
+    if resume:
+        completed = readCheckpoint(checkpoint_path)
+        logger.info(
+            f'Skipping {len(completed)} bills in checkpoint {checkpoint_path}')
+        if total is not None:
+            total -= sum(1 for billPath in billPaths
+                         if billPath.billnumber_version in completed)
+    progress = CompareProgress(total=total)
+
+    billPathsIter = (billPath for billPath in billPaths
+                     if billPath.billnumber_version not in completed)
+    # Bounds the number of parsed bills waiting for I/O
+    max_in_flight = parse_workers + 2 * io_workers
+    in_flight = {}
+    with ProcessPoolExecutor(max_workers=parse_workers) as parse_pool, \
+            ThreadPoolExecutor(max_workers=io_workers,
+                               thread_name_prefix='compare-io') as io_pool, \
+            open(checkpoint_path, 'a') as checkpoint:
+
+        def submitParse():
+            while len(in_flight) < max_in_flight:
+                billPath = next(billPathsIter, None)
+                if billPath is None:
+                    return
+                in_flight[parse_pool.submit(getBillQuerySections,
+                                            billPath)] = ('parse', billPath)
+
+        submitParse()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, billPath = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    progress.failure()
+                    logger.error(
+                        f'Error processing similarbills for bill {billPath.billnumber_version} ({stage}): {e}'
+                    )
+                    continue
+                if stage == 'parse':
+                    length, querySections = result
+                    in_flight[io_pool.submit(
+                        processQuerySections,
+                        billPath.billnumber_version,
+                        length,
+                        querySections,
+                        timeout_secs=timeout_secs,
+                        add_similarity_scores=add_similarity_scores,
+                        search_timeout_secs=search_timeout_secs,
+                        save_timeout_secs=save_timeout_secs)] = (
+                            'io', billPath)
+                else:
+                    worker, similar_bills = result
+                    logger.debug(
+                        f'{billPath.billnumber_version} has {len(similar_bills)} similar bills: {similar_bills}'
+                    )
+                    checkpoint.write(billPath.billnumber_version + '\n')
+                    checkpoint.flush()
+                    progress.success(worker)
+            submitParse()
+            progress.report()
+    progress.report(force=True)
     end_time = time.time()
     logger.info("It took {0} seconds to process {1} bills.".format(
-        end_time - start_time, maxBills))
+        end_time - start_time, progress.processed))
 
 
 if __name__ == "__main__":
@@ -167,5 +381,40 @@ if __name__ == "__main__":
                         type=int,
                         help='max number of bills to compare')
 
+    parser.add_argument('--parse-workers',
+                        type=int,
+                        default=COMPARE_PARSE_WORKERS,
+                        help='number of processes to parse bill XML')
+    parser.add_argument('--io-workers',
+                        type=int,
+                        default=COMPARE_IO_WORKERS,
+                        help='number of threads for Elasticsearch and db I/O')
+    parser.add_argument('--checkpoint',
+                        default=COMPARE_CHECKPOINT_PATH,
+                        help='path to the checkpoint of compared bills')
+    parser.add_argument('--no-resume',
+                        action='store_true',
+                        help='process bills already in the checkpoint')
+    parser.add_argument('--catalog',
+                        nargs='?',
+                        const=BILL_CATALOG_PATH,
+                        default=None,
+                        help='get the bills from the bill catalog (default path: BILL_CATALOG_PATH), instead of scanning the data directory')
+    parser.add_argument('--congress',
+                        type=int,
+                        nargs='+',
+                        default=None,
+                        help='the congresses of the bills to compare (default: all)')
+
     args = parser.parse_args()
-    compareBills(maxBills=args.max)
+    if args.catalog:
+        billPaths = BillCatalog(args.catalog).iterBillPaths(
+            congresses=args.congress)
+    else:
+        billPaths = iterBillXmlPaths(congresses=args.congress)
+    compareBills(maxBills=args.max,
+                 parse_workers=args.parse_workers,
+                 io_workers=args.io_workers,
+                 checkpoint_path=args.checkpoint,
+                 resume=not args.no_resume,
+                 billPaths=billPaths)
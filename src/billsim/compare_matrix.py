@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Bill-to-bill scores, computed in-process from the section records of the bills.
+Replaces the `comparematrix` executable (from the Golang bills repo), and returns a matrix of the same form,
+one row per bill, with cells of the form:
+
+{'Score': 0.86, 'ScoreOther': 0.86, 'Explanation': 'bills-nearly_identical', 'ComparedDocs': '116hr222ih-115hr198ih'}
+
+Each bill is represented by the set of hashes of the word n-grams (COMPARE_NGRAM_SIZE words) of its sections.
+For bills A and B, Score is the share of the n-grams of A that are found in B, and ScoreOther the share of the
+n-grams of B that are found in A. So A 'incorporates' B when most of B is found in A.
+
+scoreBillToBills only needs the row of the bill it scores; getCompareRow computes that row alone, scoring
+the similar bills in parallel. The scores of each pair are kept in PAIR_CACHE, so that when the similar bill
+is scored in turn, the pair is not compared again.
+
+>>> from billsim.compare_matrix import getCompareMatrix
+>>> c = getCompareMatrix(['116hr222ih', '115hr198ih'])
+>>> c[0][1]
+{'Score': 0.86, 'ScoreOther': 0.86, 'Explanation': 'bills-nearly_identical', 'ComparedDocs': '116hr222ih-115hr198ih'}
+"""
+
+import os
+import sys
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from functools import lru_cache
+from typing import Iterable, Optional
+
+import numpy as np
+
+from billsim import constants
+from billsim.deadline import Deadline, DeadlineExceeded
+from billsim.local_index import tokenize
+from billsim.utils import billNumberVersionToBillPath, getParsedBill
+
+logger = logging.getLogger(constants.LOGGER_NAME)
+logger.addHandler(logging.StreamHandler(sys.stdout))
+
+# Multiplier of the polynomial hash of an n-gram (the 64-bit FNV prime); arithmetic wraps at 2^64
+NGRAM_MULTIPLIER = np.uint64(0x100000001B3)
+
+
+@lru_cache(maxsize=2**20)
+def getTokenHash(token: str) -> int:
+    """
+    A 64-bit hash of the token that is the same in every process (unlike the builtin hash of a str).
+    """
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'),
+                                          digest_size=8).digest(),
+                          byteorder='little')
+
+
+def getNgramHashes(text: str,
+                   ngram_size: int = constants.COMPARE_NGRAM_SIZE):
+    """
+    Returns the hashes (numpy uint64 array) of the word n-grams of the text, in order.
+    A text with fewer than ngram_size words has a single n-gram of all of its words.
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return np.empty(0, dtype=np.uint64)
+    tokenHashes = np.fromiter((getTokenHash(token) for token in tokens),
+                              dtype=np.uint64,
+                              count=len(tokens))
+    size = min(ngram_size, len(tokens))
+    count = len(tokens) - size + 1
+    hashes = tokenHashes[:count].copy()
+    for offset in range(1, size):
+        hashes = hashes * NGRAM_MULTIPLIER + tokenHashes[offset:offset + count]
+    return hashes
+
+
+def getShingleSet(texts: Iterable[str],
+                  ngram_size: int = constants.COMPARE_NGRAM_SIZE):
+    """
+    Returns the sorted, unique n-gram hashes of the texts (n-grams do not cross from one text to the next).
+    """
+    hashes = [getNgramHashes(text, ngram_size) for text in texts]
+    if not hashes:
+        return np.empty(0, dtype=np.uint64)
+    return np.unique(np.concatenate(hashes))
+
+
+def getBillShingles(billnumber_version: str,
+                    ngram_size: int = constants.COMPARE_NGRAM_SIZE):
+    """
+    Returns the n-gram hashes of the sections of the bill, using the bill cache.
+    A bill without sections is represented by its full text.
+    """
+    filePath = billNumberVersionToBillPath(billnumber_version).filePath
+    parsedBill = getParsedBill(filePath, withXml=False)
+    if parsedBill.sections:
+        return getShingleSet((section.text for section in parsedBill.sections),
+                             ngram_size)
+    parsedBill = getParsedBill(filePath, withXml=False, withText=True)
+    return getShingleSet([parsedBill.text or ''], ngram_size)
+
+
+def compareShingles(shingles, shinglesOther) -> tuple[float, float]:
+    """
+    Returns the share of shingles found in shinglesOther, and of shinglesOther found in shingles.
+    Both are sorted and unique, as returned by getShingleSet.
+    """
+    if shingles.size == 0 or shinglesOther.size == 0:
+        return 0.0, 0.0
+    common = np.intersect1d(shingles, shinglesOther, assume_unique=True).size
+    return common / shingles.size, common / shinglesOther.size
+
+
+def getExplanation(score: float, scoreOther: float) -> str:
+    if score >= constants.COMPARE_IDENTICAL_SCORE and scoreOther >= constants.COMPARE_IDENTICAL_SCORE:
+        return constants.EXPLANATION_IDENTICAL
+    if score >= constants.COMPARE_NEARLY_IDENTICAL_SCORE and scoreOther >= constants.COMPARE_NEARLY_IDENTICAL_SCORE:
+        return constants.EXPLANATION_NEARLY_IDENTICAL
+    if scoreOther >= constants.COMPARE_INCORPORATES_SCORE:
+        return constants.EXPLANATION_INCORPORATES
+    if score >= constants.COMPARE_INCORPORATES_SCORE:
+        return constants.EXPLANATION_INCORPORATED_BY
+    if max(score, scoreOther) >= constants.COMPARE_SOME_SIMILARITY_SCORE:
+        return constants.EXPLANATION_SOME_SIMILARITY
+    return constants.EXPLANATION_UNRELATED
+
+
+def getComparison(billnumber_version: str, billnumber_version_other: str,
+                  score: float, scoreOther: float) -> dict:
+    score = round(score, 2)
+    scoreOther = round(scoreOther, 2)
+    return {
+        'Score': score,
+        'ScoreOther': scoreOther,
+        'Explanation': getExplanation(score, scoreOther),
+        'ComparedDocs': f'{billnumber_version}-{billnumber_version_other}'
+    }
+
+
+def getCompareMatrixFromShingles(billnumbers: list[str],
+                                 shingles: list) -> list[list[dict]]:
+    """
+    Compares each pair of bills once; the cell of (B, A) is that of (A, B) with the scores swapped.
+    """
+    matrix = [[None] * len(billnumbers) for _ in billnumbers]
+    for i, billnumber in enumerate(billnumbers):
+        for j in range(i, len(billnumbers)):
+            score, scoreOther = compareShingles(shingles[i], shingles[j])
+            matrix[i][j] = getComparison(billnumber, billnumbers[j], score,
+                                         scoreOther)
+            if j != i:
+                matrix[j][i] = getComparison(billnumbers[j], billnumber,
+                                             scoreOther, score)
+    return matrix
+
+
+def getCompareMatrix(
+        billnumbers: list[str],
+        ngram_size: int = constants.COMPARE_NGRAM_SIZE) -> list[list[dict]]:
+    """
+    Returns the matrix of comparisons of the bills, in the form returned by `comparematrix`.
+    A bill whose XML cannot be read has no n-grams, so it is 'unrelated' to the others.
+    """
+    shingles = []
+    for billnumber in billnumbers:
+        try:
+            shingles.append(getBillShingles(billnumber, ngram_size))
+        except Exception as e:
+            logger.warning(f'Could not read {billnumber} to compare: {e}')
+            shingles.append(np.empty(0, dtype=np.uint64))
+    return getCompareMatrixFromShingles(billnumbers, shingles)
+
+
+class PairCache:
+    """
+    Thread-safe LRU cache of the (Score, ScoreOther) of pairs of bills, keyed by the getBillKey of each bill.
+    A pair is found in either direction, with the scores swapped for the reverse direction.
+    """
+
+    def __init__(self, max_items: int = constants.COMPARE_PAIR_CACHE_SIZE):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple,
+            keyOther: tuple) -> Optional[tuple[float, float]]:
+        with self._lock:
+            scores = self._items.get((key, keyOther))
+            if scores is not None:
+                self._items.move_to_end((key, keyOther))
+                return scores
+            scores = self._items.get((keyOther, key))
+            if scores is not None:
+                self._items.move_to_end((keyOther, key))
+                return scores[1], scores[0]
+        return None
+
+    def put(self, key: tuple, keyOther: tuple, scores: tuple[float, float]):
+        with self._lock:
+            self._items[(key, keyOther)] = scores
+            self._items.move_to_end((key, keyOther))
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+PAIR_CACHE = PairCache()
+
+
+def getBillKey(billnumber_version: str,
+               ngram_size: int = constants.COMPARE_NGRAM_SIZE) -> tuple:
+    """
+    Identifies the version of the bill file that was scored, so that a cached pair is not used
+    once either bill file has changed.
+    """
+    filePath = billNumberVersionToBillPath(billnumber_version).filePath
+    return (billnumber_version, os.stat(filePath).st_mtime, ngram_size)
+
+
+def getCompareRow(billnumber_version: str,
+                  billnumbers: list[str],
+                  ngram_size: int = constants.COMPARE_NGRAM_SIZE,
+                  workers: int = constants.COMPARE_SCORE_WORKERS,
+                  cache: PairCache = PAIR_CACHE,
+                  deadline: Optional[Deadline] = None) -> list[dict]:
+    """
+    Returns the row of the compare matrix for billnumber_version: its comparison to each of billnumbers,
+    in order, in the form of the cells of getCompareMatrix.
+    The similar bills are read and compared in a pool of worker threads; pairs found in the cache
+    (in either direction) are not compared again.
+    A bill whose XML cannot be read is 'unrelated', and is not cached.
+
+    Raises:
+        DeadlineExceeded: if the deadline expires before the row is complete; pairs already compared are cached
+    """
+    try:
+        key = getBillKey(billnumber_version, ngram_size)
+        shingles = getBillShingles(billnumber_version, ngram_size)
+    except Exception as e:
+        logger.warning(f'Could not read {billnumber_version} to compare: {e}')
+        key = None
+        shingles = np.empty(0, dtype=np.uint64)
+
+    def scorePair(billnumber_version_other: str) -> tuple[float, float]:
+        if deadline is not None:
+            deadline.check()
+        if billnumber_version_other == billnumber_version:
+            return compareShingles(shingles, shingles)
+        if key is None:
+            return 0.0, 0.0
+        keyOther = getBillKey(billnumber_version_other, ngram_size)
+        scores = cache.get(key, keyOther)
+        if scores is None:
+            scores = compareShingles(
+                shingles, getBillShingles(billnumber_version_other,
+                                          ngram_size))
+            cache.put(key, keyOther, scores)
+        return scores
+
+    row = []
+    with ThreadPoolExecutor(max_workers=workers,
+                            thread_name_prefix='compare-score') as executor:
+        futures = [
+            executor.submit(scorePair, billnumber_version_other)
+            for billnumber_version_other in billnumbers
+        ]
+        for billnumber_version_other, future in zip(billnumbers, futures):
+            try:
+                score, scoreOther = future.result(
+                    timeout=None if deadline is None else deadline.remaining())
+            except (DeadlineExceeded, FuturesTimeoutError):
+                for pending in futures:
+                    pending.cancel()
+                raise deadline.getError() from None
+            except Exception as e:
+                logger.warning(
+                    f'Could not read {billnumber_version_other} to compare: {e}'
+                )
+                score, scoreOther = 0.0, 0.0
+            row.append(
+                getComparison(billnumber_version, billnumber_version_other,
+                              score, scoreOther))
+    return row
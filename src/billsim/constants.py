@@ -13,7 +13,11 @@ from dotenv import load_dotenv
 load_dotenv()
 
 LOGGER_NAME = 'billsim'
+# Per-stage deadlines of compare: scoring similar bills (TIMEOUT_SECONDS), searching for similar sections,
+# and saving the similar bills and sections
 TIMEOUT_SECONDS = 300
+TIMEOUT_SEARCH_SECONDS = float(os.getenv('TIMEOUT_SEARCH_SECONDS', default=300))
+TIMEOUT_SAVE_SECONDS = float(os.getenv('TIMEOUT_SAVE_SECONDS', default=120))
 PATHTYPE_DEFAULT = os.getenv('PATHTYPE_DEFAULT', default='congressdotgov')
 
 PATH_TO_DATA_DIR = os.getenv(
@@ -36,6 +40,26 @@ NAMESPACE_DC = 'http://purl.org/dc/elements/1.1/'
 NAMESPACE_USLM = 'http://xml.house.gov/schemas/uslm/1.0'
 NAMESPACE_USLM2 = 'http://schemas.gpo.gov/xml/uslm'
 
+# Elasticsearch client (utils_es.getEsClient)
+# ES_HOSTS is a comma-separated list of hosts, e.g. 'es1:9200,es2:9200'
+ES_HOSTS = [
+    host.strip()
+    for host in os.getenv('ES_HOSTS', default='localhost:9200').split(',')
+    if host.strip()
+]
+# Connections kept open per node
+ES_MAXSIZE = int(os.getenv('ES_MAXSIZE', default=25))
+# Per-request timeout, in seconds
+ES_TIMEOUT = float(os.getenv('ES_TIMEOUT', default=30))
+ES_MAX_RETRIES = int(os.getenv('ES_MAX_RETRIES', default=3))
+ES_RETRY_ON_STATUS = (429, 502, 503, 504)
+# Seconds to wait before the first retry; doubled for each following retry, up to ES_RETRY_BACKOFF_MAX
+ES_RETRY_BACKOFF = float(os.getenv('ES_RETRY_BACKOFF', default=0.5))
+ES_RETRY_BACKOFF_MAX = float(os.getenv('ES_RETRY_BACKOFF_MAX', default=30))
+ES_SNIFF = os.getenv('ES_SNIFF', default='false').lower() in ('1', 'true', 'yes')
+# Maximum number of section queries in flight per bill in bill_similarity_async
+ES_ASYNC_CONCURRENCY = int(os.getenv('ES_ASYNC_CONCURRENCY', default=10))
+
 # Names of elasticsearch indices
 INDEX_SECTIONS = os.getenv('INDEX_SECTIONS', default='billsim')
 INDEX_BILL_FULL = os.getenv('INDEX_BILL_FULL', default='bill_full')
@@ -47,15 +71,105 @@ SCORE_MODE_SUM = 'sum'
 # largest number of results for a query of sections
 MAX_BILLS_SECTION = int(os.getenv('MAX_BILLS_SECTIONS', default=100))
 
+# number of section queries packed into one _msearch request
+MSEARCH_BATCH_SIZE = int(os.getenv('MSEARCH_BATCH_SIZE', default=50))
+
+# Bulk indexing (elastic_load.bulkIndexBills)
+INDEX_WORKERS = int(os.getenv('INDEX_WORKERS', default=os.cpu_count() or 1))
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', default=200))
+BULK_MAX_CHUNK_BYTES = int(
+    os.getenv('BULK_MAX_CHUNK_BYTES', default=50 * 1024 * 1024))
+BULK_THREAD_COUNT = int(os.getenv('BULK_THREAD_COUNT', default=4))
+
 BILLMETA_GO_CMD = 'billmeta'
 ESQUERY_GO_CMD = 'esquery'
 
 # NOTE: This requires installing `comparematrix` on the path
 COMPAREMATRIX_GO_CMD = 'comparematrix'
 
+# Bill-to-bill scores (compare_matrix): word n-grams of the bills' sections
+COMPARE_NGRAM_SIZE = int(os.getenv('COMPARE_NGRAM_SIZE', default=4))
+# Minimum scores (shares of n-grams in common) for each explanation
+COMPARE_IDENTICAL_SCORE = 0.99
+COMPARE_NEARLY_IDENTICAL_SCORE = 0.85
+COMPARE_INCORPORATES_SCORE = 0.8
+COMPARE_SOME_SIMILARITY_SCORE = 0.1
+# Threads that score the similar bills of a bill (compare_matrix.getCompareRow)
+COMPARE_SCORE_WORKERS = int(os.getenv('COMPARE_SCORE_WORKERS', default=4))
+# Scores of pairs of bills kept in memory, so that a pair is scored once for both directions
+COMPARE_PAIR_CACHE_SIZE = int(
+    os.getenv('COMPARE_PAIR_CACHE_SIZE', default=100000))
+EXPLANATION_IDENTICAL = 'bills-identical'
+EXPLANATION_NEARLY_IDENTICAL = 'bills-nearly_identical'
+EXPLANATION_INCORPORATES = 'bills-incorporates'
+EXPLANATION_INCORPORATED_BY = 'bills-incorporated_by'
+EXPLANATION_SOME_SIMILARITY = 'bills-some_similarity'
+EXPLANATION_UNRELATED = 'bills-unrelated'
+
+# Parallel compare.compareBills: processes parse bill XML, threads run ES and DB I/O
+COMPARE_PARSE_WORKERS = int(
+    os.getenv('COMPARE_PARSE_WORKERS', default=os.cpu_count() or 1))
+COMPARE_IO_WORKERS = int(os.getenv('COMPARE_IO_WORKERS', default=8))
+# billnumber_versions already compared, one per line; used to resume an interrupted run
+COMPARE_CHECKPOINT_PATH = os.getenv('COMPARE_CHECKPOINT_PATH',
+                                    default=os.path.join(
+                                        PATH_TO_DATA_DIR,
+                                        'compare_checkpoint.txt'))
+COMPARE_REPORT_SECONDS = 60
+
+# Corpus mode (corpus_similarity): all-pairs section similarity with sparse matrix products
+# Sections (rows) multiplied at a time
+CORPUS_BLOCK_SIZE = int(os.getenv('CORPUS_BLOCK_SIZE', default=2000))
+# Minimum cosine similarity of two sections
+CORPUS_MIN_SCORE = float(os.getenv('CORPUS_MIN_SCORE', default=0.5))
+# Terms in more than this fraction of the sections are ignored
+CORPUS_MAX_DF = float(os.getenv('CORPUS_MAX_DF', default=0.5))
+
 RESULTS_DEFAULT = 20
 MIN_SCORE_DEFAULT = 25
 
+# more_like_this parameters of the section queries (SAMPLE_QUERY_NESTED_MLT and local_index)
+MLT_MIN_TERM_FREQ = 2
+MLT_MAX_QUERY_TERMS = 30
+MLT_MIN_DOC_FREQ = 2
+
+# Backend for the section queries of bill_similarity:
+# 'es' (Elasticsearch) or 'local' (the in-process index of local_index, saved at LOCAL_INDEX_PATH)
+SIMILARITY_BACKEND_ES = 'es'
+SIMILARITY_BACKEND_LOCAL = 'local'
+SIMILARITY_BACKEND = os.getenv('SIMILARITY_BACKEND',
+                               default=SIMILARITY_BACKEND_ES).lower()
+LOCAL_INDEX_PATH = os.getenv('LOCAL_INDEX_PATH',
+                             default=os.path.join(PATH_TO_DATA_DIR,
+                                                  'local_index.pickle'))
+# Default min_score of the local index, as a fraction of the score of a section identical to the query text.
+# Sections copied from another version of a bill score ~0.9 or more; unrelated sections mostly below 0.5.
+LOCAL_MIN_SCORE_RATIO = float(os.getenv('LOCAL_MIN_SCORE_RATIO', default=0.5))
+
+# MinHash/LSH index of near-duplicate sections (minhash_index)
+# MINHASH_ENABLED: keep the index up to date when bills are indexed (elastic_load); requires numpy
+MINHASH_ENABLED = os.getenv('MINHASH_ENABLED',
+                            default='false').lower() in ('1', 'true', 'yes')
+# MINHASH_MERGE: add the near-duplicates of a section, from the index, to the results of its query in bill_similarity
+MINHASH_MERGE = os.getenv('MINHASH_MERGE',
+                          default='false').lower() in ('1', 'true', 'yes')
+# MINHASH_SHORTCIRCUIT: do not query for a section that has a near-duplicate in another bill; its near-duplicates
+# are its results. Other sections are queried, and their near-duplicates merged, as with MINHASH_MERGE
+MINHASH_SHORTCIRCUIT = os.getenv('MINHASH_SHORTCIRCUIT',
+                                 default='false').lower() in ('1', 'true',
+                                                              'yes')
+MINHASH_INDEX_PATH = os.getenv('MINHASH_INDEX_PATH',
+                               default=os.path.join(PATH_TO_DATA_DIR,
+                                                    'minhash_index.pickle'))
+MINHASH_NUM_PERM = 128
+# LSH bands of MINHASH_NUM_PERM / MINHASH_BANDS rows; 16 bands of 8 rows find pairs with Jaccard similarity above ~0.7
+MINHASH_BANDS = 16
+# Words per shingle
+MINHASH_SHINGLE_SIZE = 5
+MINHASH_SEED = 1
+# Minimum (estimated) Jaccard similarity of the shingles of near-duplicate sections
+MINHASH_THRESHOLD = float(os.getenv('MINHASH_THRESHOLD', default=0.8))
+
 try:
     BILLSECTION_MAPPING = json.loads(
         pkgutil.get_data(__name__, PATH_BILLSECTIONS_JSON).decode("utf-8"))
@@ -69,6 +183,34 @@ except Exception as err:
     with open(PATH_BILL_FULL_JSON, 'r') as f:
         BILL_FULL_MAPPING = json.load(f)
 
+# Threads that list directories in parallel, in utils.iterBillDirs (most of the time is spent waiting on the file system)
+SCAN_WORKERS = int(os.getenv('SCAN_WORKERS', default=16))
+# Maximum memory (approximate) held by the cache of parsed bills (utils.getParsedBill)
+BILL_CACHE_MAX_BYTES = int(
+    os.getenv('BILL_CACHE_MAX_BYTES', default=512 * 1024 * 1024))
+# Bill files of at least this size are parsed as a stream (utils.parseBill), without the tree of the whole bill
+PARSE_STREAM_MIN_BYTES = int(
+    os.getenv('PARSE_STREAM_MIN_BYTES', default=2 * 1024 * 1024))
+
+# Record of indexed bill files (path, size, mtime, hash), used by elastic_load.updateBillSectionsIndex
+INDEX_MANIFEST_PATH = os.getenv('INDEX_MANIFEST_PATH',
+                                default=os.path.join(PATH_TO_DATA_DIR,
+                                                     'index_manifest.json'))
+
+# SQLite catalog of bill files (billnumber_version, path, size, mtime, Congress, bill type), see bill_catalog
+BILL_CATALOG_PATH = os.getenv('BILL_CATALOG_PATH',
+                              default=os.path.join(PATH_TO_DATA_DIR,
+                                                   'bill_catalog.sqlite'))
+
+# On-disk store of the extracted sections of bills, one directory per Congress (see section_store)
+# SECTION_STORE_ENABLED: add the sections of each bill to the store when it is indexed (elastic_load)
+SECTION_STORE_ENABLED = os.getenv('SECTION_STORE_ENABLED',
+                                  default='false').lower() in ('1', 'true',
+                                                               'yes')
+SECTION_STORE_PATH = os.getenv('SECTION_STORE_PATH',
+                               default=os.path.join(PATH_TO_DATA_DIR,
+                                                    'section_store'))
+
 #PATH_TO_RELATEDBILLS = '../relatedBills.json'
 SAVE_ON_COUNT = 1000
 
@@ -92,12 +234,24 @@ US_CONGRESS_PATH_REGEX_COMPILED = re.compile(
 USCONGRESS_XML_FILE = 'document.xml'
 
 
+# Rows per INSERT statement in the utils_db batch functions (Postgres allows 65535 bind parameters per statement)
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', default=5000))
+
 POSTGRES_USER = os.getenv('POSTGRES_USER', default='postgres')
 POSTGRES_DB = os.getenv('POSTGRES_DB', default='billsim')
 POSTGRES_HOST = os.getenv('POSTGRES_HOST', default='localhost')
 POSTGRES_PORT = os.getenv('POSTGRES_PORT', default='5432')
 POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', default='1234')
 
+# Connection pool of the database engine (per process)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', default=10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', default=20))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', default=30))
+# Seconds after which a pooled connection is replaced, before the server or a proxy drops it
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', default=1800))
+# Test connections when they are checked out of the pool
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', default='true').lower() in ('1', 'true', 'yes')
+
 # CDG = congress.gov
 def billNumberVersionFromPath_CDG(billpath: str):
     match = BILL_NUMBER_PART_REGEX_COMPILED.search(billpath)
@@ -151,6 +305,12 @@ def isFileParent_USCONGRESS(path: str):
         return False
 
 
+BILL_XML_FILENAME_REGEX_CDG_COMPILED = re.compile(r'BILLS-' +
+                                                 BILL_NUMBER_PART_REGEX +
+                                                 r'-uslm\.xml')
+BILL_XML_FILENAME_REGEX_USCONGRESS_COMPILED = re.compile(r'' +
+                                                        USCONGRESS_XML_FILE)
+
 CONGRESS_DIRS = {
     "congressdotgov": {
         "samplePath":
@@ -164,8 +324,7 @@ CONGRESS_DIRS = {
         "isFileParent":
             isFileParent_CDG,
         "fileMatch":
-            lambda x: re.compile(r'BILLS-' + BILL_NUMBER_PART_REGEX +
-                                 r'-uslm\.xml').match(x) is not None
+            lambda x: BILL_XML_FILENAME_REGEX_CDG_COMPILED.match(x) is not None
     },
     "unitedstates": {
         "samplePath":
@@ -179,7 +338,7 @@ CONGRESS_DIRS = {
         "isFileParent":
             isFileParent_USCONGRESS,
         "fileMatch":
-            lambda x: re.compile(r'' + USCONGRESS_XML_FILE).match(x) is not None
+            lambda x: BILL_XML_FILENAME_REGEX_USCONGRESS_COMPILED.match(x) is not None
     }
 }
 
@@ -408,9 +567,9 @@ SAMPLE_QUERY_NESTED_MLT = {
                 "more_like_this": {
                     "fields": ["sections.section_text"],
                     "like": forestry_programs,
-                    "min_term_freq": 2,
-                    "max_query_terms": 30,
-                    "min_doc_freq": 2
+                    "min_term_freq": MLT_MIN_TERM_FREQ,
+                    "max_query_terms": MLT_MAX_QUERY_TERMS,
+                    "min_doc_freq": MLT_MIN_DOC_FREQ
                 }
             },
             "inner_hits": {
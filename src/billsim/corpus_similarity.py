@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Corpus mode: similar sections for all bills of one or more Congresses at once, without a query per section.
+All sections are vectorized into a sparse tf-idf matrix (rows normalized, so that the product of two rows is
+their cosine similarity), and the matrix is multiplied by its transpose one block of rows at a time.
+For each section, the best matching section of each of the top bills is kept, as in the nested
+more_like_this query of bill_similarity. The results are saved bill by bill to the BillToBill
+and SectionToSection tables, as compare.processSimilarBills does.
+
+The cosine similarity (0 to 1) of the sections is kept as the score of the similar sections (their score_es,
+the score of a query, is None). It is saved as the score of the SectionToSection rows, and added up for each
+pair of bills as the score_es of BillToBill, in place of the query scores (see SimilarSection.getScore).
+Requires numpy and scipy (`pip install billsim[corpus]`).
+
+>>> from billsim.utils import iterBillXmlPaths
+>>> from billsim.corpus_similarity import compareCorpus
+>>> compareCorpus(iterBillXmlPaths(congresses=[117]))
+
+Or, from the command line:
+$ python -m billsim.corpus_similarity --congress 117
+"""
+
+import sys
+import time
+import logging
+import argparse
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterable, Iterator, NamedTuple
+
+from billsim import constants
+from billsim.bill_similarity import getBillToBill
+from billsim.local_index import tokenize
+from billsim.pymodels import BillPath, BillSections, Section, SectionMeta, SimilarSection
+from billsim.utils import getBillLengthbyPath, iterBillXmlPaths, iterSectionRecords
+from billsim.utils_db import batch_save_bill_to_bill_sections
+
+logger = logging.getLogger(constants.LOGGER_NAME)
+logger.addHandler(logging.StreamHandler(sys.stdout))
+
+
+class BillSectionTerms(NamedTuple):
+    billnumber_version: str
+    length: int
+    sections: list[SectionMeta]
+    terms: list[Counter]
+
+
+def getBillSectionTerms(billPath: BillPath) -> BillSectionTerms:
+    """
+    Reads the sections of the bill XML and returns their term counts.
+    Runs in the process pool of iterCorpusBillSections. Each bill is read once, so the bill cache is not used;
+    sections are streamed (see utils.iterSectionRecords), so large bills do not have to fit in memory as a tree.
+    """
+    sections = []
+    terms = []
+    for section in iterSectionRecords(billPath.filePath, withXml=False):
+        sections.append(
+            SectionMeta(billnumber_version=billPath.billnumber_version,
+                        section_id=section.section_id,
+                        label=section.enum,
+                        header=section.header,
+                        length=section.length))
+        terms.append(Counter(tokenize(section.text)))
+    return BillSectionTerms(billnumber_version=billPath.billnumber_version,
+                            length=getBillLengthbyPath(billPath.filePath),
+                            sections=sections,
+                            terms=terms)
+
+
+def makeSectionMatrix(terms: list[Counter],
+                      max_df: float = constants.CORPUS_MAX_DF):
+    """
+    Returns the tf-idf matrix (scipy.sparse.csr_matrix) of the sections, one row per section,
+    with sublinear tf and rows normalized to unit length.
+    Terms that occur in more than max_df of the sections are dropped.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    vocabulary = {}
+    indptr = [0]
+    indices = []
+    data = []
+    for sectionTerms in terms:
+        for term, tf in sectionTerms.items():
+            indices.append(vocabulary.setdefault(term, len(vocabulary)))
+            data.append(tf)
+        indptr.append(len(indices))
+    numSections = len(terms)
+    matrix = sparse.csr_matrix(
+        (np.asarray(data, dtype=np.float32), np.asarray(indices,
+                                                        dtype=np.int64),
+         np.asarray(indptr, dtype=np.int64)),
+        shape=(numSections, len(vocabulary)))
+    df = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = (np.log((1 + numSections) / (1 + df)) + 1).astype(np.float32)
+    idf[df > max_df * numSections] = 0
+    matrix.data = (1 + np.log(matrix.data)) * idf[matrix.indices]
+    matrix.eliminate_zeros()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms).dot(matrix).tocsr()
+
+
+def iterSimilarBillSections(
+        bills: Iterable[BillSectionTerms],
+        min_score: float = constants.CORPUS_MIN_SCORE,
+        max_bills: int = constants.MAX_BILLS_SECTION,
+        block_size: int = constants.CORPUS_BLOCK_SIZE,
+        max_df: float = constants.CORPUS_MAX_DF) -> Iterator[BillSections]:
+    """
+    Finds the similar sections of all sections of the bills, with blocked sparse matrix multiplication.
+
+    Args:
+        bills (Iterable[BillSectionTerms]): the sections of the corpus, by bill
+        min_score (float, optional): minimum cosine similarity of two sections. Defaults to constants.CORPUS_MIN_SCORE.
+        max_bills (int, optional): maximum number of similar bills per section. Defaults to constants.MAX_BILLS_SECTION.
+        block_size (int, optional): number of sections (rows) multiplied at a time; whole bills are kept in a block.
+            Memory use grows with block_size. Defaults to constants.CORPUS_BLOCK_SIZE.
+        max_df (float, optional): see makeSectionMatrix. Defaults to constants.CORPUS_MAX_DF.
+
+    Yields:
+        BillSections: the similar sections of each bill, in the order of bills
+    """
+    import numpy as np
+
+    bills = list(bills)
+    sectionMetas = []
+    terms = []
+    sectionBill = []
+    for billIndex, bill in enumerate(bills):
+        sectionMetas.extend(bill.sections)
+        terms.extend(bill.terms)
+        sectionBill.extend([billIndex] * len(bill.sections))
+    if not sectionMetas:
+        return
+    sectionBill = np.asarray(sectionBill, dtype=np.int64)
+    matrix = makeSectionMatrix(terms, max_df=max_df)
+    transposed = matrix.T.tocsr()
+    logger.info(
+        f'Section matrix: {matrix.shape[0]} sections of {len(bills)} bills, {matrix.shape[1]} terms'
+    )
+
+    start = 0
+    billIndex = 0
+    while billIndex < len(bills):
+        # Whole bills, up to block_size sections (at least one bill)
+        blockBills = []
+        end = start
+        while billIndex < len(bills) and (not blockBills or end - start +
+                                          len(bills[billIndex].sections)
+                                          <= block_size):
+            blockBills.append(bills[billIndex])
+            end += len(bills[billIndex].sections)
+            billIndex += 1
+        scores = matrix[start:end].dot(transposed).tocsr()
+        scores.data[scores.data < min_score] = 0
+        scores.eliminate_zeros()
+
+        row = 0
+        for bill in blockBills:
+            sections = []
+            for sectionMeta in bill.sections:
+                rowStart, rowEnd = scores.indptr[row], scores.indptr[row + 1]
+                row += 1
+                columns = scores.indices[rowStart:rowEnd]
+                values = scores.data[rowStart:rowEnd]
+                # Best section of each bill, then the best bills
+                order = np.argsort(-values, kind='stable')
+                _, firstOfBill = np.unique(sectionBill[columns[order]],
+                                           return_index=True)
+                best = order[np.sort(firstOfBill)]
+                best = best[np.argsort(-values[best],
+                                       kind='stable')][:max_bills]
+                sections.append(
+                    Section(billnumber_version=sectionMeta.billnumber_version,
+                            section_id=sectionMeta.section_id,
+                            label=sectionMeta.label,
+                            header=sectionMeta.header,
+                            length=sectionMeta.length,
+                            similar_sections=[
+                                SimilarSection(
+                                    billnumber_version=sectionMetas[
+                                        column].billnumber_version,
+                                    section_id=sectionMetas[column].section_id,
+                                    label=sectionMetas[column].label,
+                                    header=sectionMetas[column].header,
+                                    length=sectionMetas[column].length,
+                                    score=float(values[position]))
+                                for position, column in zip(
+                                    best, columns[best])
+                            ]))
+            yield BillSections(billnumber_version=bill.billnumber_version,
+                               length=bill.length,
+                               sections=sections)
+        start = end
+
+
+def iterCorpusBillSections(
+        billPaths: Iterable[BillPath],
+        min_score: float = constants.CORPUS_MIN_SCORE,
+        max_bills: int = constants.MAX_BILLS_SECTION,
+        block_size: int = constants.CORPUS_BLOCK_SIZE,
+        max_df: float = constants.CORPUS_MAX_DF,
+        workers: int = constants.COMPARE_PARSE_WORKERS
+) -> Iterator[BillSections]:
+    """
+    Parses the bills in a pool of worker processes and yields their similar sections (see iterSimilarBillSections).
+    At most 2 * workers bills are parsed ahead of the vectorizer. Bills that cannot be parsed are skipped.
+    """
+
+    def iterBills():
+        billPathsIter = iter(billPaths)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            while True:
+                while len(pending) < 2 * workers:
+                    billPath = next(billPathsIter, None)
+                    if billPath is None:
+                        break
+                    pending[executor.submit(getBillSectionTerms,
+                                            billPath)] = billPath
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    billPath = pending.pop(future)
+                    try:
+                        yield future.result()
+                    except Exception as e:
+                        logger.error(
+                            f'Could not parse {billPath.billnumber_version}: {e}'
+                        )
+
+    return iterSimilarBillSections(iterBills(),
+                                   min_score=min_score,
+                                   max_bills=max_bills,
+                                   block_size=block_size,
+                                   max_df=max_df)
+
+
+def compareCorpus(billPaths: Iterable[BillPath],
+                  min_score: float = constants.CORPUS_MIN_SCORE,
+                  max_bills: int = constants.MAX_BILLS_SECTION,
+                  block_size: int = constants.CORPUS_BLOCK_SIZE,
+                  max_df: float = constants.CORPUS_MAX_DF,
+                  workers: int = constants.COMPARE_PARSE_WORKERS) -> int:
+    """
+    Finds the similar sections and bills of all of the bills and saves them, one transaction per bill,
+    as each block of the matrix product is computed.
+
+    Returns:
+        int: the number of bills saved
+    """
+    start_time = time.time()
+    saved = 0
+    for billSections in iterCorpusBillSections(billPaths,
+                                               min_score=min_score,
+                                               max_bills=max_bills,
+                                               block_size=block_size,
+                                               max_df=max_df,
+                                               workers=workers):
+        try:
+            batch_save_bill_to_bill_sections(
+                list(getBillToBill(billSections).values()))
+            saved += 1
+        except Exception as e:
+            logger.error(
+                f'Could not save similar bills of {billSections.billnumber_version}: {e}'
+            )
+    logger.info(
+        f'Saved similar bills of {saved} bills in {time.time() - start_time} seconds'
+    )
+    return saved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Get similar sections and bills for whole Congresses.')
+    parser.add_argument('--congress',
+                        type=int,
+                        nargs='+',
+                        default=[constants.CURRENT_CONGRESS],
+                        help='congresses to compare')
+    parser.add_argument('--min-score',
+                        type=float,
+                        default=constants.CORPUS_MIN_SCORE,
+                        help='minimum cosine similarity of two sections')
+    parser.add_argument('--block-size',
+                        type=int,
+                        default=constants.CORPUS_BLOCK_SIZE,
+                        help='number of sections multiplied at a time')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=constants.COMPARE_PARSE_WORKERS,
+                        help='number of processes to parse bill XML')
+    args = parser.parse_args()
+    compareCorpus(iterBillXmlPaths(congresses=args.congress),
+                  min_score=args.min_score,
+                  block_size=args.block_size,
+                  workers=args.workers)
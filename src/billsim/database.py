@@ -1,15 +1,95 @@
 #!/usr/bin/env python3
+"""
+Database engine and sessions.
+Use session_scope for a unit of work: a new session from the pool, committed at the end (rolled back on error) and closed.
 
-from billsim.constants import POSTGRES_USER, POSTGRES_DB, POSTGRES_HOST, POSTGRES_PASSWORD, POSTGRES_PORT
-from sqlalchemy.orm import sessionmaker
+>>> from billsim.database import session_scope
+>>> with session_scope() as session:
+>>>    save_bill(bill, db=session)
+>>>    batch_save_sectionitems(section_metas, db=session)
+
+The engine is shared by the threads of a process. Pooled connections are not shared with forked processes:
+a connection checked out in a process other than the one that opened it is discarded and replaced.
+"""
+
+import os
+from contextlib import contextmanager
+from billsim.deadline import Deadline
+from billsim.constants import POSTGRES_USER, POSTGRES_DB, POSTGRES_HOST, POSTGRES_PASSWORD, POSTGRES_PORT, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+from sqlalchemy import event, exc
+from sqlalchemy.orm import Session, sessionmaker
 from sqlmodel import create_engine
 
 postgres_url = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 
-engine = create_engine(postgres_url, echo=False)
+engine = create_engine(postgres_url,
+                       echo=False,
+                       pool_size=DB_POOL_SIZE,
+                       max_overflow=DB_MAX_OVERFLOW,
+                       pool_timeout=DB_POOL_TIMEOUT,
+                       pool_recycle=DB_POOL_RECYCLE,
+                       pool_pre_ping=DB_POOL_PRE_PING)
+
+
+@event.listens_for(engine, 'connect')
+def setConnectionPid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+@event.listens_for(engine, 'checkout')
+def checkConnectionPid(dbapi_connection, connection_record, connection_proxy):
+    """
+    Discards pooled connections inherited from a parent process (e.g. by the workers of a ProcessPoolExecutor),
+    so that the processes never use the same connection.
+    """
+    pid = os.getpid()
+    if connection_record.info['pid'] != pid:
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            f"Connection record belongs to pid {connection_record.info['pid']}, attempting to check out in pid {pid}"
+        )
+
 
 SessionLocal = sessionmaker(autocommit=False,
                             autoflush=False,
                             expire_on_commit=False,
                             bind=engine)
 
+
+@contextmanager
+def session_scope(commit: bool = True) -> Session:
+    """
+    A unit of work: yields a new session, which is committed at the end (if commit is True),
+    rolled back on error and always closed, returning its connection to the pool.
+    """
+    session = SessionLocal()
+    try:
+        yield session
+        if commit:
+            session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def setStatementDeadline(session: Session, deadline: Deadline):
+    """
+    Bounds the statements of the session's current transaction by the deadline (Postgres statement_timeout):
+    before each statement, the timeout is set to the time that remains, so that the transaction as a whole
+    ends by the deadline. The server cancels a statement that takes longer, and the transaction is rolled back;
+    no statement is started once the deadline has expired (DeadlineExceeded is raised).
+    """
+    if deadline.expires_at is None:
+        return
+
+    def setTimeout(conn, cursor, statement, parameters, context, executemany):
+        deadline.check()
+        # 0 would disable the timeout
+        timeout_ms = max(1, int(deadline.remaining() * 1000))
+        cursor.execute("SELECT set_config('statement_timeout', %(timeout)s, true)",
+                       {'timeout': str(timeout_ms)})
+
+    # The listener belongs to the connection of this transaction, which is released when the session ends
+    event.listen(session.connection(), 'before_cursor_execute', setTimeout)
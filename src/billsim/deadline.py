@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Deadlines for the stages of compare (candidate search, scoring and saving), without signals.
+Unlike signal.alarm, which only works in the main thread, cannot be nested and does not stop a subprocess,
+a Deadline works in any thread, in worker processes (it can be pickled) and in asyncio tasks.
+
+A stage gets its own Deadline, so a stage that times out does not discard the results of the stages before it.
+The code of a stage checks the deadline between units of work (Deadline.check) and bounds its waits by it
+(Deadline.remaining). Child processes started with runProcess are killed when the deadline expires.
+Queries pass Deadline.remaining() as their own timeout (e.g. the request_timeout of Elasticsearch, or
+database.setStatementDeadline), so that they are cancelled with the stage.
+A function that cannot be bounded in any of these ways may be run with runWithTimeout, which stops waiting for it.
+
+>>> deadline = Deadline(60, 'scoring')
+>>> for pair in pairs:
+>>>     deadline.check()
+>>>     ...
+>>> result = runProcess(['comparematrix', '-abspaths', paths], deadline)
+"""
+
+import time
+import asyncio
+import threading
+import subprocess
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+from typing import Any, Callable, Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Deadline:
+    """
+    A point in time by which a stage must finish; seconds=None is no limit.
+    The deadline is kept as wall-clock time, so that it means the same in a worker process.
+    """
+
+    def __init__(self, seconds: Optional[float] = None, stage: str = 'block'):
+        self.seconds = seconds
+        self.stage = stage
+        self.expires_at = None if seconds is None else time.time() + seconds
+        self._processes: list[subprocess.Popen] = []
+        self._lock = threading.Lock()
+
+    def remaining(self) -> Optional[float]:
+        """
+        Seconds left (0 once expired), or None if there is no limit.
+        """
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.time())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    def getError(self) -> DeadlineExceeded:
+        return DeadlineExceeded(
+            f'{self.stage} timed out after {self.seconds} seconds')
+
+    def check(self):
+        """
+        Raises DeadlineExceeded, after killing the child processes of the deadline, if it has expired.
+        """
+        if self.expired():
+            self.killProcesses()
+            raise self.getError()
+
+    def addProcess(self, process: subprocess.Popen):
+        with self._lock:
+            self._processes.append(process)
+
+    def removeProcess(self, process: subprocess.Popen):
+        with self._lock:
+            if process in self._processes:
+                self._processes.remove(process)
+
+    def killProcesses(self):
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+
+    async def waitFor(self, awaitable) -> Any:
+        """
+        Awaits the awaitable in an asyncio task, cancelling it when the deadline expires.
+        """
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            self.killProcesses()
+            raise self.getError() from None
+
+    def __getstate__(self) -> dict:
+        # Child processes and the lock belong to the process that created them
+        state = self.__dict__.copy()
+        del state['_processes']
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._processes = []
+        self._lock = threading.Lock()
+
+
+def runWithTimeout(deadline: Deadline, func: Callable, *args, **kwargs) -> Any:
+    """
+    Runs func(*args, **kwargs) and returns its result, or raises DeadlineExceeded when the deadline expires first.
+    The function runs in a daemon thread, which cannot be stopped: on expiry, its child processes (see runProcess)
+    are killed, and its result is discarded when it finishes, but the thread keeps running until then.
+    Prefer passing the deadline to the function, so that the work itself stops (see utils_es.moreLikeThisBatch
+    and database.setStatementDeadline).
+    """
+    if deadline.expires_at is None:
+        return func(*args, **kwargs)
+    deadline.check()
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run,
+                     name=f'deadline-{deadline.stage}',
+                     daemon=True).start()
+    try:
+        return future.result(timeout=deadline.remaining())
+    except FuturesTimeoutError:
+        deadline.killProcesses()
+        raise deadline.getError() from None
+
+
+def runProcess(args: list[str], deadline: Deadline,
+               **kwargs) -> subprocess.CompletedProcess:
+    """
+    subprocess.run, with text output captured, bounded by the deadline: the process is killed when the deadline
+    expires, whether this thread is waiting for it or not.
+    """
+    deadline.check()
+    process = subprocess.Popen(args,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               text=True,
+                               **kwargs)
+    deadline.addProcess(process)
+    try:
+        stdout, stderr = process.communicate(timeout=deadline.remaining())
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        raise deadline.getError() from None
+    finally:
+        deadline.removeProcess(process)
+    if deadline.expired() and process.returncode != 0:
+        # Killed by the deadline from another thread
+        raise deadline.getError()
+    return subprocess.CompletedProcess(args, process.returncode, stdout,
+                                       stderr)
@@ -1,19 +1,20 @@
 #!/usr/bin/env python3
 
-import re
 import json
 import logging
 import sys
-from billsim.utils_db import get_or_create_sectionitem, save_bill
-from lxml import etree
-from elasticsearch import exceptions, Elasticsearch
-from collections import OrderedDict
+from billsim.utils_db import batch_save_sectionitems, save_bill
+from elasticsearch import exceptions, helpers
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Iterable, NamedTuple, Optional
 
-es = Elasticsearch()
 from billsim import constants
-from billsim.utils import getBillnumberversionParts, getBillXmlPaths, getBillLengthbyPath, getDefaultNamespace, getId, getHeader, getEnum, getSections, getText, parseFilePath
-from billsim.utils_es import getBill_es
-from billsim.pymodels import SectionMeta, Status, BillPath, Bill, SectionItem
+from billsim.utils import deep_get, getBillnumberversionParts, getBillXmlPaths, getParsedBill, iterBillXmlPaths, parseBill
+from billsim.utils_es import getBill_es, getEsClient
+from billsim.utils_manifest import diffManifest, loadManifest, markIndexed, saveManifest
+from billsim.minhash_index import getMinHashIndex, getSectionSignatures, saveMinHashIndex
+from billsim.section_store import getSectionStore
+from billsim.pymodels import SectionMeta, Status, BillPath, Bill, ManifestEntry, ParsedBill, SectionRecord
 
 #logging.basicConfig(filename='elastic_load.log', filemode='w', level='INFO')
 logger = logging.getLogger(constants.LOGGER_NAME)
@@ -32,13 +33,13 @@ def createIndex(index: str = constants.INDEX_SECTIONS,
                 delete=False):
     if delete:
         try:
-            es.indices.delete(index=index)
+            getEsClient().indices.delete(index=index)
         except exceptions.NotFoundError:
             logger.error('No index to delete: {0}'.format(index))
 
     logger.info('Creating index with mapping: ')
     logger.info(str(body))
-    es.indices.create(index=index, ignore=400, body=body)
+    getEsClient().indices.create(index=index, ignore=400, body=body)
 
 
 def indexBill(billPath: BillPath,
@@ -54,6 +55,9 @@ def indexBill(billPath: BillPath,
       index_types (dict, optional): Index by 'sections', 'bill_full' or both. Defaults to ['sections'].
       reindex (bool, optional): Whether to reindex the bill if it already is in ES. Defaults to True.
       withDb (bool, optional): Whether to save the bill and sections to the database. Defaults to False.
+  With constants.MINHASH_ENABLED, the sections are also added to the shared MinHash index (minhash_index),
+  which is saved by indexBillPaths, or with minhash_index.saveMinHashIndex.
+  With constants.SECTION_STORE_ENABLED, the sections are also added to the section store (section_store).
 
   Raises:
       Exception: Could not parse bill xml file. 
@@ -69,85 +73,62 @@ def indexBill(billPath: BillPath,
             if billres:
                 return Status(success=False, message='Bill already indexed')
 
-    billTree = parseFilePath(billPath.filePath)
-    length = getBillLengthbyPath(billPath.filePath)
-    dublinCore = None
-    defaultNS = getDefaultNamespace(billTree)
-    if defaultNS and defaultNS == constants.NAMESPACE_USLM2:
-        logger.debug('INDEXING WITH USLM2')
-        logger.debug('defaultNS: {}'.format(defaultNS))
-        dcdate = getText(
-            billTree.xpath('//uslm:meta/dc:date',
-                           namespaces={
-                               'uslm': defaultNS,
-                               'dc': constants.NAMESPACE_DC
-                           }))
-        congress = billTree.xpath('//uslm:meta/uslm:congress',
-                                  namespaces={'uslm': defaultNS})
-        congress_text = re.sub(r'[a-zA-Z ]+$', '', getText(congress))
-        session = billTree.xpath('//uslm:meta/uslm:session',
-                                 namespaces={'uslm': defaultNS})
-        session_text = re.sub(r'[a-zA-Z ]+$', '', getText(session))
-        dc_type = billTree.xpath('//uslm:preface/dc:type',
-                                 namespaces={
-                                     'uslm': defaultNS,
-                                     'dc': constants.NAMESPACE_DC
-                                 })
-        docNumber = billTree.xpath('//uslm:preface/uslm:docNumber',
-                                   namespaces={
-                                       'uslm': defaultNS,
-                                       'dc': constants.NAMESPACE_DC
-                                   })
-        if dc_type and docNumber:
-            legisnum_text = getText(dc_type) + ' ' + getText(docNumber)
-        else:
-            legisnum_text = ''
-
-        dctitle = getText(
-            billTree.xpath('//uslm:meta/dc:title',
-                           namespaces={
-                               'uslm': defaultNS,
-                               'dc': constants.NAMESPACE_DC
-                           })),
-        sections = getSections(billTree, defaultNS)
-        headers = billTree.xpath('//uslm:heading',
-                                 namespaces={'uslm': defaultNS})
+    res = {}
+    parsedBill = getParsedBill(billPath.filePath,
+                               withText='bill_full' in index_types.keys())
+    docs = getBillDocs(billPath,
+                       index_types=index_types,
+                       withDb=withDb,
+                       parsedBill=parsedBill)
+    if constants.MINHASH_ENABLED:
+        getMinHashIndex().addBill(billPath.billnumber_version,
+                                  parsedBill.sections)
+    if constants.SECTION_STORE_ENABLED:
+        getSectionStore().addBill(billPath.billnumber_version,
+                                  parsedBill.sections)
+    for index_type, doc in docs.items():
+        res = getEsClient().index(index=index_types[index_type],
+                                  body=doc,
+                                  id=billPath.billnumber_version)
+
+    # TODO: handle processing of bill section index separately from full bill
+    result_status = res.get('result', None)
+    if result_status == 'created' or result_status == 'updated':
+        return Status(
+            success=True,
+            message=
+            f'Indexed ({result_status}) bill: {billPath.billnumber_version}')
     else:
-        logger.debug('NO NAMESPACE')
-        dublinCores = billTree.xpath('//dublinCore')
-        if (dublinCores is not None) and (len(dublinCores) > 0):
-            dublinCore = etree.tostring(dublinCores[0],
-                                        method="xml",
-                                        encoding="unicode"),
-        else:
-            dublinCore = ''
-        dcdate = getText(
-            billTree.xpath('//dublinCore/dc:date',
-                           namespaces={'dc': constants.NAMESPACE_DC}))
-        # TODO find date for enr bills in the bill status (for the flat congress directory structure)
-        if (dcdate is None
-                or len(dcdate) == 0) and '/data.xml' in billPath.filePath:
-            metadata_path = billPath.filePath.replace('/data.xml', '/data.json')
-            try:
-                with open(metadata_path, 'rb') as f:
-                    metadata = json.load(f)
-                    dcdate = metadata.get('issued_on', None)
-            except:
-                pass
-        if dcdate is None or len(dcdate) == 0:
-            dcdate = None
-
-        congress = billTree.xpath('//form/congress')
-        congress_text = re.sub(r'[a-zA-Z ]+$', '', getText(congress))
-        session = billTree.xpath('//form/session')
-        session_text = re.sub(r'[a-zA-Z ]+$', '', getText(session))
-        legisnum = billTree.xpath('//legis-num')
-        legisnum_text = getText(legisnum)
-        dctitle = getText(
-            billTree.xpath('//dublinCore/dc:title',
-                           namespaces={'dc': constants.NAMESPACE_DC}))
-        sections = getSections(billTree),
-        headers = billTree.xpath('//header')
+        return Status(
+            success=False,
+            message=f'Failed to index bill: {billPath.billnumber_version}')
+
+
+def getBillDocs(billPath: BillPath,
+                index_types: dict = {'sections': constants.INDEX_SECTIONS},
+                withDb=False,
+                parsedBill: ParsedBill = None) -> dict:
+    """
+  Parse bill and build the Elasticsearch documents for it
+
+  Args:
+      bill_path (str): location of the bill xml file.
+      index_types (dict, optional): Build documents for 'sections', 'bill_full' or both. Defaults to ['sections'].
+      withDb (bool, optional): Whether to save the bill and sections to the database. Defaults to False.
+      parsedBill (ParsedBill, optional): the already parsed bill. Defaults to None (get it from the bill cache).
+
+  Raises:
+      Exception: Could not parse bill xml file. 
+
+  Returns:
+      dict: the documents to index, keyed by index type ('sections', 'bill_full') 
+  """
+    if parsedBill is None:
+        parsedBill = getParsedBill(billPath.filePath,
+                                   withText='bill_full' in index_types.keys())
+    length = parsedBill.length
+    meta = parsedBill.meta
+    sections = parsedBill.sections
 
     billmatch = constants.BILL_NUMBER_REGEX_COMPILED.match(
         billPath.billnumber_version)
@@ -157,7 +138,6 @@ def indexBill(billPath: BillPath,
         billmatch_dict = billmatch.groupdict()
         billnumber = '{congress}{stage}{number}'.format(**billmatch_dict)
         billversion = billmatch_dict.get('version', '')
-    headers_text = [header.text for header in headers]
 
     if withDb:
         try:
@@ -167,132 +147,367 @@ def indexBill(billPath: BillPath,
             save_bill(bill)
         except Exception as e:
             logger.error('Could not add bill to database: {}'.format(e))
-    res = {}
+    docs = {}
 
-    # Uses an OrderedDict to deduplicate headers
     # TODO handle missing header and enum separately
     if 'sections' in index_types.keys():
         sectionData = [{
-            'section_id':
-                getId(section),
-            'section_number':
-                getEnum(section, defaultNS),
-            'section_header':
-                getHeader(section, defaultNS),
-            'section_text':
-                etree.tostring(section, method="text", encoding="unicode"),
-            'section_length':
-                len(etree.tostring(section, method="text", encoding="unicode")),
-            'section_xml':
-                etree.tostring(section, method="xml", encoding="unicode")
+            'section_id': section.section_id,
+            'section_number': section.enum,
+            'section_header': section.header,
+            'section_text': section.text,
+            'section_length': section.length,
+            'section_xml': section.xml
         } for section in sections]
 
         if withDb:
             try:
-                # Add sectionItems to db here
-                for sectionDataItem in sectionData:
-                    if sectionDataItem.get('section_id') is None:
-                        continue
-                    try:
-                        section_meta = SectionMeta(
-                            billnumber_version=f'{billnumber}{billversion}',
-                            section_id=sectionDataItem.get('section_id'),
-                            label=sectionDataItem.get('section_number', ''),
-                            length=sectionDataItem.get('length', 0))
-                        get_or_create_sectionitem(section_meta)
-                    except Exception as e:
-                        logger.error(
-                            f'Could not add section in {billnumber}{billversion} to database: {e}'
-                        )
-                        logger.error(f'{sectionDataItem}')
+                # Add sectionItems to db here, in one batch
+                batch_save_sectionitems([
+                    SectionMeta(billnumber_version=f'{billnumber}{billversion}',
+                                section_id=section.section_id,
+                                label=section.enum,
+                                header=section.header,
+                                length=section.length)
+                    for section in sections
+                    if section.section_id is not None
+                ])
             except Exception as e:
                 logger.error('Could not add sections to database: {}'.format(e))
 
         doc = {
             'id': billPath.billnumber_version,
-            'congress': congress_text,
-            'session': session_text,
+            'congress': meta.congress,
+            'session': meta.session,
             'length': length,
-            'dctitle': dctitle,
-            'date': dcdate,
-            'legisnum': legisnum_text,
+            'dctitle': meta.dctitle,
+            'date': meta.date,
+            'legisnum': meta.legisnum,
             'billnumber': billnumber,
             'billversion': billversion,
-            'headers': list(OrderedDict.fromkeys(headers_text)),
+            'headers': meta.headers,
             'sections_num': len(sections),
             'sections': sectionData
         }
-        if dublinCore:
-            doc['dublinCore'] = dublinCore
+        if meta.dublinCore:
+            doc['dublinCore'] = meta.dublinCore
 
-        res = es.index(index=index_types['sections'],
-                       body=doc,
-                       id=billPath.billnumber_version)
+        docs['sections'] = doc
 
     if 'bill_full' in index_types.keys():
-        billText = etree.tostring(billTree, method="text", encoding="unicode")
         doc_full = {
             'id': billPath.billnumber_version,
-            'congress': congress_text,
-            'session': session_text,
+            'congress': meta.congress,
+            'session': meta.session,
             'length': length,
             'sections_num': len(sections),
-            'dc': dublinCore,
-            'dctitle': dctitle,
-            'date': dcdate,
-            'legisnum': legisnum_text,
+            'dc': meta.dublinCore,
+            'dctitle': meta.dctitle,
+            'date': meta.date,
+            'legisnum': meta.legisnum,
             'billnumber': billnumber,
             'billversion': billversion,
-            'headers': list(OrderedDict.fromkeys(headers_text)),
-            'billtext': billText
+            'headers': meta.headers,
+            'billtext': parsedBill.text
         }
-        res = es.index(index=index_types['bill_full'],
-                       body=doc_full,
-                       id=billPath.billnumber_version)
+        docs['bill_full'] = doc_full
 
-    # TODO: handle processing of bill section index separately from full bill
-    result_status = res.get('result', None)
-    if result_status == 'created' or result_status == 'updated':
-        return Status(
-            success=True,
-            message=
-            f'Indexed ({result_status}) bill: {billPath.billnumber_version}')
-    else:
-        return Status(
-            success=False,
-            message=f'Failed to index bill: {billPath.billnumber_version}')
+    return docs
 
     # billRoot = billTree.getroot()
     # nsmap = {k if k is not None else '':v for k,v in billRoot.nsmap.items()}
 
 
-def initializeBillSectionsIndex(delete_index=False):
+class BillActions(NamedTuple):
+    billnumber_version: str
+    actions: list
+    # Sections and their MinHash signatures (minhash_index.getSectionSignatures), if computed
+    sectionMetas: Optional[list[SectionMeta]] = None
+    signatures: Optional[list] = None
+    # Sections (without XML) for the section store, if requested
+    sections: Optional[list[SectionRecord]] = None
+
+
+def getBillActions(billPath: BillPath,
+                   index_types: dict,
+                   withMinHash: bool = False,
+                   withSections: bool = False) -> BillActions:
+    """
+    Build the _bulk index actions for a bill. Runs in the parsing worker processes of bulkIndexBills.
+    With withMinHash, the MinHash signatures of the sections are computed too.
+    With withSections, the sections are returned too, to be added to the section store.
+
+    Returns:
+        BillActions: the _bulk actions (and signatures), or a Status if the bill could not be parsed
+    """
+    try:
+        # Each bill is parsed once, so the bill cache is not used
+        parsedBill = parseBill(billPath.filePath,
+                               withText='bill_full' in index_types.keys())
+        docs = getBillDocs(billPath,
+                           index_types=index_types,
+                           parsedBill=parsedBill)
+        sectionMetas, signatures = getSectionSignatures(
+            billPath.billnumber_version,
+            parsedBill.sections) if withMinHash else (None, None)
+    except Exception as e:
+        return Status(
+            success=False,
+            message=f'Failed to parse bill: {billPath.billnumber_version}; {e}')
+    return BillActions(billnumber_version=billPath.billnumber_version,
+                       actions=[{
+                           '_index': index_types[index_type],
+                           '_id': billPath.billnumber_version,
+                           '_source': doc
+                       } for index_type, doc in docs.items()],
+                       sectionMetas=sectionMetas,
+                       signatures=signatures,
+                       sections=[
+                           section._replace(xml=None)
+                           for section in parsedBill.sections
+                       ] if withSections else None)
+
+
+def generateBillActions(billPaths: list[BillPath], index_types: dict,
+                        workers: int, failures: list[Status]):
+    """
+    Parses bills in a pool of worker processes and yields their _bulk actions as they are ready.
+    At most 2 * workers bills are parsed ahead of the consumer. Parse failures are appended to failures.
+    With constants.MINHASH_ENABLED, the sections are added to the shared MinHash index.
+    With constants.SECTION_STORE_ENABLED, the sections are added to the section store, by this process.
+    """
+    billPathsIter = iter(billPaths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        while True:
+            while len(pending) < 2 * workers:
+                billPath = next(billPathsIter, None)
+                if billPath is None:
+                    break
+                pending.add(
+                    pool.submit(getBillActions, billPath, index_types,
+                                constants.MINHASH_ENABLED,
+                                constants.SECTION_STORE_ENABLED))
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                billActions = future.result()
+                if isinstance(billActions, Status):
+                    logger.error(billActions.message)
+                    failures.append(billActions)
+                    continue
+                if billActions.signatures is not None:
+                    getMinHashIndex().addSignatures(
+                        billActions.billnumber_version,
+                        billActions.sectionMetas, billActions.signatures)
+                if billActions.sections is not None:
+                    getSectionStore().addBill(billActions.billnumber_version,
+                                              billActions.sections)
+                yield from billActions.actions
+
+
+def bulkIndexBills(billPaths: list[BillPath],
+                   index_types: dict = {'sections': constants.INDEX_SECTIONS},
+                   workers: int = constants.INDEX_WORKERS,
+                   chunk_size: int = constants.BULK_CHUNK_SIZE,
+                   max_chunk_bytes: int = constants.BULK_MAX_CHUNK_BYTES,
+                   thread_count: int = constants.BULK_THREAD_COUNT,
+                   onIndexed: Callable[[str], None] = None) -> list[Status]:
+    """
+    Index bills with the Elasticsearch _bulk API. Bills are parsed in parallel worker processes
+    and the documents are the same as those indexed by indexBill.
+    Refresh is disabled on the indices during the load and restored afterwards.
+
+    Args:
+        billPaths (list[BillPath]): bills to index.
+        index_types (dict, optional): Index by 'sections', 'bill_full' or both. Defaults to {'sections': constants.INDEX_SECTIONS}.
+        workers (int, optional): number of processes that parse bills. Defaults to constants.INDEX_WORKERS.
+        chunk_size (int, optional): maximum number of documents in a _bulk request. Defaults to constants.BULK_CHUNK_SIZE.
+        max_chunk_bytes (int, optional): maximum size of a _bulk request in bytes. Defaults to constants.BULK_MAX_CHUNK_BYTES.
+        thread_count (int, optional): number of _bulk requests in flight. Defaults to constants.BULK_THREAD_COUNT.
+        onIndexed (Callable[[str], None], optional): called with the id (billnumber_version) of each bill whose documents
+            (one per index type) are all indexed.
+
+    Returns:
+        list[Status]: a Status for each bill that could not be parsed or document that could not be indexed
+    """
+    indices = list(index_types.values())
+    refresh_intervals = {}
+    for index in indices:
+        settings = getEsClient().indices.get_settings(
+            index=index, name='index.refresh_interval')
+        refresh_intervals[index] = deep_get(
+            settings, [index, 'settings', 'index', 'refresh_interval'])
+        getEsClient().indices.put_settings(
+            index=index, body={'index': {
+                'refresh_interval': '-1'
+            }})
+
+    failures = []
+    indexed = 0
+    # Documents of each bill indexed so far, and the bills with a document that failed
+    indexedDocs = {}
+    failedIds = set()
+    try:
+        for ok, item in helpers.parallel_bulk(
+                getEsClient(),
+                generateBillActions(billPaths, index_types, workers, failures),
+                thread_count=thread_count,
+                chunk_size=chunk_size,
+                max_chunk_bytes=max_chunk_bytes,
+                raise_on_error=False,
+                raise_on_exception=False):
+            result = item.get('index', {})
+            billId = result.get('_id')
+            if ok:
+                indexed += 1
+                indexedDocs[billId] = indexedDocs.get(billId, 0) + 1
+                if indexedDocs[billId] == len(
+                        index_types) and billId not in failedIds:
+                    del indexedDocs[billId]
+                    if onIndexed is not None:
+                        onIndexed(billId)
+                continue
+            failedIds.add(billId)
+            status = Status(
+                success=False,
+                message=
+                f"Failed to index bill: {result.get('_id')}; {result.get('error')}"
+            )
+            logger.error(status.message)
+            failures.append(status)
+    finally:
+        for index in indices:
+            # A refresh_interval of None restores the default
+            getEsClient().indices.put_settings(
+                index=index,
+                body={'index': {
+                    'refresh_interval': refresh_intervals[index]
+                }})
+            getEsClient().indices.refresh(index=index)
+    logger.info('Indexed {0} documents; {1} failures'.format(
+        indexed, len(failures)))
+    return failures
+
+
+def indexBillPaths(billPaths: list[BillPath],
+                   bulk=False,
+                   manifest: dict[str, ManifestEntry] = None,
+                   manifest_path: str = constants.INDEX_MANIFEST_PATH,
+                   index_types: dict = {'sections': constants.INDEX_SECTIONS}
+                  ) -> list[Status]:
+    """
+    Indexes the bills in the indices of index_types, one at a time or with bulkIndexBills.
+    If a manifest is passed, each bill that is indexed is marked in the manifest, which is saved
+    every constants.SAVE_ON_COUNT bills and at the end.
+    With constants.MINHASH_ENABLED, the MinHash index is saved at the end.
+
+    Returns:
+        list[Status]: a Status for each bill that could not be indexed (these are also logged)
+    """
+    indexedNum = 0
+    failures = []
+
+    def onIndexed(billPath: BillPath):
+        nonlocal indexedNum
+        if manifest is None:
+            return
+        markIndexed(manifest, billPath)
+        indexedNum += 1
+        if indexedNum % constants.SAVE_ON_COUNT == 0:
+            saveManifest(manifest, manifest_path)
+
+    try:
+        if bulk:
+            billPathsById = {
+                billPath.billnumber_version: billPath for billPath in billPaths
+            }
+            failures = bulkIndexBills(
+                billPaths,
+                index_types=index_types,
+                onIndexed=lambda billnumber_version: onIndexed(
+                    billPathsById[billnumber_version]))
+            return failures
+        for billPath in billPaths:
+            try:
+                status = indexBill(billPath, index_types=index_types)
+                logger.debug(status)
+                if status.success:
+                    onIndexed(billPath)
+                else:
+                    logger.error(status.message)
+                    failures.append(status)
+            except Exception as e:
+                logger.error('Failed to index bill {0}'.format(
+                    billPath.billnumber_version))
+                logger.error(e)
+                failures.append(
+                    Status(success=False,
+                           message='Failed to index bill {0}: {1}'.format(
+                               billPath.billnumber_version, e)))
+        return failures
+    finally:
+        if manifest is not None:
+            saveManifest(manifest, manifest_path)
+        if constants.MINHASH_ENABLED:
+            saveMinHashIndex()
+
+
+def initializeBillSectionsIndex(delete_index=False,
+                                bulk=False,
+                                manifest_path: str = constants.INDEX_MANIFEST_PATH):
     """
   Initializes the index for the congress directory. The 'id' field is set to the billnumber_version and is unique.
+  With bulk=True, bills are indexed with bulkIndexBills.
+  Indexed bills are recorded in the manifest at manifest_path, for use by updateBillSectionsIndex.
+  Returns the Status of each bill that could not be indexed (see indexBillPaths).
   """
 
     createIndex(delete=delete_index)
     billPaths = getBillXmlPaths()
     logger.info('Indexing {0} bills'.format(len(billPaths)))
-    for billPath in billPaths:
-        try:
-            logger.debug(indexBill(billPath))
-        except Exception as e:
-            logger.error('Failed to index bill {0}'.format(
-                billPath.billnumber_version))
-            logger.error(e)
+    manifest = {} if delete_index else loadManifest(manifest_path)
+    return indexBillPaths(billPaths,
+                          bulk=bulk,
+                          manifest=manifest,
+                          manifest_path=manifest_path)
 
 
-def updateBillSectionsIndex():
+def updateBillSectionsIndex(bulk=False,
+                            index_types: dict = {
+                                'sections': constants.INDEX_SECTIONS
+                            },
+                            manifest_path: str = constants.INDEX_MANIFEST_PATH,
+                            billPaths: Optional[Iterable[BillPath]] = None):
     """
-    Updates the bill sections index. Finds all bills, checks whether a bill is already in the index, and indexes it if it is not.
+    Updates the bill sections index. Finds all bills and indexes those that are new or have changed since
+    they were recorded in the manifest (see utils_manifest.diffManifest).
+    Documents for bills whose files no longer exist are deleted from the index.
+    With bulk=True, bills are indexed with bulkIndexBills.
+    billPaths are all of the bills, e.g. from bill_catalog.BillCatalog.iterBillPaths; by default, the data
+    directory is scanned.
+    Returns the Status of each bill that could not be indexed (see indexBillPaths).
     """
-    billPaths = getBillXmlPaths()
-    logger.info('Found {0} total bills'.format(len(billPaths)))
-    for billPath in billPaths:
-        try:
-            logger.debug(indexBill(billPath))
-        except Exception as e:
-            logger.error('Failed to index bill {0}'.format(
-                billPath.billnumber_version))
-            logger.error(e)
\ No newline at end of file
+    manifest = loadManifest(manifest_path)
+    if billPaths is None:
+        # The files are compared with the manifest as the directories are scanned
+        billPaths = iterBillXmlPaths()
+    changedBillPaths, removed = diffManifest(manifest, billPaths)
+    logger.info('{0} new or changed bills; {1} removed bills'.format(
+        len(changedBillPaths), len(removed)))
+    for entry in removed:
+        for index in index_types.values():
+            getEsClient().delete(index=index,
+                                 id=entry.billnumber_version,
+                                 ignore=[404])
+        if constants.MINHASH_ENABLED:
+            getMinHashIndex().removeBill(entry.billnumber_version)
+        if constants.SECTION_STORE_ENABLED:
+            getSectionStore().removeBill(entry.billnumber_version)
+        del manifest[entry.filePath]
+    return indexBillPaths(changedBillPaths,
+                          bulk=bulk,
+                          manifest=manifest,
+                          manifest_path=manifest_path,
+                          index_types=index_types)
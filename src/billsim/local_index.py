@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+An in-process index of section texts that answers the more_like_this section queries of bill_similarity
+without Elasticsearch. Select it with SIMILARITY_BACKEND=local; the index is loaded from LOCAL_INDEX_PATH.
+
+Sections are scored with BM25 (k1=1.2, b=0.75, as in Elasticsearch), using the query terms that
+more_like_this would select from the query text. The scores are not on the scale of Elasticsearch scores,
+so the default min_score is relative to the query: LOCAL_MIN_SCORE_RATIO of the score of an identical section. Responses have the form of an Elasticsearch search response
+(hits with the best section as inner hit), so they are read by bill_similarity.getSimilarSectionsFromResponse
+like those of utils_es.moreLikeThis.
+
+>>> from billsim.utils import iterBillXmlPaths
+>>> from billsim.local_index import buildLocalIndex
+>>> index = buildLocalIndex(iterBillXmlPaths(congresses=[117]))
+>>> index.save()
+
+Or, from the command line:
+$ python -m billsim.local_index --congress 117 116
+"""
+
+import os
+import re
+import sys
+import math
+import pickle
+import logging
+import argparse
+import threading
+from collections import Counter
+from typing import Iterable, Optional
+
+from billsim import constants
+from billsim.deadline import Deadline
+from billsim.pymodels import BillPath, SectionRecord
+from billsim.utils import getParsedBill, iterBillXmlPaths
+
+logger = logging.getLogger(constants.LOGGER_NAME)
+logger.addHandler(logging.StreamHandler(sys.stdout))
+
+TOKEN_REGEX_COMPILED = re.compile(r'\w+')
+BM25_K1 = 1.2
+BM25_B = 0.75
+# more_like_this default: 30% of the selected query terms must match
+MLT_MINIMUM_SHOULD_MATCH = 0.3
+
+_local_index = None
+_local_index_lock = threading.Lock()
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_REGEX_COMPILED.findall(text.lower())
+
+
+class LocalSectionIndex:
+    """
+    Inverted index of sections: for each term, the sections (by position in self.sections) it occurs in
+    and its frequency in each.
+    A removed bill's sections are kept as deleted, and are still counted in document frequencies
+    (as deleted documents are in Elasticsearch until segments are merged), until the index is compacted.
+    Queries may run concurrently from several threads, but not while bills are added or removed.
+    """
+
+    def __init__(self):
+        # The inner hit _source of each section
+        self.sections: list[dict] = []
+        self.docLengths: list[int] = []
+        self.postings: dict[str, dict[int, int]] = {}
+        self.bills: dict[str, list[int]] = {}
+        self.deleted: set[int] = set()
+        self.totalLength = 0
+
+    @property
+    def numDocs(self) -> int:
+        return len(self.sections) - len(self.deleted)
+
+    def __len__(self) -> int:
+        return self.numDocs
+
+    def addBill(self, billnumber_version: str,
+                sections: list[SectionRecord]):
+        """
+        Index the sections of a bill, replacing the sections it had in the index.
+        """
+        if billnumber_version in self.bills:
+            self.removeBill(billnumber_version)
+        docIds = []
+        for section in sections:
+            docId = len(self.sections)
+            terms = Counter(tokenize(section.text))
+            for term, tf in terms.items():
+                self.postings.setdefault(term, {})[docId] = tf
+            length = sum(terms.values())
+            self.sections.append({
+                'id': billnumber_version,
+                'section_id': section.section_id,
+                'section_number': section.enum,
+                'section_header': section.header,
+                'section_length': section.length
+            })
+            self.docLengths.append(length)
+            self.totalLength += length
+            docIds.append(docId)
+        self.bills[billnumber_version] = docIds
+
+    def addBillPath(self, billPath: BillPath):
+        parsedBill = getParsedBill(billPath.filePath, withXml=False)
+        self.addBill(billPath.billnumber_version, parsedBill.sections)
+
+    def removeBill(self, billnumber_version: str):
+        for docId in self.bills.pop(billnumber_version, []):
+            self.deleted.add(docId)
+            self.totalLength -= self.docLengths[docId]
+
+    def getQueryTerms(self, queryText: str) -> list[str]:
+        """
+        Selects the query terms as more_like_this does: terms that occur at least MLT_MIN_TERM_FREQ times
+        in the text and in at least MLT_MIN_DOC_FREQ sections, the MLT_MAX_QUERY_TERMS highest by tf-idf.
+        """
+        numDocs = self.numDocs
+        if numDocs == 0:
+            return []
+        candidates = []
+        for term, tf in Counter(tokenize(queryText)).items():
+            if tf < constants.MLT_MIN_TERM_FREQ:
+                continue
+            df = len(self.postings.get(term, ()))
+            if df < constants.MLT_MIN_DOC_FREQ:
+                continue
+            candidates.append((tf * (1 + math.log(numDocs / (df + 1))), term))
+        candidates.sort(reverse=True)
+        return [term for _, term in candidates[:constants.MLT_MAX_QUERY_TERMS]]
+
+    def getTermScore(self, idf: float, tf: int, length: int,
+                     avgLength: float) -> float:
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avgLength)
+        return idf * tf / (tf + norm)
+
+    def getIdf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (self.numDocs - df + 0.5) / (df + 0.5))
+
+    def getMinScore(self, queryText: str, queryTerms: list[str]) -> float:
+        """
+        The default min_score of a query: constants.LOCAL_MIN_SCORE_RATIO of the score that a section
+        identical to the query text would get.
+        """
+        if self.numDocs == 0:
+            return 0
+        avgLength = self.totalLength / self.numDocs
+        terms = Counter(tokenize(queryText))
+        length = sum(terms.values())
+        return constants.LOCAL_MIN_SCORE_RATIO * sum(
+            self.getTermScore(self.getIdf(term), terms[term], length, avgLength)
+            for term in queryTerms)
+
+    def scoreSections(self, queryTerms: list[str]) -> dict[int, float]:
+        """
+        BM25 scores of the sections that match at least MLT_MINIMUM_SHOULD_MATCH of the query terms.
+        """
+        numDocs = self.numDocs
+        if numDocs == 0 or not queryTerms:
+            return {}
+        avgLength = self.totalLength / numDocs
+        scores = {}
+        matches = Counter()
+        for term in queryTerms:
+            postings = self.postings.get(term, {})
+            idf = self.getIdf(term)
+            for docId, tf in postings.items():
+                if docId in self.deleted:
+                    continue
+                scores[docId] = scores.get(docId, 0) + self.getTermScore(
+                    idf, tf, self.docLengths[docId], avgLength)
+                matches[docId] += 1
+        minimumShouldMatch = max(
+            1, int(len(queryTerms) * MLT_MINIMUM_SHOULD_MATCH))
+        return {
+            docId: score
+            for docId, score in scores.items()
+            if matches[docId] >= minimumShouldMatch
+        }
+
+    def moreLikeThis(self,
+                     queryText: str,
+                     score_mode: str = constants.SCORE_MODE_MAX,
+                     size: int = constants.MAX_BILLS_SECTION,
+                     min_score: Optional[float] = None) -> dict:
+        """
+        Local equivalent of utils_es.moreLikeThis.
+        Bills are scored from their matching sections with score_mode ('max', 'avg' or 'sum'),
+        and returned with the highest scoring section as inner hit.
+        If min_score is None, bills are returned if they score at least getMinScore of the query.
+
+        Returns:
+            dict: a response of the form of an Elasticsearch search response
+        """
+        queryTerms = self.getQueryTerms(queryText)
+        if min_score is None:
+            min_score = self.getMinScore(queryText, queryTerms)
+        billScores = {}
+        for docId, score in self.scoreSections(queryTerms).items():
+            billnumber_version = self.sections[docId]['id']
+            bestDocId, bestScore, total, count = billScores.get(
+                billnumber_version, (docId, score, 0, 0))
+            if score > bestScore:
+                bestDocId, bestScore = docId, score
+            billScores[billnumber_version] = (bestDocId, bestScore,
+                                              total + score, count + 1)
+        hits = []
+        for billnumber_version, (docId, bestScore, total,
+                                 count) in billScores.items():
+            if score_mode == constants.SCORE_MODE_AVG:
+                score = total / count
+            elif score_mode == constants.SCORE_MODE_SUM:
+                score = total
+            else:
+                score = bestScore
+            if score < min_score:
+                continue
+            hits.append({
+                '_id': billnumber_version,
+                '_score': score,
+                '_source': {
+                    'id': billnumber_version
+                },
+                'inner_hits': {
+                    'sections': {
+                        'hits': {
+                            'max_score': bestScore,
+                            'hits': [{
+                                '_score': bestScore,
+                                '_source': self.sections[docId]
+                            }]
+                        }
+                    }
+                }
+            })
+        hits.sort(key=lambda hit: hit['_score'], reverse=True)
+        hits = hits[:size]
+        return {
+            'hits': {
+                'total': {
+                    'value': len(hits),
+                    'relation': 'eq'
+                },
+                'max_score': hits[0]['_score'] if hits else None,
+                'hits': hits
+            }
+        }
+
+    def compact(self) -> 'LocalSectionIndex':
+        """
+        Returns a copy of the index without the sections of removed bills.
+        """
+        index = LocalSectionIndex()
+        newDocIds = {}
+        for billnumber_version, docIds in self.bills.items():
+            for docId in docIds:
+                newDocIds[docId] = len(index.sections)
+                index.sections.append(self.sections[docId])
+                index.docLengths.append(self.docLengths[docId])
+            index.bills[billnumber_version] = [
+                newDocIds[docId] for docId in docIds
+            ]
+        for term, postings in self.postings.items():
+            termPostings = {
+                newDocIds[docId]: tf
+                for docId, tf in postings.items()
+                if docId in newDocIds
+            }
+            if termPostings:
+                index.postings[term] = termPostings
+        index.totalLength = sum(index.docLengths)
+        return index
+
+    def save(self, path: str = constants.LOCAL_INDEX_PATH):
+        """
+        Save the index, without the sections of removed bills (see compact).
+        Writes to a temporary file first, so an interrupted save does not corrupt the index.
+        """
+        index = self.compact() if self.deleted else self
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = constants.LOCAL_INDEX_PATH) -> 'LocalSectionIndex':
+        with open(path, 'rb') as f:
+            index = pickle.load(f)
+        if not isinstance(index, cls):
+            raise TypeError(f'Not a local section index: {path}')
+        return index
+
+
+def buildLocalIndex(billPaths: Iterable[BillPath]) -> LocalSectionIndex:
+    index = LocalSectionIndex()
+    for billPath in billPaths:
+        try:
+            index.addBillPath(billPath)
+        except Exception as e:
+            logger.error(
+                f'Could not index {billPath.billnumber_version} locally: {e}')
+    logger.info(
+        f'Indexed {index.numDocs} sections of {len(index.bills)} bills locally'
+    )
+    return index
+
+
+def getLocalIndex() -> LocalSectionIndex:
+    """
+    Returns the shared local index, loading it from constants.LOCAL_INDEX_PATH on first use.
+    If there is no saved index, the index is empty.
+    """
+    global _local_index
+    if _local_index is None:
+        with _local_index_lock:
+            if _local_index is None:
+                if os.path.isfile(constants.LOCAL_INDEX_PATH):
+                    _local_index = LocalSectionIndex.load(
+                        constants.LOCAL_INDEX_PATH)
+                else:
+                    logger.warning(
+                        f'No local index found at {constants.LOCAL_INDEX_PATH}'
+                    )
+                    _local_index = LocalSectionIndex()
+    return _local_index
+
+
+def setLocalIndex(index: LocalSectionIndex):
+    """
+    Sets the shared local index, e.g. to an index built in memory for tests.
+    """
+    global _local_index
+    with _local_index_lock:
+        _local_index = index
+
+
+def moreLikeThis(queryText: str,
+                 index: str = constants.INDEX_SECTIONS,
+                 score_mode: str = constants.SCORE_MODE_MAX,
+                 size: int = constants.MAX_BILLS_SECTION,
+                 min_score: Optional[float] = None) -> dict:
+    """
+    The same as utils_es.moreLikeThis, on the shared local index. The index (name) is ignored.
+    If min_score is None, it is relative to the query (see LocalSectionIndex.moreLikeThis).
+    """
+    return getLocalIndex().moreLikeThis(queryText,
+                                        score_mode=score_mode,
+                                        size=size,
+                                        min_score=min_score)
+
+
+def moreLikeThisBatch(queryTexts: list[str],
+                      index: str = constants.INDEX_SECTIONS,
+                      score_mode: str = constants.SCORE_MODE_MAX,
+                      size: int = constants.MAX_BILLS_SECTION,
+                      min_score: Optional[float] = None,
+                      batch_size: int = constants.MSEARCH_BATCH_SIZE,
+                      deadline: Optional[Deadline] = None) -> list:
+    """
+    The same as utils_es.moreLikeThisBatch, on the shared local index. The index (name) and batch_size are ignored.
+    The deadline is checked before each query.
+    """
+    localIndex = getLocalIndex()
+    responses = []
+    for queryText in queryTexts:
+        if deadline is not None:
+            deadline.check()
+        responses.append(
+            localIndex.moreLikeThis(queryText,
+                                    score_mode=score_mode,
+                                    size=size,
+                                    min_score=min_score))
+    return responses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Build the local section index.')
+    parser.add_argument('--congress',
+                        type=int,
+                        nargs='+',
+                        default=[constants.CURRENT_CONGRESS],
+                        help='congresses to index')
+    parser.add_argument('--path',
+                        default=constants.LOCAL_INDEX_PATH,
+                        help='path to save the index')
+    args = parser.parse_args()
+    buildLocalIndex(iterBillXmlPaths(congresses=args.congress)).save(args.path)
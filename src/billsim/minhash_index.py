@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+A MinHash/LSH index of near-duplicate sections.
+Each section is represented by the MinHash signature of its word shingles; signatures are split into bands,
+and sections that share a band are candidates, whose Jaccard similarity is estimated from their signatures.
+
+With MINHASH_ENABLED, elastic_load keeps the index up to date as bills are indexed and saves it to MINHASH_INDEX_PATH.
+With MINHASH_MERGE, bill_similarity adds the near-duplicates of a section (estimated Jaccard similarity of at least
+MINHASH_THRESHOLD) to the results of its query, so that they are found even if the query misses them;
+with MINHASH_SHORTCIRCUIT, a section that has near-duplicates in other bills is not queried.
+The estimated Jaccard similarity (0 to 1) is returned as the score of the similar sections; their score_es,
+the Elasticsearch score, is None.
+Requires numpy (`pip install billsim[minhash]`).
+
+>>> from billsim.minhash_index import getMinHashIndex
+>>> getMinHashIndex().getSimilarSections(constants.forestry_programs)
+"""
+
+import os
+import sys
+import zlib
+import pickle
+import logging
+import threading
+from functools import lru_cache
+from typing import Optional
+
+from billsim import constants
+from billsim.local_index import tokenize
+from billsim.pymodels import SectionMeta, SectionRecord, SimilarSection
+
+logger = logging.getLogger(constants.LOGGER_NAME)
+logger.addHandler(logging.StreamHandler(sys.stdout))
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+# Shingles hashed at a time by getSignature: num_perm x SIGNATURE_CHUNK_SIZE uint64 values (1 MB for 128 permutations)
+SIGNATURE_CHUNK_SIZE = 1024
+
+_minhash_index = None
+_minhash_index_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def getPermutations(num_perm: int = constants.MINHASH_NUM_PERM,
+                    seed: int = constants.MINHASH_SEED):
+    """
+    The parameters (a, b) of the num_perm hash functions (a * x + b) % MERSENNE_PRIME.
+    They depend only on num_perm and seed, so signatures computed in different processes can be compared.
+    """
+    import numpy as np
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def getShingles(text: str,
+                shingle_size: int = constants.MINHASH_SHINGLE_SIZE) -> set[str]:
+    tokens = tokenize(text)
+    return {
+        ' '.join(tokens[i:i + shingle_size])
+        for i in range(max(1,
+                           len(tokens) - shingle_size + 1))
+    } if tokens else set()
+
+
+def getSignature(text: str,
+                 num_perm: int = constants.MINHASH_NUM_PERM,
+                 shingle_size: int = constants.MINHASH_SHINGLE_SIZE,
+                 seed: int = constants.MINHASH_SEED):
+    """
+    Returns the MinHash signature (numpy uint32 array of num_perm values) of the word shingles of the text,
+    or None if the text has no words. The shingles are hashed SIGNATURE_CHUNK_SIZE at a time, so memory use
+    does not grow with the length of the text.
+    """
+    import numpy as np
+    shingles = getShingles(text, shingle_size)
+    if not shingles:
+        return None
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles))
+    a, b = getPermutations(num_perm, seed)
+    signature = np.full(num_perm, MERSENNE_PRIME, dtype=np.uint64)
+    for start in range(0, len(hashes), SIGNATURE_CHUNK_SIZE):
+        hashed = (np.outer(a, hashes[start:start + SIGNATURE_CHUNK_SIZE]) +
+                  b[:, None]) % MERSENNE_PRIME
+        np.minimum(signature, hashed.min(axis=1), out=signature)
+    return (signature & MAX_HASH).astype(np.uint32)
+
+
+def getSectionSignatures(
+    billnumber_version: str,
+    sections: list[SectionRecord],
+    num_perm: int = constants.MINHASH_NUM_PERM,
+    shingle_size: int = constants.MINHASH_SHINGLE_SIZE
+) -> tuple[list[SectionMeta], list]:
+    """
+    Returns the sections (that have text) of a bill and their signatures, for MinHashIndex.addSignatures.
+    Does not use the index, so it can run in a worker process.
+    """
+    sectionMetas = []
+    signatures = []
+    for section in sections:
+        signature = getSignature(section.text, num_perm, shingle_size)
+        if signature is None:
+            continue
+        sectionMetas.append(
+            SectionMeta(billnumber_version=billnumber_version,
+                        section_id=section.section_id,
+                        label=section.enum,
+                        header=section.header,
+                        length=section.length))
+        signatures.append(signature)
+    return sectionMetas, signatures
+
+
+class MinHashIndex:
+    """
+    Signatures of sections and the LSH buckets of their bands.
+    A removed bill's sections are dropped from the buckets when they are found in a query.
+    Queries may run concurrently from several threads, but not while bills are added or removed.
+    """
+
+    def __init__(self,
+                 num_perm: int = constants.MINHASH_NUM_PERM,
+                 bands: int = constants.MINHASH_BANDS,
+                 shingle_size: int = constants.MINHASH_SHINGLE_SIZE):
+        if num_perm % bands != 0:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.sections: list[Optional[SectionMeta]] = []
+        self.signatures: list = []
+        self.buckets: dict[tuple[int, bytes], list[int]] = {}
+        self.bills: dict[str, list[int]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(docIds) for docIds in self.bills.values())
+
+    def getRemovedCount(self) -> int:
+        """
+        The number of sections of removed bills, which are kept until the index is compacted.
+        """
+        return len(self.sections) - len(self)
+
+    def getBandKeys(self, signature) -> list[tuple[int, bytes]]:
+        return [(band, signature[band * self.rows:(band + 1) *
+                                 self.rows].tobytes())
+                for band in range(self.bands)]
+
+    def addSignatures(self, billnumber_version: str,
+                      sectionMetas: list[SectionMeta], signatures: list):
+        """
+        Add the sections of a bill, with signatures from getSectionSignatures, replacing the sections
+        it had in the index.
+        """
+        if billnumber_version in self.bills:
+            self.removeBill(billnumber_version)
+        docIds = []
+        for sectionMeta, signature in zip(sectionMetas, signatures):
+            if len(signature) != self.num_perm:
+                raise ValueError(
+                    f'Signature of {len(signature)} values; the index has {self.num_perm} permutations'
+                )
+            docId = len(self.sections)
+            self.sections.append(sectionMeta)
+            self.signatures.append(signature)
+            for key in self.getBandKeys(signature):
+                self.buckets.setdefault(key, []).append(docId)
+            docIds.append(docId)
+        self.bills[billnumber_version] = docIds
+
+    def addBill(self, billnumber_version: str,
+                sections: list[SectionRecord]):
+        self.addSignatures(
+            billnumber_version, *getSectionSignatures(billnumber_version,
+                                                      sections,
+                                                      self.num_perm,
+                                                      self.shingle_size))
+
+    def removeBill(self, billnumber_version: str):
+        for docId in self.bills.pop(billnumber_version, []):
+            self.sections[docId] = None
+            self.signatures[docId] = None
+
+    def query(self,
+              signature,
+              threshold: float = constants.MINHASH_THRESHOLD
+             ) -> list[tuple[int, float]]:
+        """
+        Returns the sections (docIds) that share a band with the signature and whose
+        estimated Jaccard similarity is at least threshold, with that similarity.
+        """
+        candidates = set()
+        for key in self.getBandKeys(signature):
+            docIds = self.buckets.get(key)
+            if docIds is None:
+                continue
+            if any(self.sections[docId] is None for docId in docIds):
+                docIds[:] = [
+                    docId for docId in docIds
+                    if self.sections[docId] is not None
+                ]
+            candidates.update(docIds)
+        results = []
+        for docId in candidates:
+            similarity = float(
+                (self.signatures[docId] == signature).sum()) / self.num_perm
+            if similarity >= threshold:
+                results.append((docId, similarity))
+        return results
+
+    def getSimilarSections(
+            self,
+            queryText: str,
+            threshold: float = constants.MINHASH_THRESHOLD
+    ) -> list[SimilarSection]:
+        """
+        Near-duplicates of the text: the most similar section of each bill, most similar first.
+        """
+        signature = getSignature(queryText, self.num_perm, self.shingle_size)
+        if signature is None:
+            return []
+        best = {}
+        for docId, similarity in self.query(signature, threshold):
+            billnumber_version = self.sections[docId].billnumber_version
+            if similarity > best.get(billnumber_version, (None, -1))[1]:
+                best[billnumber_version] = (docId, similarity)
+        similarSections = []
+        for docId, similarity in sorted(best.values(),
+                                        key=lambda item: item[1],
+                                        reverse=True):
+            sectionMeta = self.sections[docId]
+            similarSections.append(
+                SimilarSection(
+                    billnumber_version=sectionMeta.billnumber_version,
+                    section_id=sectionMeta.section_id,
+                    label=sectionMeta.label,
+                    header=sectionMeta.header,
+                    length=sectionMeta.length,
+                    score=similarity))
+        return similarSections
+
+    def compact(self) -> 'MinHashIndex':
+        """
+        Returns a copy of the index without the sections of removed bills.
+        """
+        index = MinHashIndex(self.num_perm, self.bands, self.shingle_size)
+        for billnumber_version, docIds in self.bills.items():
+            index.addSignatures(billnumber_version,
+                                [self.sections[docId] for docId in docIds],
+                                [self.signatures[docId] for docId in docIds])
+        return index
+
+    def save(self, path: str = constants.MINHASH_INDEX_PATH):
+        """
+        Save the index, without the sections of removed bills (see compact).
+        Writes to a temporary file first, so an interrupted save does not corrupt the index.
+        """
+        index = self.compact() if self.getRemovedCount() else self
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = constants.MINHASH_INDEX_PATH) -> 'MinHashIndex':
+        with open(path, 'rb') as f:
+            index = pickle.load(f)
+        if not isinstance(index, cls):
+            raise TypeError(f'Not a MinHash index: {path}')
+        return index
+
+
+def getMinHashIndex() -> MinHashIndex:
+    """
+    Returns the shared MinHash index, loading it from constants.MINHASH_INDEX_PATH on first use.
+    If there is no saved index, the index is empty.
+    """
+    global _minhash_index
+    if _minhash_index is None:
+        with _minhash_index_lock:
+            if _minhash_index is None:
+                if os.path.isfile(constants.MINHASH_INDEX_PATH):
+                    _minhash_index = MinHashIndex.load(
+                        constants.MINHASH_INDEX_PATH)
+                else:
+                    logger.info(
+                        f'No MinHash index found at {constants.MINHASH_INDEX_PATH}'
+                    )
+                    _minhash_index = MinHashIndex()
+    return _minhash_index
+
+
+def setMinHashIndex(index: MinHashIndex):
+    global _minhash_index
+    with _minhash_index_lock:
+        _minhash_index = index
+
+
+def saveMinHashIndex(path: str = constants.MINHASH_INDEX_PATH):
+    """
+    Saves the shared MinHash index, if it has been loaded. If bills were removed, the shared index is
+    replaced by its compacted copy, which is saved.
+    """
+    index = _minhash_index
+    if index is None:
+        return
+    if index.getRemovedCount():
+        index = index.compact()
+        setMinHashIndex(index)
+    index.save(path)
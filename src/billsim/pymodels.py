@@ -4,7 +4,7 @@ from sqlalchemy.sql.schema import UniqueConstraint, Index
 from sqlalchemy.sql.sqltypes import ARRAY, VARCHAR, String
 from sqlalchemy.ext.declarative import declared_attr
 from sqlmodel import Field, SQLModel, Column, Integer, Sequence
-from typing import List, Optional
+from typing import Any, List, NamedTuple, Optional
 from billsim.database import engine
 from datetime import datetime
 
@@ -20,6 +20,68 @@ class BillPath(SQLModel):
     fileName: str = ''
 
 
+# An entry in the index manifest (see billsim.utils_manifest)
+class ManifestEntry(SQLModel):
+    billnumber_version: str
+    filePath: str
+    size: int
+    mtime: float
+    content_hash: str
+    length: Optional[int] = None    # character length, see billsim.utils.getBillLengthbyPath
+    indexed_at: Optional[datetime] = None
+
+
+# A bill file in the bill catalog (see billsim.bill_catalog)
+class CatalogEntry(NamedTuple):
+    billnumber_version: str
+    filePath: str
+    fileName: str
+    size: int
+    mtime: float
+    congress: Optional[int]
+    bill_type: str    # e.g. 'hr', 's', 'hres'
+    version: str
+
+
+# A section extracted from bill XML (see billsim.utils.getSectionRecords)
+class SectionRecord(NamedTuple):
+    section_id: str
+    enum: str
+    header: str
+    text: str
+    length: int
+    xml: Optional[str] = None
+
+
+# Bill metadata extracted from bill XML (see billsim.utils.getBillMeta)
+class BillMeta(NamedTuple):
+    congress: str
+    session: str
+    dctitle: str
+    date: Optional[str]
+    legisnum: str
+    headers: list[str]    # deduplicated, in document order
+    dublinCore: Optional[str] = None
+
+
+# Metadata and sections of a bill, extracted in one traversal (see billsim.bill_extractor.extractBill)
+class ExtractedBill(NamedTuple):
+    meta: BillMeta
+    sections: list[SectionRecord]
+
+
+# A parsed bill, as held in the bill cache (see billsim.utils.getParsedBill)
+class ParsedBill(NamedTuple):
+    filePath: str
+    mtime: float
+    length: int
+    defaultNS: str
+    meta: BillMeta
+    sections: list[SectionRecord]
+    hasXml: bool    # whether the section records include section XML
+    text: Optional[str] = None    # full text of the bill, if requested
+
+
 class SectionMeta(SQLModel):
     billnumber_version: Optional[str] = None
     section_id: Optional[str] = None
@@ -28,19 +90,32 @@ class SectionMeta(SQLModel):
     length: Optional[int] = None
 
 
+# score_es is the score of the query that found the section; score is a similarity (0 to 1) for matches
+# found without a query (MinHash near-duplicates, corpus mode). getScore is the score that is saved.
 class SimilarSection(SectionMeta):
     score_es: Optional[float] = None
     score: Optional[float] = None
     score_to: Optional[float] = None
 
+    def getScore(self) -> Optional[float]:
+        return self.score_es if self.score_es is not None else self.score
+
 
 class Section(SectionMeta):
     similar_sections: list[SimilarSection]
 
 
 # This is the basis for making queries, using billsim.bill_similarity.py getSimilarSectionItem
+# The text is query_text or, for sections read from the section corpus, a lazy reference to it
+# (billsim.section_store.SectionText), which is only read when the query is made
 class QuerySection(SectionMeta):
-    query_text: str
+    query_text: Optional[str] = None
+    text_ref: Optional[Any] = None
+
+    def getQueryText(self) -> str:
+        if self.query_text is None and self.text_ref is not None:
+            return self.text_ref.getText()
+        return self.query_text or ''
 
 
 # Result of the similarity search, collecting top similar sections for each section of the bill
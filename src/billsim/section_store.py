@@ -0,0 +1,673 @@
+#!/usr/bin/env python3
+"""
+A compact, columnar, on-disk store of the sections extracted from bills, so that jobs that need section texts
+(similarity, scoring, loading the database) can read them without parsing the bill XML again.
+
+The store has one directory per Congress, to which bills are appended. Each column of the sections
+(section_id, enum, header, text) is a blob of UTF-8 values, one after the other (<column>.bin), and an array
+of the end offset of each value in the blob (<column>.idx, little-endian int64). The sections of a bill are
+consecutive rows; the rows of each bill are recorded in an append-only index (bills.jsonl), which is loaded
+into a dict. Fetching the sections of a bill is a dict lookup and reads of the memory-mapped files at known
+offsets, whatever the size of the store.
+
+A bill that is appended again replaces the earlier version (its rows are left in the files, unused);
+a removed bill is recorded in the index. There is one writer per Congress at a time; readers in other
+processes see new bills after refresh().
+
+The unused rows of replaced and removed bills take space until the store is compacted: compact() rewrites
+the files of a Congress with only the rows of the bills in the index. It is meant to run between loads, when
+no other process is reading or writing the Congress; readers that refresh() afterwards read the new files,
+but SectionText references taken before the compaction are no longer valid.
+
+With SECTION_STORE_ENABLED, elastic_load adds the sections of each bill it indexes to the store at
+SECTION_STORE_PATH. To add the bills of some Congresses from the command line:
+$ python -m billsim.section_store --congress 117 116
+
+To compact the store (the Congresses given, or all):
+$ python -m billsim.section_store --compact --congress 117
+
+>>> from billsim.section_store import getSectionStore
+>>> getSectionStore().getSections('117hr200ih')
+
+Jobs that read many section texts (e.g. comparisons of whole Congresses) use the store through a SectionCorpus,
+which hands out the texts as views of the memory maps, without holding a copy of each text:
+
+>>> from billsim.section_store import getSectionCorpus
+>>> getSectionCorpus().getMemoryView('117hr200ih', 0)
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+import logging
+import argparse
+import threading
+from typing import Iterator, Optional
+
+from billsim import constants
+from billsim.pymodels import SectionRecord
+from billsim.utils import iterBillXmlPaths, parseBill
+
+logger = logging.getLogger(constants.LOGGER_NAME)
+logger.addHandler(logging.StreamHandler(sys.stdout))
+
+SECTION_COLUMNS = ['section_id', 'enum', 'header', 'text']
+BILLS_INDEX_FILE = 'bills.jsonl'
+# Directory of bills whose billnumber_version does not have a Congress
+OTHER_CONGRESS_DIR = 'other'
+OFFSET_SIZE = 8
+
+_section_store = None
+_section_store_lock = threading.Lock()
+_section_corpus = None
+# The text column of each Congress directory, for SectionText (see getTextColumn)
+_text_columns = {}
+_text_columns_lock = threading.Lock()
+
+
+def getCongressDir(billnumber_version: str) -> str:
+    match = constants.BILL_NUMBER_PART_REGEX_COMPILED.match(billnumber_version)
+    if match is None:
+        return OTHER_CONGRESS_DIR
+    return match.group('congress')
+
+
+class MappedFile:
+    """
+    A read-only memory map of a file that is appended to; it is mapped again when a read goes past its end.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mmap = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def getBuffer(self, end: int) -> mmap.mmap:
+        """
+        The map of the file, covering at least the first end bytes.
+        """
+        if end > self._size:
+            with self._lock:
+                if end > self._size:
+                    self.remap()
+            if end > self._size:
+                raise ValueError(f'{self.path} is shorter than {end} bytes')
+        return self._mmap
+
+    def remap(self):
+        if not os.path.isfile(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # The previous map is not closed: slices of it may still be in use; it is unmapped once unreferenced
+        self._mmap = mapped
+        self._size = len(mapped)
+
+
+class StringColumn:
+    """
+    A column of str values: a blob of UTF-8 values (<name>.bin) and the end offset of each value (<name>.idx).
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.dataPath = os.path.join(directory, f'{name}.bin')
+        self.endsPath = os.path.join(directory, f'{name}.idx')
+        self._data = MappedFile(self.dataPath)
+        self._ends = MappedFile(self.endsPath)
+
+    def getOffsets(self, start: int, count: int) -> tuple[int, ...]:
+        """
+        The start offset of row start, and the end offsets of the count rows from row start.
+        """
+        if start == 0:
+            ends = self._ends.getBuffer(count * OFFSET_SIZE)
+            return (0,) + struct.unpack_from(f'<{count}q', ends, 0)
+        ends = self._ends.getBuffer((start + count) * OFFSET_SIZE)
+        return struct.unpack_from(f'<{count + 1}q', ends,
+                                  (start - 1) * OFFSET_SIZE)
+
+    def getValues(self, start: int, count: int) -> list[str]:
+        if count == 0:
+            return []
+        offsets = self.getOffsets(start, count)
+        if offsets[-1] == offsets[0]:
+            return [''] * count
+        data = self._data.getBuffer(offsets[-1])
+        return [
+            data[offsets[i]:offsets[i + 1]].decode('utf-8')
+            for i in range(count)
+        ]
+
+    def getView(self, row: int) -> memoryview:
+        """
+        The UTF-8 bytes of the value of the row, as a view of the memory map (not a copy).
+        """
+        start, end = self.getOffsets(row, 1)
+        if end == start:
+            return memoryview(b'')
+        return memoryview(self._data.getBuffer(end))[start:end]
+
+    def getRowCount(self) -> int:
+        if not os.path.isfile(self.endsPath):
+            return 0
+        return os.path.getsize(self.endsPath) // OFFSET_SIZE
+
+    def reopen(self):
+        """
+        Maps the files again, e.g. after they were replaced by compact().
+        """
+        self._data = MappedFile(self.dataPath)
+        self._ends = MappedFile(self.endsPath)
+
+    def compact(self, rows: list[tuple[int, int]]) -> tuple[str, str, int]:
+        """
+        Writes the values of the rows, given as (first row, number of rows), to temporary files, and returns
+        their paths (blob, offsets) and the size of the blob. The column is left as it is.
+        """
+        dataPath = self.dataPath + '.compact'
+        endsPath = self.endsPath + '.compact'
+        dataSize = 0
+        with open(dataPath, 'wb') as data, open(endsPath, 'wb') as ends:
+            for start, count in rows:
+                if count == 0:
+                    continue
+                offsets = self.getOffsets(start, count)
+                first, last = offsets[0], offsets[-1]
+                if last > first:
+                    data.write(self._data.getBuffer(last)[first:last])
+                ends.write(
+                    struct.pack(
+                        f'<{count}q',
+                        *(end - first + dataSize for end in offsets[1:])))
+                dataSize += last - first
+        return dataPath, endsPath, dataSize
+
+    def repair(self, maxRows: Optional[int] = None) -> int:
+        """
+        Truncates a partial write (of the offsets, or of values without offsets), and the rows after maxRows,
+        and returns the number of rows.
+        """
+        for path in (self.dataPath, self.endsPath):
+            if not os.path.exists(path):
+                open(path, 'ab').close()
+        rows = os.path.getsize(self.endsPath) // OFFSET_SIZE
+        if maxRows is not None:
+            rows = min(rows, maxRows)
+        dataSize = 0
+        with open(self.endsPath, 'r+b') as f:
+            f.truncate(rows * OFFSET_SIZE)
+            if rows:
+                f.seek((rows - 1) * OFFSET_SIZE)
+                dataSize = struct.unpack('<q', f.read(OFFSET_SIZE))[0]
+        if os.path.getsize(self.dataPath) < dataSize:
+            raise ValueError(f'{self.dataPath} is shorter than its offsets')
+        with open(self.dataPath, 'r+b') as f:
+            f.truncate(dataSize)
+        return rows
+
+    def append(self, values: list[str], dataSize: int) -> int:
+        """
+        Appends the values to a blob of dataSize bytes, and returns the new size of the blob.
+        """
+        encoded = [value.encode('utf-8') for value in values]
+        ends = []
+        for value in encoded:
+            dataSize += len(value)
+            ends.append(dataSize)
+        with open(self.dataPath, 'ab') as f:
+            f.write(b''.join(encoded))
+        with open(self.endsPath, 'ab') as f:
+            f.write(struct.pack(f'<{len(ends)}q', *ends))
+        return dataSize
+
+
+class CongressSectionStore:
+    """
+    The sections of the bills of one Congress (a directory of the store).
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.indexPath = os.path.join(directory, BILLS_INDEX_FILE)
+        self.columns = {
+            name: StringColumn(directory, name) for name in SECTION_COLUMNS
+        }
+        # billnumber_version: (first row, number of rows)
+        self.bills: dict[str, tuple[int, int]] = {}
+        self._indexOffset = 0
+        # The inode of the index that was read; a new inode means that the store was compacted
+        self._indexInode = None
+        # Rows and blob sizes of the columns, read when this process first appends
+        self._rows = None
+        self._dataSizes = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """
+        Reads the bills appended to the index since it was last read (e.g. by another process).
+        """
+        with self._lock:
+            self.readIndex()
+
+    def readIndex(self):
+        if not os.path.isfile(self.indexPath):
+            return
+        with open(self.indexPath, 'rb') as f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self._indexInode:
+                if self._indexInode is not None:
+                    # The files were rewritten by compact() in another process
+                    self.bills = {}
+                    self._indexOffset = 0
+                    self._rows = None
+                    for column in self.columns.values():
+                        column.reopen()
+                    textColumn = _text_columns.get(self.directory)
+                    if textColumn is not None:
+                        textColumn.reopen()
+                self._indexInode = inode
+            f.seek(self._indexOffset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # A line that is being written
+                    break
+                self._indexOffset += len(line)
+                billnumber_version, start, count = json.loads(line)
+                if start is None:
+                    self.bills.pop(billnumber_version, None)
+                else:
+                    self.bills[billnumber_version] = (start, count)
+
+    def writeIndexEntry(self, billnumber_version: str, start: Optional[int],
+                        count: int):
+        line = (json.dumps([billnumber_version, start, count]) +
+                '\n').encode('utf-8')
+        with open(self.indexPath, 'ab') as f:
+            f.write(line)
+        self._indexOffset += len(line)
+
+    def prepareAppend(self):
+        if self._rows is not None:
+            return
+        # Bills written by another process since the last refresh
+        self.readIndex()
+        rows = [column.repair() for column in self.columns.values()]
+        if len(set(rows)) > 1:
+            # An append that was interrupted: the rows of its bill are not in the index
+            rows = [column.repair(min(rows)) for column in self.columns.values()]
+        self._rows = rows[0]
+        self._dataSizes = {
+            name: os.path.getsize(column.dataPath)
+            for name, column in self.columns.items()
+        }
+
+    def addBill(self, billnumber_version: str, sections: list[SectionRecord]):
+        with self._lock:
+            self.prepareAppend()
+            start = self._rows
+            try:
+                for name, column in self.columns.items():
+                    self._dataSizes[name] = column.append(
+                        [getattr(section, name) or '' for section in sections],
+                        self._dataSizes[name])
+            except Exception:
+                # The next append truncates the columns to the rows of the bills in the index
+                self._rows = None
+                raise
+            self._rows += len(sections)
+            self.writeIndexEntry(billnumber_version, start, len(sections))
+            self.bills[billnumber_version] = (start, len(sections))
+
+    def removeBill(self, billnumber_version: str):
+        with self._lock:
+            if self.bills.pop(billnumber_version, None) is not None:
+                self.writeIndexEntry(billnumber_version, None, 0)
+
+    def getUnusedRows(self) -> int:
+        """
+        The number of rows in the files that are not used by a bill in the index (of replaced or removed bills).
+        """
+        with self._lock:
+            self.readIndex()
+            return self.columns['text'].getRowCount() - sum(
+                count for _, count in self.bills.values())
+
+    def compact(self) -> int:
+        """
+        Rewrites the files with only the rows of the bills in the index, and returns the number of rows removed.
+        """
+        with self._lock:
+            self.prepareAppend()
+            unusedRows = self._rows - sum(
+                count for _, count in self.bills.values())
+            if unusedRows == 0:
+                return 0
+            bills = sorted(self.bills.items(), key=lambda item: item[1][0])
+            rows = [bill[1] for bill in bills]
+            compacted = {
+                name: column.compact(rows)
+                for name, column in self.columns.items()
+            }
+            indexPath = self.indexPath + '.compact'
+            start = 0
+            with open(indexPath, 'wb') as f:
+                for billnumber_version, (_, count) in bills:
+                    f.write((json.dumps([billnumber_version, start, count]) +
+                             '\n').encode('utf-8'))
+                    self.bills[billnumber_version] = (start, count)
+                    start += count
+            for name, column in self.columns.items():
+                dataPath, endsPath, dataSize = compacted[name]
+                os.replace(dataPath, column.dataPath)
+                os.replace(endsPath, column.endsPath)
+                column.reopen()
+                self._dataSizes[name] = dataSize
+            # The index is replaced last: readers in other processes reload the store when its inode changes
+            os.replace(indexPath, self.indexPath)
+            self._indexInode = os.stat(self.indexPath).st_ino
+            self._indexOffset = os.path.getsize(self.indexPath)
+            self._rows = start
+            return unusedRows
+
+    def getRows(self, billnumber_version: str) -> Optional[tuple[int, int]]:
+        rows = self.bills.get(billnumber_version)
+        if rows is None:
+            self.refresh()
+            rows = self.bills.get(billnumber_version)
+        return rows
+
+    def getSections(self,
+                    billnumber_version: str) -> Optional[list[SectionRecord]]:
+        rows = self.getRows(billnumber_version)
+        if rows is None:
+            return None
+        values = {
+            name: column.getValues(*rows)
+            for name, column in self.columns.items()
+        }
+        return [
+            SectionRecord(section_id=section_id,
+                          enum=enum,
+                          header=header,
+                          text=text,
+                          length=len(text))
+            for section_id, enum, header, text in zip(*(
+                values[name] for name in SECTION_COLUMNS))
+        ]
+
+    def getSectionTexts(self, billnumber_version: str) -> Optional[list[str]]:
+        rows = self.getRows(billnumber_version)
+        if rows is None:
+            return None
+        return self.columns['text'].getValues(*rows)
+
+    def getSectionIds(self, billnumber_version: str) -> Optional[list[str]]:
+        rows = self.getRows(billnumber_version)
+        if rows is None:
+            return None
+        return self.columns['section_id'].getValues(*rows)
+
+
+class SectionStore:
+    """
+    The section store at path (created if it does not exist), with a CongressSectionStore for each Congress.
+    Thread-safe.
+    """
+
+    def __init__(self, path: str = constants.SECTION_STORE_PATH):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._congressStores: dict[str, CongressSectionStore] = {}
+        self._lock = threading.Lock()
+
+    def getCongressStore(self, congress) -> CongressSectionStore:
+        congress = str(congress)
+        store = self._congressStores.get(congress)
+        if store is None:
+            with self._lock:
+                store = self._congressStores.get(congress)
+                if store is None:
+                    store = CongressSectionStore(
+                        os.path.join(self.path, congress))
+                    self._congressStores[congress] = store
+        return store
+
+    def getCongresses(self) -> list[str]:
+        return sorted(entry.name
+                      for entry in os.scandir(self.path)
+                      if entry.is_dir())
+
+    def addBill(self, billnumber_version: str, sections: list[SectionRecord]):
+        """
+        Appends the sections of the bill (without their XML) to the store of its Congress.
+        """
+        self.getCongressStore(
+            getCongressDir(billnumber_version)).addBill(billnumber_version,
+                                                        sections)
+
+    def removeBill(self, billnumber_version: str):
+        self.getCongressStore(
+            getCongressDir(billnumber_version)).removeBill(billnumber_version)
+
+    def getSections(self,
+                    billnumber_version: str) -> Optional[list[SectionRecord]]:
+        """
+        The sections of the bill (with xml=None), in order, or None if the bill is not in the store.
+        """
+        return self.getCongressStore(
+            getCongressDir(billnumber_version)).getSections(billnumber_version)
+
+    def getSectionTexts(self, billnumber_version: str) -> Optional[list[str]]:
+        return self.getCongressStore(getCongressDir(
+            billnumber_version)).getSectionTexts(billnumber_version)
+
+    def getSectionIds(self, billnumber_version: str) -> Optional[list[str]]:
+        """
+        The section_ids of the bill, in order, or None if the bill is not in the store. Reads no texts.
+        """
+        return self.getCongressStore(getCongressDir(
+            billnumber_version)).getSectionIds(billnumber_version)
+
+    def compact(self, congresses: Optional[list] = None) -> int:
+        """
+        Compacts the stores of the Congresses (default: all), and returns the number of rows removed.
+        """
+        removed = 0
+        for congress in (congresses or self.getCongresses()):
+            removed += self.getCongressStore(congress).compact()
+        return removed
+
+    def getSection(self, billnumber_version: str,
+                   section_id: str) -> Optional[SectionRecord]:
+        for section in self.getSections(billnumber_version) or []:
+            if section.section_id == section_id:
+                return section
+        return None
+
+    def iterBillnumbers(self, congresses: Optional[list] = None) -> Iterator[str]:
+        for congress in (congresses or self.getCongresses()):
+            store = self.getCongressStore(congress)
+            store.refresh()
+            yield from sorted(store.bills)
+
+    def __contains__(self, billnumber_version: str) -> bool:
+        return self.getCongressStore(getCongressDir(
+            billnumber_version)).getRows(billnumber_version) is not None
+
+
+def getTextColumn(directory: str) -> StringColumn:
+    column = _text_columns.get(directory)
+    if column is None:
+        with _text_columns_lock:
+            column = _text_columns.setdefault(directory,
+                                              StringColumn(directory, 'text'))
+    return column
+
+
+class SectionText:
+    """
+    A lazy reference to the text of a section in a SectionCorpus: the text is only read from the memory map,
+    and decoded, when it is used. A reference is small and can be pickled (e.g. to a worker process, which
+    maps the files itself).
+    """
+    __slots__ = ('directory', 'row')
+
+    def __init__(self, directory: str, row: int):
+        self.directory = directory
+        self.row = row
+
+    def getMemoryView(self) -> memoryview:
+        """
+        The UTF-8 bytes of the text, as a view of the memory map (not a copy).
+        """
+        return getTextColumn(self.directory).getView(self.row)
+
+    def getText(self) -> str:
+        return str(self.getMemoryView(), 'utf-8')
+
+    def __str__(self) -> str:
+        return self.getText()
+
+    def __repr__(self) -> str:
+        return f'SectionText({self.directory!r}, {self.row})'
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SectionText) and (
+            self.directory, self.row) == (other.directory, other.row)
+
+    def __hash__(self) -> int:
+        return hash((self.directory, self.row))
+
+
+class SectionCorpus:
+    """
+    A read-only view of the section texts of a SectionStore, by (bill, section index): each Congress is one
+    memory-mapped UTF-8 file and an array of offsets, and texts are handed out as memoryview slices of the map,
+    as str decoded on demand, or as lazy SectionText references. The texts of a whole Congress take no memory
+    beyond the pages of the map that are in use.
+    """
+
+    def __init__(self, store: Optional[SectionStore] = None):
+        self.store = store if store is not None else getSectionStore()
+
+    def getRows(self, billnumber_version: str) -> Optional[tuple[str, int, int]]:
+        """
+        The Congress directory, first row and number of sections of the bill, or None if it is not in the corpus.
+        """
+        congressStore = self.store.getCongressStore(
+            getCongressDir(billnumber_version))
+        rows = congressStore.getRows(billnumber_version)
+        if rows is None:
+            return None
+        if congressStore.directory not in _text_columns:
+            # SectionText references use the maps of this store
+            with _text_columns_lock:
+                _text_columns.setdefault(congressStore.directory,
+                                         congressStore.columns['text'])
+        return (congressStore.directory,) + rows
+
+    def getSectionCount(self, billnumber_version: str) -> Optional[int]:
+        rows = self.getRows(billnumber_version)
+        return None if rows is None else rows[2]
+
+    def getSectionTexts(self,
+                        billnumber_version: str) -> Optional[list[SectionText]]:
+        """
+        Lazy references to the texts of the sections of the bill, in order, or None if it is not in the corpus.
+        """
+        rows = self.getRows(billnumber_version)
+        if rows is None:
+            return None
+        directory, start, count = rows
+        return [SectionText(directory, row) for row in range(start, start + count)]
+
+    def getSectionText(self, billnumber_version: str, index: int) -> SectionText:
+        """
+        Raises:
+            KeyError: the bill is not in the corpus
+            IndexError: the bill does not have a section at index
+        """
+        rows = self.getRows(billnumber_version)
+        if rows is None:
+            raise KeyError(billnumber_version)
+        directory, start, count = rows
+        if not 0 <= index < count:
+            raise IndexError(
+                f'{billnumber_version} has {count} sections, not {index + 1}')
+        return SectionText(directory, start + index)
+
+    def getMemoryView(self, billnumber_version: str, index: int) -> memoryview:
+        return self.getSectionText(billnumber_version, index).getMemoryView()
+
+    def getText(self, billnumber_version: str, index: int) -> str:
+        return self.getSectionText(billnumber_version, index).getText()
+
+
+def getSectionStore() -> SectionStore:
+    """
+    Returns the shared section store, at constants.SECTION_STORE_PATH.
+    """
+    global _section_store
+    if _section_store is None:
+        with _section_store_lock:
+            if _section_store is None:
+                _section_store = SectionStore(constants.SECTION_STORE_PATH)
+    return _section_store
+
+
+def getSectionCorpus() -> SectionCorpus:
+    """
+    Returns the corpus of the shared section store (see getSectionStore).
+    """
+    global _section_corpus
+    if _section_corpus is None:
+        store = getSectionStore()
+        with _section_store_lock:
+            if _section_corpus is None:
+                _section_corpus = SectionCorpus(store)
+    return _section_corpus
+
+
+def addBillPaths(store: SectionStore, billPaths) -> int:
+    """
+    Parses the bills and adds their sections to the store; returns the number of bills added.
+    """
+    added = 0
+    for billPath in billPaths:
+        try:
+            parsedBill = parseBill(billPath.filePath, withXml=False)
+        except Exception as e:
+            logger.error(f'Could not parse {billPath.filePath}: {e}')
+            continue
+        store.addBill(billPath.billnumber_version, parsedBill.sections)
+        added += 1
+    return added
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Add the sections of bills to the section store.')
+    parser.add_argument('--congress',
+                        type=int,
+                        nargs='+',
+                        default=None,
+                        help='congresses to add (default: all)')
+    parser.add_argument('--path',
+                        default=constants.SECTION_STORE_PATH,
+                        help='path to the section store')
+    parser.add_argument('--compact',
+                        action='store_true',
+                        help='compact the store instead of adding bills')
+    args = parser.parse_args()
+    if args.compact:
+        removed = SectionStore(args.path).compact(args.congress)
+        logger.info(f'Removed {removed} unused rows from {args.path}')
+        sys.exit(0)
+    added = addBillPaths(SectionStore(args.path),
+                         iterBillXmlPaths(congresses=args.congress))
+    logger.info(f'Added {added} bills to the section store at {args.path}')
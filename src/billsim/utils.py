@@ -3,16 +3,25 @@
 from functools import reduce
 import os, sys
 import re
+import json
+import codecs
 import logging
-from typing import List
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, List, Optional, Union
 from lxml import etree
 from xml.etree import ElementTree
 
-from billsim.constants import LOGGER_NAME, PATHTYPE_DEFAULT, PATHTYPE_OBJ, CURRENT_CONGRESS, PATH_TO_CONGRESSDATA_DIR, CONGRESS_DIRS, BILL_NUMBER_PART_REGEX_COMPILED
-from billsim.pymodels import BillPath
+from billsim.constants import LOGGER_NAME, PATHTYPE_DEFAULT, PATHTYPE_OBJ, PATH_TO_CONGRESSDATA_DIR, CONGRESS_DIRS, BILL_NUMBER_PART_REGEX_COMPILED, BILL_CACHE_MAX_BYTES, PARSE_STREAM_MIN_BYTES, SCAN_WORKERS, NAMESPACE_DC, NAMESPACE_USLM2
+from billsim.pymodels import BillMeta, BillPath, ParsedBill, SectionRecord
+from billsim.bill_extractor import BillMetaExtractor, extractBill
+from billsim.xpath_extractor import SECTION_EXTRACTOR
 
 import traceback
 
+LENGTH_CHUNK_BYTES = 1024 * 1024
+
 #logging.basicConfig(filename='utils.log', filemode='w', level='INFO')
 logger = logging.getLogger(LOGGER_NAME)
 logger.addHandler(logging.StreamHandler(sys.stdout))
@@ -71,39 +80,383 @@ def getIdentifier(section) -> str:
 
 # NOTE: USLM uses 'num', bill dtd uses 'enum'
 def getEnum(section, defaultNS=None) -> str:
-    if defaultNS is not None and len(defaultNS) > 0:
-        enumpath = section.xpath('ns:enum | ns:num',
-                                 namespaces={'ns': defaultNS})
-    else:
-        enumpath = section.xpath('enum | num')
-    if enumpath is not None and len(
-            enumpath) > 0 and enumpath[0].text is not None:
-        return enumpath[0].text.strip()
-    return ''
+    return SECTION_EXTRACTOR.getEnum(section, defaultNS)
 
 
 # NOTE: USLM uses 'heading', bill dtd uses 'header'
 def getHeader(section, defaultNS=None) -> str:
-    if defaultNS is not None and len(defaultNS) > 0:
-        headerpath = section.xpath('ns:header | ns:heading',
-                                   namespaces={'ns': defaultNS})
-    else:
-        headerpath = section.xpath('header | heading')
-    if headerpath is not None and len(
-            headerpath) > 0 and headerpath[0].text is not None:
-        return headerpath[0].text.strip()
-    return ''
+    return SECTION_EXTRACTOR.getHeader(section, defaultNS)
 
 
 def getSections(billTree, namespace=None) -> List:
-    if namespace is not None and len(namespace) > 0:
-        sections = billTree.xpath(
-            '//ns:section[not(ancestor::ns:section) and not(@status="withdrawn")]',
-            namespaces={'ns': namespace})
+    return SECTION_EXTRACTOR.getSections(billTree, namespace)
+
+
+def getSectionRecords(billTree,
+                      defaultNS=None,
+                      withXml: bool = True) -> list[SectionRecord]:
+    """
+    Extracts the top-level, non-withdrawn sections of a bill, serializing the text (and XML) of each section once.
+
+    Args:
+        billTree: parsed bill (e.g. from parseFilePath)
+        defaultNS (str, optional): default namespace of the bill. Defaults to None.
+        withXml (bool, optional): whether to include the section XML. Defaults to True.
+
+    Returns:
+        list[SectionRecord]: section id, enum, header, text, length and (optionally) xml of each section
+    """
+    return [
+        makeSectionRecord(section, defaultNS, withXml=withXml)
+        for section in getSections(billTree, defaultNS)
+    ]
+
+
+def makeSectionRecord(section, defaultNS=None,
+                      withXml: bool = True) -> SectionRecord:
+    text = etree.tostring(section, method="text", encoding="unicode")
+    xml = etree.tostring(section, method="xml",
+                         encoding="unicode") if withXml else None
+    return SectionRecord(section_id=getId(section),
+                         enum=getEnum(section, defaultNS),
+                         header=getHeader(section, defaultNS),
+                         text=text,
+                         length=len(text),
+                         xml=xml)
+
+
+def iterSectionRecords(
+    filePath: str,
+    withXml: bool = True,
+    metaExtractor: Optional[BillMetaExtractor] = None
+) -> Iterator[SectionRecord]:
+    """
+    Streaming version of getSectionRecords, for very large bills: parses the file with etree.iterparse and
+    yields the top-level, non-withdrawn sections one at a time, as they are parsed.
+    Elements are cleared once they have been processed, so memory does not grow with the size of the bill.
+    Handles USLM (sections in the default namespace) and the bill DTD (no namespace), as getSections does.
+
+    Args:
+        filePath (str): path to the bill XML
+        withXml (bool, optional): whether to include the section XML. Defaults to True.
+        metaExtractor (BillMetaExtractor, optional): collects the metadata of the bill in the same pass
+            (see parseBill). Defaults to None.
+
+    Yields:
+        SectionRecord: the same records, in the same order, as getSectionRecords
+    """
+    defaultNS = None
+    sectionTag = None
+    depth = 0
+    # A section is yielded at the next event, when its tail (included in its text, as in getSectionRecords) is parsed
+    pending = None
+    try:
+        for event, element in etree.iterparse(filePath,
+                                              events=('start', 'end')):
+            if pending is not None:
+                yield makeSectionRecord(pending, defaultNS, withXml=withXml)
+                clearElement(pending)
+                pending = None
+            if sectionTag is None:
+                # The first event is the start of the root element
+                defaultNS = element.nsmap.get(None, '')
+                sectionTag = '{%s}section' % defaultNS if defaultNS else 'section'
+                if metaExtractor is not None:
+                    metaExtractor.setNamespace(defaultNS)
+            if metaExtractor is not None and event == 'end' and element.tag in metaExtractor.tags:
+                metaExtractor.add(element)
+            if element.tag != sectionTag:
+                if event == 'end' and depth == 0 and not (
+                        metaExtractor is not None
+                        and metaExtractor.keeps(element)):
+                    # Any sections it contains have been processed
+                    clearElement(element)
+                continue
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 0:
+                if element.get('status') == 'withdrawn':
+                    clearElement(element)
+                else:
+                    pending = element
+        if pending is not None:
+            yield makeSectionRecord(pending, defaultNS, withXml=withXml)
+    except etree.XMLSyntaxError as e:
+        logger.error('Exception: {}'.format(e))
+        raise Exception('Could not parse bill: {}'.format(filePath))
+
+
+def clearElement(element):
+    """
+    Frees a processed element, and its processed preceding siblings, during etree.iterparse.
+    """
+    element.clear(keep_tail=True)
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def getBillMeta(billTree, defaultNS: str = '', filePath: str = '') -> BillMeta:
+    """
+    Extracts the metadata (congress, session, title, date, legisnum, headers, dublinCore) of a bill.
+
+    Args:
+        billTree: parsed bill (e.g. from parseFilePath)
+        defaultNS (str, optional): default namespace of the bill. Defaults to ''.
+        filePath (str, optional): path to the bill, used to find a data.json with the date for some bills. Defaults to ''.
+
+    Returns:
+        BillMeta: the bill metadata
+    """
+    dublinCore = None
+    if defaultNS and defaultNS == NAMESPACE_USLM2:
+        logger.debug('Parsing bill WITH USLM2')
+        logger.debug('defaultNS: {}'.format(defaultNS))
+        dcdate = getText(
+            billTree.xpath('//uslm:meta/dc:date',
+                           namespaces={
+                               'uslm': defaultNS,
+                               'dc': NAMESPACE_DC
+                           }))
+        congress = billTree.xpath('//uslm:meta/uslm:congress',
+                                  namespaces={'uslm': defaultNS})
+        congress_text = re.sub(r'[a-zA-Z ]+$', '', getText(congress))
+        session = billTree.xpath('//uslm:meta/uslm:session',
+                                 namespaces={'uslm': defaultNS})
+        session_text = re.sub(r'[a-zA-Z ]+$', '', getText(session))
+        dc_type = billTree.xpath('//uslm:preface/dc:type',
+                                 namespaces={
+                                     'uslm': defaultNS,
+                                     'dc': NAMESPACE_DC
+                                 })
+        docNumber = billTree.xpath('//uslm:preface/uslm:docNumber',
+                                   namespaces={
+                                       'uslm': defaultNS,
+                                       'dc': NAMESPACE_DC
+                                   })
+        if dc_type and docNumber:
+            legisnum_text = getText(dc_type) + ' ' + getText(docNumber)
+        else:
+            legisnum_text = ''
+
+        dctitle = getText(
+            billTree.xpath('//uslm:meta/dc:title',
+                           namespaces={
+                               'uslm': defaultNS,
+                               'dc': NAMESPACE_DC
+                           }))
+        headers = billTree.xpath('//uslm:heading',
+                                 namespaces={'uslm': defaultNS})
     else:
-        sections = billTree.xpath(
-            '//section[not(ancestor::section) and not(@status="withdrawn")]')
-    return sections
+        logger.debug('NO NAMESPACE')
+        dublinCores = billTree.xpath('//dublinCore')
+        if (dublinCores is not None) and (len(dublinCores) > 0):
+            dublinCore = etree.tostring(dublinCores[0],
+                                        method="xml",
+                                        encoding="unicode")
+        else:
+            dublinCore = ''
+        dcdate = getText(
+            billTree.xpath('//dublinCore/dc:date',
+                           namespaces={'dc': NAMESPACE_DC}))
+        # TODO find date for enr bills in the bill status (for the flat congress directory structure)
+        if (dcdate is None or len(dcdate) == 0) and '/data.xml' in filePath:
+            metadata_path = filePath.replace('/data.xml', '/data.json')
+            try:
+                with open(metadata_path, 'rb') as f:
+                    metadata = json.load(f)
+                    dcdate = metadata.get('issued_on', None)
+            except:
+                pass
+        if dcdate is None or len(dcdate) == 0:
+            dcdate = None
+
+        congress = billTree.xpath('//form/congress')
+        congress_text = re.sub(r'[a-zA-Z ]+$', '', getText(congress))
+        session = billTree.xpath('//form/session')
+        session_text = re.sub(r'[a-zA-Z ]+$', '', getText(session))
+        legisnum = billTree.xpath('//legis-num')
+        legisnum_text = getText(legisnum)
+        dctitle = getText(
+            billTree.xpath('//dublinCore/dc:title',
+                           namespaces={'dc': NAMESPACE_DC}))
+        headers = billTree.xpath('//header')
+
+    # Uses an OrderedDict to deduplicate headers
+    headers_text = list(
+        OrderedDict.fromkeys([header.text for header in headers]))
+    return BillMeta(congress=congress_text,
+                    session=session_text,
+                    dctitle=dctitle,
+                    date=dcdate,
+                    legisnum=legisnum_text,
+                    headers=headers_text,
+                    dublinCore=dublinCore)
+
+
+def getTextLength(data: bytes) -> int:
+    """
+    Returns the number of characters in the UTF-8 encoded data, counting newlines as
+    reading the file in text mode does (a '\r\n' is one character).
+    """
+    text = data.decode('utf-8')
+    return len(text) - text.count('\r\n')
+
+
+def parseBill(filePath: str,
+              withXml: bool = True,
+              withText: bool = False) -> ParsedBill:
+    """
+    Reads and parses a bill file once, extracting its length, and its metadata and sections in one traversal
+    (see bill_extractor.extractBill).
+    A file of at least PARSE_STREAM_MIN_BYTES is parsed as a stream (see iterSectionRecords), without holding
+    the tree of the whole bill, unless the full text is requested.
+
+    Args:
+        filePath (str): path to the bill XML.
+        withXml (bool, optional): whether to include the XML of each section. Defaults to True.
+        withText (bool, optional): whether to include the full text of the bill. Defaults to False.
+
+    Raises:
+        Exception: Could not parse bill xml file.
+
+    Returns:
+        ParsedBill: the parsed bill
+    """
+    stat = os.stat(filePath)
+    mtime = stat.st_mtime
+    if not withText and stat.st_size >= PARSE_STREAM_MIN_BYTES:
+        return streamBill(filePath, mtime, withXml=withXml)
+    with open(filePath, 'rb') as f:
+        data = f.read()
+    try:
+        billTree = etree.fromstring(data,
+                                    parser=etree.XMLParser(),
+                                    base_url=filePath).getroottree()
+    except Exception as e:
+        logger.error('Exception: {}'.format(e))
+        raise Exception('Could not parse bill: {}'.format(filePath))
+    defaultNS = getDefaultNamespace(billTree)
+    length = getTextLength(data)
+    setBillLength(filePath, mtime, length)
+    text = None
+    if withText:
+        text = etree.tostring(billTree, method="text", encoding="unicode")
+    extracted = extractBill(billTree, defaultNS, filePath, withXml=withXml)
+    return ParsedBill(filePath=filePath,
+                      mtime=mtime,
+                      length=length,
+                      defaultNS=defaultNS,
+                      meta=extracted.meta,
+                      sections=extracted.sections,
+                      hasXml=withXml,
+                      text=text)
+
+
+def streamBill(filePath: str, mtime: float, withXml: bool = True) -> ParsedBill:
+    """
+    parseBill for large files: the sections and metadata are extracted as the file is parsed
+    (see iterSectionRecords), and the length is counted in chunks (see countFileChars).
+    """
+    metaExtractor = BillMetaExtractor(filePath)
+    sections = list(
+        iterSectionRecords(filePath,
+                           withXml=withXml,
+                           metaExtractor=metaExtractor))
+    length = countFileChars(filePath)
+    setBillLength(filePath, mtime, length)
+    return ParsedBill(filePath=filePath,
+                      mtime=mtime,
+                      length=length,
+                      defaultNS=metaExtractor.defaultNS,
+                      meta=metaExtractor.getMeta(),
+                      sections=sections,
+                      hasXml=withXml)
+
+
+def getParsedBillSize(parsedBill: ParsedBill) -> int:
+    """
+    Approximate memory, in bytes, held by a ParsedBill.
+    """
+    size = sys.getsizeof(parsedBill.text or '')
+    size += sum(sys.getsizeof(header or '') for header in parsedBill.meta.headers)
+    size += sys.getsizeof(parsedBill.meta.dublinCore or '')
+    for section in parsedBill.sections:
+        size += sys.getsizeof(section) + sys.getsizeof(
+            section.text) + sys.getsizeof(section.xml or '') + sys.getsizeof(
+                section.header) + sys.getsizeof(section.section_id)
+    return size
+
+
+class BillCache:
+    """
+    Thread-safe LRU cache of ParsedBill items, keyed by (filePath, mtime).
+    Least recently used bills are evicted when the approximate size of the cache exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = BILL_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[ParsedBill]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key: tuple, parsedBill: ParsedBill):
+        nbytes = getParsedBillSize(parsedBill)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._items[key] = (parsedBill, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, (_, evicted_bytes) = self._items.popitem(last=False)
+                self.size -= evicted_bytes
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+BILL_CACHE = BillCache()
+
+
+def getParsedBill(filePath: str,
+                  withXml: bool = True,
+                  withText: bool = False,
+                  cache: BillCache = BILL_CACHE) -> ParsedBill:
+    """
+    Returns the parsed bill from the cache, parsing the file only if it is not cached (or has changed),
+    or if the cached item does not include the section XML or full text that is requested.
+    """
+    key = (filePath, os.stat(filePath).st_mtime)
+    parsedBill = cache.get(key)
+    if parsedBill is not None:
+        if (parsedBill.hasXml or not withXml) and (parsedBill.text is not None
+                                                   or not withText):
+            return parsedBill
+        # Keep whatever the cached item already had
+        withXml = withXml or parsedBill.hasXml
+        withText = withText or parsedBill.text is not None
+    parsedBill = parseBill(filePath, withXml=withXml, withText=withText)
+    cache.put(key, parsedBill)
+    return parsedBill
 
 
 def getBillnumberversionParts(billnumber_version: str, accept_all: bool = False) -> dict:
@@ -153,22 +506,86 @@ def billNumberVersionToBillPath(billnumber_version: str,
                     billnumber_version=billnumber_version)
 
 
-def getBillLengthbyPath(filePath: str):
-    if not os.path.isfile(filePath):
-        logger.error("Bill file does not exist: %s", filePath)
-        raise Exception("Bill file does not exist: %s", filePath)
+# Character lengths of bill files: { filePath: (mtime, length) }, for the last version of each file that was seen
+# Filled when a bill is parsed, when its length is counted, and from the index manifest
+BILL_LENGTHS = {}
 
-    doc_length = 0
-    with open(filePath, 'r') as f:
-        billText = f.read()
-        doc_length = len(billText)
-    return doc_length
 
+def setBillLength(filePath: str, mtime: float, length: int):
+    BILL_LENGTHS[filePath] = (mtime, length)
 
-def getBillLength(billnumber_version: str, pathType=PATHTYPE_DEFAULT) -> int:
+
+def getCachedBillLength(filePath: str, mtime: float) -> Optional[int]:
+    """
+    The length recorded for the file (see setBillLength), if it has not changed since.
+    """
+    cached = BILL_LENGTHS.get(filePath)
+    if cached is None or cached[0] != mtime:
+        return None
+    return cached[1]
+
+
+def countFileChars(filePath: str) -> int:
+    """
+    Counts the characters of a UTF-8 file in chunks, counting newlines as reading the file
+    in text mode does (a '\r\n' is one character).
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    length = 0
+    lastChar = ''
+    with open(filePath, 'rb') as f:
+        for chunk in iter(lambda: f.read(LENGTH_CHUNK_BYTES), b''):
+            text = decoder.decode(chunk)
+            if not text:
+                continue
+            length += len(text) - text.count('\r\n')
+            if lastChar == '\r' and text[0] == '\n':
+                length -= 1
+            lastChar = text[-1]
+    return length
+
+
+def getBillLengthbyPath(filePath: str, byteLength: bool = False) -> int:
+    """
+    Returns the length of the bill file. The character length is counted once per version
+    of the file (path and mtime) and then looked up.
+
+    Args:
+        filePath (str): path to the bill XML.
+        byteLength (bool, optional): return the size of the file in bytes, from os.stat, instead of the number of characters.
+            This is an approximation of the character length (equal for ASCII files). Defaults to False.
+
+    Raises:
+        Exception: Bill file does not exist.
+
+    Returns:
+        int: length of the bill file
+    """
+    try:
+        stat = os.stat(filePath)
+    except FileNotFoundError:
+        logger.error("Bill file does not exist: %s", filePath)
+        raise Exception("Bill file does not exist: %s", filePath)
+    if byteLength:
+        return stat.st_size
+
+    length = getCachedBillLength(filePath, stat.st_mtime)
+    if length is None:
+        parsedBill = BILL_CACHE.get((filePath, stat.st_mtime))
+        if parsedBill is not None:
+            length = parsedBill.length
+        else:
+            length = countFileChars(filePath)
+        setBillLength(filePath, stat.st_mtime, length)
+    return length
+
+
+def getBillLength(billnumber_version: str,
+                  pathType=PATHTYPE_DEFAULT,
+                  byteLength: bool = False) -> int:
     bill_path = billNumberVersionToBillPath(
         billnumber_version=billnumber_version, pathType=pathType)
-    return getBillLengthbyPath(bill_path.filePath)
+    return getBillLengthbyPath(bill_path.filePath, byteLength=byteLength)
 
 
 def isDataJson(fileName: str) -> bool:
@@ -196,12 +613,89 @@ def GETBILLPATH_DEFAULT(
                     billnumber_version=billnumber_version)
 
 
+def scanDir(dirName: str) -> tuple[list[str], list[str]]:
+    """
+    Lists a directory with os.scandir, as os.walk does: returns the paths of its subdirectories
+    (not following symlinks) and the names of its other entries.
+    """
+    subDirs = []
+    fileNames = []
+    try:
+        with os.scandir(dirName) as entries:
+            for entry in entries:
+                try:
+                    isDir = entry.is_dir()
+                except OSError:
+                    isDir = False
+                if not isDir:
+                    fileNames.append(entry.name)
+                elif not entry.is_symlink():
+                    subDirs.append(entry.path)
+    except OSError as e:
+        logger.warning('Could not scan directory {0}: {1}'.format(dirName, e))
+    return subDirs, fileNames
+
+
+def iterBillDirs(rootDir: Union[str, Iterable[str]] = PATH_TO_CONGRESSDATA_DIR,
+                 processFile=GETBILLPATH_DEFAULT,
+                 dirMatch=PATHTYPE_OBJ["isFileParent"],
+                 fileMatch=PATHTYPE_OBJ["fileMatch"],
+                 workers: int = SCAN_WORKERS) -> Iterator:
+    """
+  Lazy, parallel version of walkBillDirs. Directories are listed with os.scandir in a pool of worker threads,
+  each subdirectory as soon as it is found, and the result of processFile for each matching file is yielded
+  while the scan continues. Files are not yielded in a fixed order.
+
+  Args:
+      rootDir (str | Iterable[str], optional): the directory, or directories, to scan. Defaults to PATH_TO_CONGRESSDATA_DIR.
+      processFile ([type], optional): called as processFile(dirName=..., fileName=...) for each matching file. Defaults to GETBILLPATH_DEFAULT.
+      dirMatch ([type], optional): whether the files of a directory (path) are considered. Defaults to isFileParent.
+      fileMatch ([type], optional): whether a file (name) is processed. Defaults to the bill XML file name match.
+      workers (int, optional): number of threads listing directories. Defaults to SCAN_WORKERS.
+
+  Yields:
+      the results of processFile that are not None
+  """
+    processedNum = 0
+    with ThreadPoolExecutor(max_workers=workers,
+                            thread_name_prefix='scan') as executor:
+        rootDirs = [rootDir] if isinstance(rootDir, str) else list(rootDir)
+        pending = {
+            executor.submit(scanDir, dirName): dirName for dirName in rootDirs
+        }
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dirName = pending.pop(future)
+                    subDirs, fileNames = future.result()
+                    for subDir in subDirs:
+                        pending[executor.submit(scanDir, subDir)] = subDir
+                    if not dirMatch(dirName):
+                        continue
+                    logger.debug('Entering directory: %s' % dirName)
+                    for fileName in fileNames:
+                        if not fileMatch(fileName):
+                            continue
+                        result = processFile(dirName=dirName, fileName=fileName)
+                        processedNum += 1
+                        if processedNum % 100 == 0:
+                            logger.debug('Processed %d files' % processedNum)
+                        if result is not None:
+                            yield result
+        finally:
+            # The consumer stopped early
+            for future in pending:
+                future.cancel()
+
+
 def walkBillDirs(rootDir=PATH_TO_CONGRESSDATA_DIR,
                  processFile=GETBILLPATH_DEFAULT,
                  dirMatch=PATHTYPE_OBJ["isFileParent"],
                  fileMatch=PATHTYPE_OBJ["fileMatch"]) -> list:
     """
   Walks through the data directory and returns a list of dicts of the form {path: '[path/to]/congress/data/116/...', billnumber_version: '116hr200ih'} with paths to the bill XML files.
+  Scans the directories in parallel (see iterBillDirs).
 
   Args:
       rootDir ([type], optional): [description]. Defaults to PATH_TO_CONGRESSDATA_DIR. This is the `congress/data` directory at the location the function is called from.
@@ -214,21 +708,11 @@ def walkBillDirs(rootDir=PATH_TO_CONGRESSDATA_DIR,
   """
     logger.debug("WalkDirs called with the following arguments:")
     logger.debug(locals())
-    accumulator = []
-    processedNum = 0
-    for dirName, _, fileList in os.walk(rootDir):
-        if dirMatch(dirName):
-            logger.debug('Entering directory: %s' % dirName)
-            filteredFileList = [fitem for fitem in fileList if fileMatch(fitem)]
-            for fileName in filteredFileList:
-                logger.debug('Processing: \t%s' % fileName)
-                result = processFile(dirName=dirName, fileName=fileName)
-                processedNum += 1
-                if processedNum % 100 == 0:
-                    logger.debug('Processed %d files' % processedNum)
-                if result is not None:
-                    accumulator.append(result)
-    return accumulator
+    return list(
+        iterBillDirs(rootDir=rootDir,
+                     processFile=processFile,
+                     dirMatch=dirMatch,
+                     fileMatch=fileMatch))
 
 
 def getDefaultNamespace(billTree) -> str:
@@ -236,15 +720,17 @@ def getDefaultNamespace(billTree) -> str:
 
 
 # Get bill XML paths depending on the pathType
-# Uses walkBillDirs with a filter
-def getBillXmlPaths(
+# Uses iterBillDirs with a filter
+def iterBillXmlPaths(
     congressDataDir: str = PATH_TO_CONGRESSDATA_DIR,
     pathType: str = PATHTYPE_DEFAULT,
-    congresses: list[int] = list(
-        range(CURRENT_CONGRESS, CURRENT_CONGRESS - 3, -1))
-) -> List[BillPath]:
+    congresses: Optional[list[int]] = None,
+    workers: int = SCAN_WORKERS) -> Iterator[BillPath]:
     """
-  Returns a list of BillPath objects of the form BillPath(path='data/116/...', billnumber_version='116hr200ih', fileName='Bills-116hr200ih.xml') with paths to the bill XML files for the given congress.
+  Yields BillPath objects of the form BillPath(path='data/116/...', billnumber_version='116hr200ih', fileName='Bills-116hr200ih.xml') for the bill XML files,
+  as the directories are scanned, so that bills can be processed before the scan is complete.
+  With congresses, only the directories of those Congresses (congressDataDir/<congress>) are scanned;
+  by default, all of congressDataDir is.
   """
     assert pathType in CONGRESS_DIRS.keys(
     ), "Path type must be in one of the following forms: {}".format(
@@ -253,6 +739,7 @@ def getBillXmlPaths(
     logger.info('Getting bill paths in {}, for congresses: {}'.format(
         congressDataDir, congresses))
     logger.info('pathType: {}'.format(pathType))
+    pathToBillnumberVersion = congressdir_obj["pathToBillnumberVersion"]
 
     def getBillPath(
         dirName: str,
@@ -261,13 +748,37 @@ def getBillXmlPaths(
         # Add billnumber and billnumber_version to the return value
         billpath = os.path.join(dirName, fileName)
         logger.debug('billpath: {0}'.format(billpath))
-        billnumber_version = CONGRESS_DIRS[pathType]["pathToBillnumberVersion"](
-            billpath=billpath)
+        billnumber_version = pathToBillnumberVersion(billpath=billpath)
         return BillPath(filePath=billpath,
                         fileName=fileName,
                         billnumber_version=billnumber_version)
 
-    return walkBillDirs(rootDir=congressDataDir,
+    if congresses:
+        rootDirs = []
+        for congress in congresses:
+            congressDir = os.path.join(congressDataDir, str(congress))
+            if os.path.isdir(congressDir):
+                rootDirs.append(congressDir)
+            else:
+                logger.warning(f'No bill directory at {congressDir}')
+    else:
+        rootDirs = [congressDataDir]
+    return iterBillDirs(rootDir=rootDirs,
                         processFile=getBillPath,
                         dirMatch=congressdir_obj["isFileParent"],
-                        fileMatch=congressdir_obj["fileMatch"])
+                        fileMatch=congressdir_obj["fileMatch"],
+                        workers=workers)
+
+
+def getBillXmlPaths(
+    congressDataDir: str = PATH_TO_CONGRESSDATA_DIR,
+    pathType: str = PATHTYPE_DEFAULT,
+    congresses: Optional[list[int]] = None) -> List[BillPath]:
+    """
+  Returns a list of BillPath objects of the form BillPath(path='data/116/...', billnumber_version='116hr200ih', fileName='Bills-116hr200ih.xml') with paths to the bill XML files for the given congress.
+  See iterBillXmlPaths to process the bills as they are found.
+  """
+    return list(
+        iterBillXmlPaths(congressDataDir=congressDataDir,
+                         pathType=pathType,
+                         congresses=congresses))
@@ -2,15 +2,14 @@
 
 import sys
 import logging
+from contextlib import contextmanager
 from typing import Optional
-from urllib.parse import _NetlocResultMixinStr
-from lxml import etree
 from sqlalchemy import tuple_, delete, and_, update
 from sqlalchemy.orm import Session
 from sqlalchemy.sql.expression import func
 from sqlalchemy.dialects.postgresql import insert
-from billsim.utils import getDefaultNamespace, getBillLength, getBillLengthbyPath, getBillnumberversionParts, getId, getEnum, getSections, parseFilePath
-from billsim.database import SessionLocal
+from billsim.utils import getBillLength, getBillnumberversionParts, getParsedBill
+from billsim.database import session_scope
 from billsim import pymodels, constants
 from datetime import datetime
 from sqlmodel import SQLModel
@@ -32,20 +31,38 @@ Take the Section object (which consists of the from Section Meta and a list of s
 """
 
 
+@contextmanager
+def get_session(db: Optional[Session] = None) -> Session:
+    """
+    Yields the session for a function of this module.
+    If db is None, the function is its own unit of work: a new session from database.session_scope,
+    committed and closed at the end. If a session is passed in, the caller owns the transaction and
+    commits it, so that several saves share one transaction:
+
+    >>> with session_scope() as session:
+    >>>    bill_ids = batch_save_bills(bills, db=session)
+    >>>    batch_save_sectionitems(section_metas, bill_ids=bill_ids, db=session)
+    """
+    if db is not None:
+        yield db
+        return
+    with session_scope() as session:
+        yield session
+
+
 def create_currency(
     version: str,
-    db: Session = SessionLocal()) -> Optional[int]:
+    db: Optional[Session] = None) -> Optional[int]:
     new_currency = pymodels.CurrencyModel(version=version, date=datetime.utcnow())
-    with db as session:
+    with get_session(db) as session:
         session.add(new_currency)
         session.flush()
-        session.commit()
         session.refresh(new_currency)
     return new_currency.currency_id
 
-def get_last_currency_id(db: Session = SessionLocal()):
+def get_last_currency_id(db: Optional[Session] = None):
     max_id = 0
-    with db as session:
+    with get_session(db) as session:
         max_id = session.query(func.max(pymodels.CurrencyModel.currency_id)).scalar()
 
     return max_id
@@ -54,12 +71,12 @@ def save_bill(
     bill: SQLModel,
     is_upload: bool = False,
 
-    db: Session = SessionLocal()) -> Optional[SQLModel]:
+    db: Optional[Session] = None) -> Optional[SQLModel]:
     """
     Save a bill to the database.
     """
     logger.info('Saving bill: {}'.format(bill))
-    with db as session:
+    with get_session(db) as session:
         if is_upload:
             query_object = pymodels.UploadedDoc
         else:
@@ -74,9 +91,8 @@ def save_bill(
             logger.debug('Saving bill: {}'.format(str(bill)))
         session.add(bill)
         session.flush()
-        session.commit()
         logger.debug(
-            f'Flush and Commit to save bill {bill.billnumber} {bill.version}')
+            f'Flush to save bill {bill.billnumber} {bill.version}')
         bill_saved = session.query(query_object).filter(
             query_object.billnumber == bill.billnumber,
             query_object.version == bill.version).first()
@@ -87,7 +103,7 @@ def save_bill(
         else:
             return bill_saved
 
-def mark_upload_processed(billnumber_version: str, doc_id: int, user: str, db: Session = SessionLocal()):
+def mark_upload_processed(billnumber_version: str, doc_id: int, user: str, db: Optional[Session] = None):
     """
     Change UploadedDoc's status to processed in the database
     """
@@ -95,16 +111,15 @@ def mark_upload_processed(billnumber_version: str, doc_id: int, user: str, db: S
     billnumber = str(billnumber_version_dict.get('billnumber'))
     version = str(billnumber_version_dict.get('version'))
     logger.info(f'Mark document {billnumber} version {version} as processed')
-    with db as session:
+    with get_session(db) as session:
         docobj = pymodels.UploadedDoc
         session.execute(update(docobj).where(and_(docobj.billnumber == billnumber, docobj.version == version)).values(processed=True, ext_id=doc_id, user=user))
-        session.commit()
     return
 
 def save_sections(
     section_models,
     is_upload: bool = False,
-    db: Session = SessionLocal()):
+    db: Optional[Session] = None):
     logger.info("Saving sections")
     section_dicts = [i.__dict__ for i in section_models]
     if is_upload:
@@ -116,19 +131,164 @@ def save_sections(
     insert_stmt = insert(query_object)
     do_update_stmt = insert_stmt.on_conflict_do_nothing(
         constraint=constraint)
-    with db as session:
+    with get_session(db) as session:
         session.execute(do_update_stmt, section_dicts)
-        session.commit()
+
+
+def batch_save_bills(bills: list[SQLModel],
+                     is_upload: bool = False,
+                     batch_size: int = constants.DB_BATCH_SIZE,
+                     db: Optional[Session] = None) -> dict:
+    """
+    Save bills to the database with set-based upserts (INSERT ... ON CONFLICT ... RETURNING id),
+    batch_size rows per statement, in a single transaction.
+    The length of an existing bill is updated if a length is passed.
+
+    Args:
+        bills (list[SQLModel]): Bill (or UploadedDoc) items, with billnumber, version and (optionally) length
+        is_upload (bool, optional): save to the UploadedDoc table. Defaults to False.
+        batch_size (int, optional): rows per INSERT statement. Defaults to constants.DB_BATCH_SIZE.
+        db (Session, optional): db session. Defaults to None, for a new session (see get_session).
+
+    Returns:
+        dict: dictionary of the form { billnumber_version: bill_id }
+    """
+    if is_upload:
+        query_object = pymodels.UploadedDoc
+        constraint = 'uploaded_billnumber_version'
+    else:
+        query_object = pymodels.Bill
+        constraint = 'billnumber_version'
+    # A row can only be upserted once per statement
+    rows = {}
+    for bill in bills:
+        rows[(bill.billnumber, bill.version)] = {
+            'billnumber': bill.billnumber,
+            'version': bill.version,
+            'length': bill.length
+        }
+    rows = list(rows.values())
+
+    billdict = {}
+    with get_session(db) as session:
+        for start in range(0, len(rows), batch_size):
+            insert_stmt = insert(query_object).values(rows[start:start +
+                                                           batch_size])
+            upsert_stmt = insert_stmt.on_conflict_do_update(
+                constraint=constraint,
+                set_={
+                    'length':
+                        func.coalesce(insert_stmt.excluded.length,
+                                      query_object.length)
+                }).returning(query_object.id, query_object.billnumber,
+                             query_object.version)
+            for result in session.execute(upsert_stmt):
+                billdict[f'{result.billnumber}{result.version}'] = result.id
+    logger.debug(f'Saved {len(billdict)} bills')
+    return billdict
+
+
+def batch_save_sectionitems(section_metas: list[pymodels.SectionMeta],
+                            bill_ids: dict = None,
+                            is_upload: bool = False,
+                            batch_size: int = constants.DB_BATCH_SIZE,
+                            db: Optional[Session] = None) -> dict:
+    """
+    Save sections to the SectionItem (or USectionItem) table with set-based upserts
+    (INSERT ... ON CONFLICT ... RETURNING id), batch_size rows per statement, in a single transaction.
+    Sections without a section_id are skipped. Values that are not set do not overwrite the values in the db.
+
+    Args:
+        section_metas (list[pymodels.SectionMeta]): sections, with billnumber_version, section_id, label, header and length
+        bill_ids (dict, optional): { billnumber_version: bill_id } for the bills of the sections, e.g. from batch_save_bills.
+            Bills that are missing are looked up with batch_get_bill_ids.
+        is_upload (bool, optional): save to the USectionItem table. Defaults to False.
+        batch_size (int, optional): rows per INSERT statement. Defaults to constants.DB_BATCH_SIZE.
+        db (Session, optional): db session. Defaults to None, for a new session (see get_session).
+
+    Returns:
+        dict: dictionary of the form { (billnumber_version, section_id): section item id }
+    """
+    if is_upload:
+        query_object = pymodels.USectionItem
+        constraint = 'uploaded_billnumber_version_section_id'
+    else:
+        query_object = pymodels.SectionItem
+        constraint = 'billnumber_version_section_id'
+    bill_ids = dict(bill_ids or {})
+    missing_bills = set(section_meta.billnumber_version
+                        for section_meta in section_metas
+                        if section_meta.billnumber_version not in bill_ids)
+    if missing_bills:
+        bill_ids.update(
+            batch_get_bill_ids(list(missing_bills),
+                               is_upload,
+                               db=db))
+
+    rows = {}
+    for section_meta in section_metas:
+        if not section_meta.section_id:
+            continue
+        rows[(section_meta.billnumber_version, section_meta.section_id)] = {
+            'bill_id': bill_ids.get(section_meta.billnumber_version),
+            'billnumber_version': section_meta.billnumber_version,
+            'section_id_attr': section_meta.section_id,
+            'number': section_meta.label,
+            'header': section_meta.header,
+            'length': section_meta.length or 0
+        }
+    rows = list(rows.values())
+
+    sectiondict = {}
+    with get_session(db) as session:
+        for start in range(0, len(rows), batch_size):
+            insert_stmt = insert(query_object).values(rows[start:start +
+                                                           batch_size])
+            upsert_stmt = insert_stmt.on_conflict_do_update(
+                constraint=constraint,
+                set_={
+                    'bill_id':
+                        func.coalesce(insert_stmt.excluded.bill_id,
+                                      query_object.bill_id),
+                    'number':
+                        func.coalesce(insert_stmt.excluded.number,
+                                      query_object.number),
+                    'header':
+                        func.coalesce(insert_stmt.excluded.header,
+                                      query_object.header),
+                    'length':
+                        func.coalesce(func.nullif(insert_stmt.excluded.length, 0),
+                                      query_object.length)
+                }).returning(query_object.id, query_object.billnumber_version,
+                             query_object.section_id_attr)
+            for result in session.execute(upsert_stmt):
+                sectiondict[(result.billnumber_version,
+                             result.section_id_attr)] = result.id
+    logger.debug(f'Saved {len(sectiondict)} sections')
+    return sectiondict
+
+
+def get_or_create_sectionitem(section_meta: pymodels.SectionMeta,
+                              is_upload: bool = False,
+                              db: Optional[Session] = None) -> Optional[int]:
+    """
+    Save a section to the SectionItem table, if it does not exist, and return its id.
+    """
+    sectiondict = batch_save_sectionitems([section_meta],
+                                          is_upload=is_upload,
+                                          db=db)
+    return sectiondict.get(
+        (section_meta.billnumber_version, section_meta.section_id))
 
 
 def get_bill_by_billnumber_version(
-    billnumber_version: str, db: Session = SessionLocal()
+    billnumber_version: str, db: Optional[Session] = None
 ) -> Optional[pymodels.Bill]:
     billnumber_version_dict = getBillnumberversionParts(billnumber_version)
     logger.debug('billnumber_version_dict: {}'.format(
         str(billnumber_version_dict)))
-    with db as session:
-        bill = db.query(pymodels.Bill).filter(
+    with get_session(db) as session:
+        bill = session.query(pymodels.Bill).filter(
             pymodels.Bill.billnumber == billnumber_version_dict.get(
                 'billnumber'), pymodels.Bill.version ==
             billnumber_version_dict.get('version')).first()
@@ -138,14 +298,14 @@ def get_bill_by_billnumber_version(
 
 
 def get_bill_ids(
-    billnumber_versions: list[str], db: Session = SessionLocal()) -> dict:
+    billnumber_versions: list[str], db: Optional[Session] = None) -> dict:
     """
     Return a dictionary of bill_id's for the billnumber_versions
      { billnumber_version: bill_id }
 
     Args:
         billnumber_versions (list[str]): list of billnumber_versions of the form '116hr200ih' 
-        db (Session, optional): db session. Defaults to SessionLocal().
+        db (Session, optional): db session. Defaults to None, for a new session (see get_session).
 
     Returns:
         billdict (dict): dictionary of the form { billnumber_version: bill_id }
@@ -158,14 +318,14 @@ def get_bill_ids(
     return billdict
 
 
-def batch_get_bill_ids(billnumber_versions: list, is_uploaded: bool = False, db: Session = SessionLocal()) -> dict:
+def batch_get_bill_ids(billnumber_versions: list, is_uploaded: bool = False, db: Optional[Session] = None) -> dict:
     """
     Return a dictionary of bill_id's for the billnumber_versions
      { billnumber_version: bill_id }
 
     Args:
         billnumber_versions (list[str]): list of billnumber_versions of the form '116hr200ih' 
-        db (Session, optional): db session. Defaults to SessionLocal().
+        db (Session, optional): db session. Defaults to None, for a new session (see get_session).
 
     Returns:
         billdict (dict): dictionary of the form { billnumber_version: bill_id }
@@ -185,7 +345,7 @@ def batch_get_bill_ids(billnumber_versions: list, is_uploaded: bool = False, db:
         version = str(billnumber_version_dict.get('version'))
         split_number_versions.append((billnumber, version))
 
-    with db as session:
+    with get_session(db) as session:
         query = session.query(bill_pymodel.id, bill_pymodel.billnumber, bill_pymodel.version).filter(
             tuple_(bill_pymodel.billnumber, bill_pymodel.version).in_(split_number_versions)
         )
@@ -197,11 +357,11 @@ def batch_get_bill_ids(billnumber_versions: list, is_uploaded: bool = False, db:
 
 def get_bill_to_bill(
     bill_id: int, bill_to_id: int,
-    db: Session = SessionLocal()) -> Optional[pymodels.BillToBill]:
+    db: Optional[Session] = None) -> Optional[pymodels.BillToBill]:
     """
     Return the BillToBill object for the bill_id and bill_to_id
     """
-    with db as session:
+    with get_session(db) as session:
         bill_to_bill = session.query(pymodels.BillToBill).filter(
             pymodels.BillToBill.bill_id == bill_id,
             pymodels.BillToBill.bill_to_id == bill_to_id).first()
@@ -214,13 +374,13 @@ def batch_get_section_ids(s2s_models: list[pymodels.SectionToSectionModel],
                           do_query_from: bool,
                           do_query_to: bool,
                           is_uploaded: bool = False, 
-                          db: Session = SessionLocal()) -> dict:
+                          db: Optional[Session] = None) -> dict:
     """
     Return a dictionary from billnumber and section id attribute to (bill_id, section id)
 
     Args:
         s2s_models (list[]): list of SectionToSectionModel
-        db (Session, optional): db session. Defaults to SessionLocal().
+        db (Session, optional): db session. Defaults to None, for a new session (see get_session).
 
     Returns:
         sectiondict (dict)
@@ -238,7 +398,7 @@ def batch_get_section_ids(s2s_models: list[pymodels.SectionToSectionModel],
             sections_set.add((model.bill_number, model.section_id))
         if do_query_to:
             sections_set.add((model.bill_number_to, model.section_to_id))
-    with db as session:
+    with get_session(db) as session:
         query = session.query(section_pymodel.id, section_pymodel.bill_id, section_pymodel.billnumber_version, section_pymodel.section_id_attr).filter(
             tuple_(section_pymodel.billnumber_version, section_pymodel.section_id_attr).in_(sections_set)
         )
@@ -254,7 +414,22 @@ def batch_get_section_ids(s2s_models: list[pymodels.SectionToSectionModel],
         
     return sectiondict
 
-def batch_save_section_to_section(s2s_models: list[pymodels.SectionToSectionModel], is_uploaded: bool = False, db: Session = SessionLocal()):
+def batch_save_section_to_section(s2s_models: list[pymodels.SectionToSectionModel],
+                                  is_uploaded: bool = False,
+                                  sectiondict: dict = None,
+                                  batch_size: int = constants.DB_BATCH_SIZE,
+                                  db: Optional[Session] = None):
+    """
+    Save section to section matches with set-based upserts, batch_size rows per statement.
+
+    Args:
+        s2s_models (list[pymodels.SectionToSectionModel]): section to section matches
+        is_uploaded (bool, optional): the 'from' sections are in the USectionItem table. Defaults to False.
+        sectiondict (dict, optional): { billnumber_version: { section_id_attr: (section id, bill_id) } }, as returned by
+            batch_get_section_ids, for the 'from' and 'to' sections. If None, the ids are queried.
+        batch_size (int, optional): rows per INSERT statement. Defaults to constants.DB_BATCH_SIZE.
+        db (Session, optional): db session. Defaults to None, for a new session (see get_session).
+    """
     
     logger.info("Batch save section to section")
     if is_uploaded:
@@ -263,46 +438,55 @@ def batch_save_section_to_section(s2s_models: list[pymodels.SectionToSectionMode
     else:
         s2s_pymodel = pymodels.SectionToSection
         the_constraint='sectiontosection_pkey'
-        
-    sectiondict_from = batch_get_section_ids(s2s_models, True, False, is_uploaded)
-    sectiondict_to = batch_get_section_ids(s2s_models, False, True, False)
 
-    section_to_sections = []
+    if sectiondict is None:
+        sectiondict_from = batch_get_section_ids(s2s_models, True, False, is_uploaded, db=db)
+        sectiondict_to = batch_get_section_ids(s2s_models, False, True, False, db=db)
+    else:
+        sectiondict_from = sectiondict_to = sectiondict
+
+    # A row can only be upserted once per statement
+    section_to_sections = {}
     for model in s2s_models:
         logger.debug('sectiontosection model: {}'.format(model))
-        from_ids = sectiondict_from[model.bill_number][model.section_id]
-        to_ids = sectiondict_to[model.bill_number_to][model.section_to_id]
-        section_to_sections.append({
+        from_ids = sectiondict_from.get(model.bill_number, {}).get(model.section_id)
+        to_ids = sectiondict_to.get(model.bill_number_to, {}).get(model.section_to_id)
+        if from_ids is None or to_ids is None:
+            logger.warning('No section item found for match {0}:{1} -> {2}:{3}'.format(
+                model.bill_number, model.section_id, model.bill_number_to, model.section_to_id))
+            continue
+        section_to_sections[(from_ids[0], to_ids[0])] = {
             'bill_id': from_ids[1],
             'bill_to_id': to_ids[1],
             'section_id': from_ids[0],
             'section_to_id': to_ids[0],
             'score': model.score,
             'currency_id': model.currency_id
-        })
-
-    insert_stmt = insert(s2s_pymodel).values(section_to_sections)
-
-    update_values = { 
-        'score': insert_stmt.excluded.score, 
-        'currency_id': insert_stmt.excluded.currency_id
-    }
-
-    do_update_stmt = insert_stmt.on_conflict_do_update(
-        constraint=the_constraint,
-        set_= update_values
-    )
-
-    with db as session:
-        session.execute(do_update_stmt)
-        session.commit()
+        }
+    if not section_to_sections:
+        return
+    rows = list(section_to_sections.values())
+
+    with get_session(db) as session:
+        for start in range(0, len(rows), batch_size):
+            insert_stmt = insert(s2s_pymodel).values(rows[start:start +
+                                                          batch_size])
+            update_values = {
+                'score': insert_stmt.excluded.score,
+                'currency_id': insert_stmt.excluded.currency_id
+            }
+            do_update_stmt = insert_stmt.on_conflict_do_update(
+                constraint=the_constraint,
+                set_= update_values
+            )
+            session.execute(do_update_stmt)
 
 def save_bill_to_bill(bill_to_bill_model: pymodels.BillToBillModel,
-                      db: Session = SessionLocal()):
+                      db: Optional[Session] = None):
     """
     Save bill to bill join to the database.
     """
-    bill = get_bill_by_billnumber_version(bill_to_bill_model.billnumber_version)
+    bill = get_bill_by_billnumber_version(bill_to_bill_model.billnumber_version, db=db)
     if bill is None:
         logger.warning('No bill found in db for {}'.format(
             bill_to_bill_model.billnumber_version))
@@ -320,10 +504,11 @@ def save_bill_to_bill(bill_to_bill_model: pymodels.BillToBillModel,
         bill = save_bill(
             pymodels.Bill(billnumber=billnumber,
                           version=version,
-                          length=bill_to_bill_model.length))
+                          length=bill_to_bill_model.length),
+            db=db)
 
     bill_to = get_bill_by_billnumber_version(
-        bill_to_bill_model.billnumber_version_to)
+        bill_to_bill_model.billnumber_version_to, db=db)
     if bill_to is None:
         err_msg = 'No bill found in db for {}'.format(
             bill_to_bill_model.billnumber_version_to)
@@ -342,7 +527,8 @@ def save_bill_to_bill(bill_to_bill_model: pymodels.BillToBillModel,
         bill_to = save_bill(
             pymodels.Bill(billnumber=billnumber_to,
                           version=version_to,
-                          length=length_to))
+                          length=length_to),
+            db=db)
     if bill is None or bill_to is None:
         raise Exception(
             'Could not create bill item for one or both of: {0}, {1}.'.format(
@@ -352,7 +538,7 @@ def save_bill_to_bill(bill_to_bill_model: pymodels.BillToBillModel,
     logger.debug('Saving bill to bill join: {0} & {1}'.format(
         bill.id, bill_to.id))
     if bill.id and bill_to.id:
-        bill_to_bill = get_bill_to_bill(bill_id=bill.id, bill_to_id=bill_to.id)
+        bill_to_bill = get_bill_to_bill(bill_id=bill.id, bill_to_id=bill_to.id, db=db)
     else:
         raise Exception('No bill id found for one or both of: {0}, {1}.'.format(
             bill_to_bill_model.billnumber_version,
@@ -376,10 +562,9 @@ def save_bill_to_bill(bill_to_bill_model: pymodels.BillToBillModel,
         logger.debug(
             "********** NO Bill-to-bill yet for: {0}, {1} ********".format(
                 bill.id, bill_to.id))
-        with db as session:
+        with get_session(db) as session:
             session.add(bill_to_bill_new)
             session.flush()
-            session.commit()
     else:
         logger.debug("********** UPDATING BILLS: {0}, {1} ********".format(
             bill.id, bill_to.id))
@@ -428,17 +613,26 @@ def save_bill_to_bill(bill_to_bill_model: pymodels.BillToBillModel,
             logger.debug("********* UPDATING sections_match")
             setattr(bill_to_bill, 'sections_match',
                     bill_to_bill_new.sections_match)
-        with db as session:
+        with get_session(db) as session:
             session.add(bill_to_bill)
             session.flush()
-            session.commit()
 
-def batch_save_bill_to_bill(b2b_models: [pymodels.BillToBillModel], 
+def batch_save_bill_to_bill(b2b_models: list[pymodels.BillToBillModel],
                       is_uploaded: bool = False,
-                      db: Session = SessionLocal()):
+                      bill_ids: dict = None,
+                      batch_size: int = constants.DB_BATCH_SIZE,
+                      db: Optional[Session] = None):
     """
-    Save bill to bill join to the database.
-    Requires a list of BillToBillModel objects with bill_id and bill_to_id set.
+    Save bill to bill joins to the database with set-based upserts, batch_size rows per statement.
+    As in save_bill_to_bill, values that are not set (None) do not overwrite the values in the db.
+
+    Args:
+        b2b_models (list[pymodels.BillToBillModel]): bill to bill joins
+        is_uploaded (bool, optional): the 'from' bills are in the UploadedDoc table. Defaults to False.
+        bill_ids (dict, optional): { billnumber_version: bill_id } for the 'from' and 'to' bills, e.g. from batch_get_bill_ids.
+            If None, the ids are queried and missing bills are saved.
+        batch_size (int, optional): rows per INSERT statement. Defaults to constants.DB_BATCH_SIZE.
+        db (Session, optional): db session. Defaults to None, for a new session (see get_session).
     """
     if is_uploaded:
         bill_pymodel = pymodels.UploadedDoc
@@ -453,91 +647,87 @@ def batch_save_bill_to_bill(b2b_models: [pymodels.BillToBillModel],
     # Backfill the bill to bill models with bill DB ids before saving.
     # If we pass in bill to bill models with bill DB ids already set,
     # this is unnecessary, but we'll do it anyway for simplicity.
-    billnumber_versions_from = []
-    billnumber_versions_to = []    
-    for model in b2b_models:
-        billnumber_versions_from.append(model.billnumber_version)
-        billnumber_versions_to.append(model.billnumber_version_to)
-
-    billnumber_version_id_dict = batch_get_bill_ids(billnumber_versions_from, is_uploaded)
-    billnumber_version_id_dict_to = batch_get_bill_ids(billnumber_versions_to, False)
-    # TODO: remove
-    # This seems duplicative and unnecessary; if the bill is missing from the db
-    # we add it below
-    #for billnum in billnumber_version_id_dict:
-    #    # The caller should ensure all bills are saved in the bill table before using this
-    #    # method.
-    #    if billnumber_version_id_dict[billnum] is None:
-    #        #raise ValueError(f"Bill numberversion not found in the database: {billnum}")
+    if bill_ids is None:
+        billnumber_versions_from = []
+        billnumber_versions_to = []    
+        for model in b2b_models:
+            billnumber_versions_from.append(model.billnumber_version)
+            billnumber_versions_to.append(model.billnumber_version_to)
+
+        billnumber_version_id_dict = batch_get_bill_ids(billnumber_versions_from, is_uploaded, db=db)
+        billnumber_version_id_dict_to = batch_get_bill_ids(billnumber_versions_to, False, db=db)
+    else:
+        billnumber_version_id_dict = billnumber_version_id_dict_to = bill_ids
 
     for model in b2b_models:
         # billnumber, version, billnumber_to, version_to
         model.bill_id = billnumber_version_id_dict.get(model.billnumber_version)
         if model.bill_id is None:
-            bill = save_bill(bill_pymodel(billnumber=model.billnumber, version=model.version))
+            bill = save_bill(bill_pymodel(billnumber=model.billnumber, version=model.version), db=db)
             if bill is None:
                 raise ValueError('Could not save bill: {0}'.format(model.billnumber_version))
             model.bill_id = bill.id
 
-        model.bill_to_id = billnumber_version_id_dict_to[model.billnumber_version_to]
-        if model.bill_id is None:
-            bill_to = save_bill(bill_pymodel(billnumber=model.billnumber_to, version=model.version_to))
+        model.bill_to_id = billnumber_version_id_dict_to.get(model.billnumber_version_to)
+        if model.bill_to_id is None:
+            bill_to = save_bill(pymodels.Bill(billnumber=model.billnumber_to, version=model.version_to), db=db)
             if bill_to is None:
                 raise ValueError('Could not save bill_to: {0}'.format(model.billnumber_version_to))
             model.bill_to_id = bill_to.id
 
-    bill_to_bills = []
+    # A row can only be upserted once per statement
+    bill_to_bills = {}
     for model in b2b_models:
-
-        bill_to_bills.append({
+        bill_to_bills[(model.bill_id, model.bill_to_id)] = {
             'bill_id': model.bill_id,
             'bill_to_id': model.bill_to_id,
+            'score_es': model.score_es,
             'score': model.score,
             'score_to': model.score_to,
-            'reasonsstring': ','.join(model.reasons),
+            'reasonsstring': ', '.join(model.reasons) if model.reasons else None,
+            'identified_by': model.identified_by,
             'sections_num': model.sections_num,
             'sections_match': model.sections_match,
             'currency_id': model.currency_id
-        })
-
-    insert_stmt = insert(b2b_pymodel).values(bill_to_bills)
-    update_values = { 
-        'score': insert_stmt.excluded.score, 
-        'score_to': insert_stmt.excluded.score_to, 
-        'reasonsstring': insert_stmt.excluded.reasonsstring, 
-        'sections_match': insert_stmt.excluded.sections_match, 
-        'sections_num': insert_stmt.excluded.sections_num,
-        'currency_id': insert_stmt.excluded.currency_id
-    }
-    do_update_stmt = insert_stmt.on_conflict_do_update(
-        constraint=constraint,
-        set_= update_values
-    )
-    with db as session:
-        session.execute(do_update_stmt)
-        session.commit()
-
-def cleanup_old_bill_to_bill(current_currency_id: int, db: Session = SessionLocal()):
+        }
+    if not bill_to_bills:
+        return
+    rows = list(bill_to_bills.values())
+
+    with get_session(db) as session:
+        for start in range(0, len(rows), batch_size):
+            insert_stmt = insert(b2b_pymodel).values(rows[start:start +
+                                                          batch_size])
+            update_values = {
+                column: func.coalesce(insert_stmt.excluded[column], getattr(b2b_pymodel, column))
+                for column in ['score_es', 'score', 'score_to', 'reasonsstring', 'identified_by',
+                               'sections_match', 'sections_num', 'currency_id']
+            }
+            do_update_stmt = insert_stmt.on_conflict_do_update(
+                constraint=constraint,
+                set_= update_values
+            )
+            session.execute(do_update_stmt)
+
+def cleanup_old_bill_to_bill(current_currency_id: int, db: Optional[Session] = None):
     delete_stmt = delete(pymodels.BillToBill).where(pymodels.BillToBill.currency_id<current_currency_id)
-    last_id = get_last_currency_id()
+    last_id = get_last_currency_id(db=db)
     if current_currency_id<0 or current_currency_id>last_id:
         raise ValueError('Currency id {0} is out of range.', current_currency_id)
-    with db as session:
+    with get_session(db) as session:
         session.execute(delete_stmt)
-        session.commit()
 
-def cleanup_old_section_to_section(current_currency_id: int, db: Session = SessionLocal()):
+def cleanup_old_section_to_section(current_currency_id: int, db: Optional[Session] = None):
     delete_stmt = delete(pymodels.SectionToSection).where(pymodels.SectionToSection.currency_id<current_currency_id)
-    last_id = get_last_currency_id()
+    last_id = get_last_currency_id(db=db)
     if current_currency_id<0 or current_currency_id>last_id:
         raise ValueError('Currency id {0} is out of range.', current_currency_id)
-    with db as session:
+    with get_session(db) as session:
         session.execute(delete_stmt)
-        session.commit()
 
 
 def save_bill_to_bill_sections(bill_to_bill_model: pymodels.BillToBillModel,
-                               db: Session = SessionLocal()):
+                               db: Optional[Session] = None):
     """
     For each bill to bill, save the 'sections' object, which includes the sections of the 'from'
     bill in order, along with the top similar section of the 'to' bill.
@@ -545,12 +735,114 @@ def save_bill_to_bill_sections(bill_to_bill_model: pymodels.BillToBillModel,
     sections = bill_to_bill_model.sections
     if sections is None:
         return None
-    for section in sections:
-        save_section(section, db)
+    batch_save_bill_to_bill_sections([bill_to_bill_model], db=db)
+
+
+def get_section_to_section_models(
+        b2b_models: list[pymodels.BillToBillModel]
+) -> list[pymodels.SectionToSectionModel]:
+    """
+    The section to section matches of the 'sections' of the bill to bill models, with the score that is saved:
+    the query score or, for matches found without a query, their similarity (see SimilarSection.getScore).
+    """
+    s2s_models = []
+    for model in b2b_models:
+        for section in model.sections or []:
+            for similar_section in section.similar_sections:
+                s2s_models.append(
+                    pymodels.SectionToSectionModel(
+                        bill_number=section.billnumber_version,
+                        bill_number_to=similar_section.billnumber_version,
+                        section_id=section.section_id,
+                        section_to_id=similar_section.section_id,
+                        score=similar_section.getScore(),
+                        currency_id=model.currency_id))
+    return s2s_models
+
+
+def batch_save_bill_to_bill_sections(
+        b2b_models: list[pymodels.BillToBillModel],
+        db: Optional[Session] = None):
+    """
+    Save the output of bill_similarity.getBillToBill for a bill in a single transaction:
+    the bills (if missing), the matched sections of both bills, the bill to bill joins and
+    the section to section matches, with one bulk id resolution, one upsert per table and one commit.
+
+    Args:
+        b2b_models (list[pymodels.BillToBillModel]): the values of the dict returned by getBillToBill
+        db (Session, optional): db session. Defaults to None, for a new session (see get_session).
+    """
+    if not b2b_models:
+        return
+    lengths = {}
+    for model in b2b_models:
+        lengths[model.billnumber_version] = model.length
+        lengths.setdefault(model.billnumber_version_to, model.length_to)
+    # The ids are read in the transaction that saves the missing bills and the joins
+    with get_session(db) as session:
+        bill_ids = batch_get_bill_ids(list(lengths.keys()), db=session)
+
+        missing_bills = []
+        for billnumber_version, bill_id in bill_ids.items():
+            if bill_id is not None:
+                continue
+            logger.warning(f'No bill found in db for {billnumber_version}')
+            try:
+                billnumber_version_dict = getBillnumberversionParts(
+                    billnumber_version)
+            except ValueError:
+                logger.error(
+                    f'Billnumber version not of the correct form: {billnumber_version}'
+                )
+                continue
+            length = lengths[billnumber_version]
+            if length is None:
+                try:
+                    length = getBillLength(billnumber_version)
+                except Exception as e:
+                    logger.warning(
+                        f'Could not get length of {billnumber_version}: {e}')
+            missing_bills.append(
+                pymodels.Bill(billnumber=str(billnumber_version_dict.get('billnumber')),
+                              version=str(billnumber_version_dict.get('version')),
+                              length=length))
+
+        if missing_bills:
+            bill_ids.update(
+                batch_save_bills(missing_bills, db=session))
+        b2b_models = [
+            model for model in b2b_models
+            if bill_ids.get(model.billnumber_version) and
+            bill_ids.get(model.billnumber_version_to)
+        ]
+
+        section_metas = []
+        for model in b2b_models:
+            for section in model.sections or []:
+                section_metas.append(section)
+                section_metas.extend(section.similar_sections)
+        s2s_models = get_section_to_section_models(b2b_models)
+        section_ids = batch_save_sectionitems(section_metas,
+                                              bill_ids=bill_ids,
+                                              db=session)
+        sectiondict = {}
+        for (billnumber_version, section_id), id in section_ids.items():
+            sectiondict.setdefault(billnumber_version, {})[section_id] = (
+                id, bill_ids.get(billnumber_version))
+
+        batch_save_bill_to_bill(b2b_models,
+                                bill_ids=bill_ids,
+                                db=session)
+        batch_save_section_to_section(s2s_models,
+                                      sectiondict=sectiondict,
+                                      db=session)
 
 
 def save_bill_and_sections(billPath: pymodels.BillPath,
-                           replace=False) -> pymodels.Status:
+                           replace=False,
+                           db: Optional[Session] = None,
+                           parsedBill: Optional[pymodels.ParsedBill] = None
+                          ) -> pymodels.Status:
     """
     Parse bill (from path) and save it, and its sections to the Bill and SectionItem
     tables, respectively.
@@ -558,6 +850,8 @@ def save_bill_and_sections(billPath: pymodels.BillPath,
     Args:
         billPath (pymodels.BillPath): absolute path to the bill XML 
         replace (bool, optional): replace the bill or section if it already exists. Defaults to False.
+        db (Session, optional): db session. Defaults to None, for a new session (see get_session).
+        parsedBill (pymodels.ParsedBill, optional): the already parsed bill. Defaults to None (get it from the bill cache).
 
     Returns:
         pymodels.Status: status of save to db, of the form {success: True/False, message: 'message'}} 
@@ -565,15 +859,10 @@ def save_bill_and_sections(billPath: pymodels.BillPath,
     status = pymodels.Status(
         success=True, message=f'Indexed bill: {billPath.billnumber_version};')
 
-    billTree = parseFilePath(billPath.filePath)
-    length = getBillLengthbyPath(billPath.filePath)
-    defaultNS = getDefaultNamespace(billTree)
-    if defaultNS and defaultNS == constants.NAMESPACE_USLM2:
-        logger.debug('Parsing bill WITH USLM2')
-        logger.debug('defaultNS: {}'.format(defaultNS))
-    else:
-        logger.debug('NO NAMESPACE')
-    sections = getSections(billTree, defaultNS)
+    if parsedBill is None:
+        parsedBill = getParsedBill(billPath.filePath)
+    length = parsedBill.length
+    sections = parsedBill.sections
 
     billmatch = constants.BILL_NUMBER_REGEX_COMPILED.match(
         billPath.billnumber_version)
@@ -583,13 +872,15 @@ def save_bill_and_sections(billPath: pymodels.BillPath,
         billmatch_dict = billmatch.groupdict()
         billnumber = '{congress}{stage}{number}'.format(**billmatch_dict)
         billversion = billmatch_dict.get('version', '')
+    bill_ids = None
     try:
         bill = pymodels.Bill(billnumber=billnumber,
                              version=billversion,
                              length=length)
-        savedbill = save_bill(bill)
-        if savedbill:
-            status.message = status.message + f'; id={bill.id}'
+        bill_ids = batch_save_bills([bill], db=db)
+        bill_id = bill_ids.get(f'{billnumber}{billversion}')
+        if bill_id is not None:
+            status.message = status.message + f'; id={bill_id}'
         else:
             status.success = False
             status.message = status.message + f'; Could not save bill'
@@ -599,34 +890,19 @@ def save_bill_and_sections(billPath: pymodels.BillPath,
         status.success = False
         status.message = 'Could not add bill to database: {}'.format(e)
 
-    sectionData = [{
-        'section_id':
-            getId(section),
-        'section_number':
-            getEnum(section, defaultNS),
-        'section_text':
-            etree.tostring(section, method="text", encoding="unicode"),
-        'section_length':
-            len(etree.tostring(section, method="text", encoding="unicode")),
-    } for section in sections]
     try:
-        # Add sectionItems to db here
-        for sectionDataItem in sectionData:
-            if sectionDataItem.get('section_id') is None:
-                continue
-            try:
-                section_meta = pymodels.SectionMeta(
-                    billnumber_version=f'{billnumber}{billversion}',
-                    section_id=sectionDataItem.get('section_id'),
-                    label=sectionDataItem.get('section_number', ''),
-                    length=sectionDataItem.get('length', 0))
-                get_or_create_sectionitem(section_meta)
-            except Exception as e:
-                logger.error(
-                    f'Could not add section in {billnumber}{billversion} to database: {e}'
-                )
-                logger.error(f'{sectionDataItem}')
-        status.message = status.message + f'; saved {len(sectionData)} sections'
+        # Add sectionItems to db here, in one batch
+        section_metas = [
+            pymodels.SectionMeta(billnumber_version=f'{billnumber}{billversion}',
+                                 section_id=section.section_id,
+                                 label=section.enum,
+                                 header=section.header,
+                                 length=section.length)
+            for section in sections
+            if section.section_id is not None
+        ]
+        batch_save_sectionitems(section_metas, bill_ids=bill_ids, db=db)
+        status.message = status.message + f'; saved {len(sections)} sections'
     except Exception as e:
         logger.error('Could not add sections to database: {}'.format(e))
         status.success = False
@@ -1,17 +1,142 @@
 #!/usr/bin/env python3
 from copy import deepcopy
+import os
 import sys
+import time
 import logging
-from elasticsearch import exceptions, Elasticsearch
+import threading
+from typing import Optional
+from elasticsearch import exceptions, Elasticsearch, Transport
 from billsim import constants
+from billsim.deadline import Deadline
 from billsim.pymodels import SectionMeta, QuerySection
-
-es = Elasticsearch()
+from billsim.section_store import SectionCorpus
 
 logger = logging.getLogger(constants.LOGGER_NAME)
 logger.addHandler(logging.StreamHandler(sys.stdout))
 logger.setLevel(logging.INFO)
 
+_es_client = None
+_es_client_lock = threading.Lock()
+_async_es_client = None
+
+
+def getRetryDelay(attempt: int) -> float:
+    """
+    Seconds to wait before retry number attempt (starting from 0): exponential backoff,
+    capped at constants.ES_RETRY_BACKOFF_MAX.
+    """
+    return min(constants.ES_RETRY_BACKOFF * (2**attempt),
+               constants.ES_RETRY_BACKOFF_MAX)
+
+
+def isRetryable(e: Exception) -> bool:
+    if isinstance(e, exceptions.ConnectionTimeout):
+        return True
+    return isinstance(e, exceptions.TransportError
+                     ) and e.status_code in constants.ES_RETRY_ON_STATUS
+
+
+class BackoffTransport(Transport):
+    """
+    Transport that retries requests that time out or fail with a status in
+    constants.ES_RETRY_ON_STATUS (e.g. 429 Too Many Requests), with exponential backoff.
+    The request_timeout of a request bounds all of its attempts, including the waits between them.
+    """
+
+    def perform_request(self, method, url, headers=None, params=None, body=None):
+        attempt = 0
+        requestTimeout = (params or {}).get('request_timeout')
+        start = time.time()
+        while True:
+            # The parent transport pops request_timeout from the params
+            attemptParams = None if params is None else dict(params)
+            if requestTimeout is not None:
+                attemptParams['request_timeout'] = max(
+                    0.001, requestTimeout - (time.time() - start))
+            try:
+                return super().perform_request(method,
+                                               url,
+                                               headers=headers,
+                                               params=attemptParams,
+                                               body=body)
+            except exceptions.TransportError as e:
+                if attempt >= constants.ES_MAX_RETRIES or not isRetryable(e):
+                    raise
+                delay = getRetryDelay(attempt)
+                if requestTimeout is not None and time.time(
+                ) - start + delay >= requestTimeout:
+                    raise
+                logger.warning(
+                    f'Elasticsearch request {method} {url} failed ({e.status_code}); retrying in {delay}s'
+                )
+                time.sleep(delay)
+                attempt += 1
+
+
+def getEsClientOptions() -> dict:
+    """
+    Options for the Elasticsearch client, from constants (set in the environment or .env).
+    Retries are done by BackoffTransport, so the retries of the underlying transport are disabled.
+    """
+    return {
+        'hosts': constants.ES_HOSTS,
+        'maxsize': constants.ES_MAXSIZE,
+        'timeout': constants.ES_TIMEOUT,
+        'max_retries': 0,
+        'retry_on_timeout': False,
+        'sniff_on_start': constants.ES_SNIFF,
+        'sniff_on_connection_fail': constants.ES_SNIFF,
+        'sniffer_timeout': 60 if constants.ES_SNIFF else None
+    }
+
+
+def getEsClient() -> Elasticsearch:
+    """
+    Returns the shared Elasticsearch client, creating it on first use.
+    The client is thread-safe and keeps a pool of connections to each node.
+    """
+    global _es_client
+    if _es_client is None:
+        with _es_client_lock:
+            if _es_client is None:
+                _es_client = Elasticsearch(transport_class=BackoffTransport,
+                                           **getEsClientOptions())
+    return _es_client
+
+
+def getAsyncEsClient():
+    """
+    Returns the shared AsyncElasticsearch client, creating it on first use.
+    Requires the async extra of the elasticsearch client (`pip install elasticsearch[async]`).
+    The async transport retries on constants.ES_RETRY_ON_STATUS and on timeouts, without backoff.
+    """
+    global _async_es_client
+    if _async_es_client is None:
+        from elasticsearch import AsyncElasticsearch
+        options = getEsClientOptions()
+        options.update({
+            'max_retries': constants.ES_MAX_RETRIES,
+            'retry_on_status': constants.ES_RETRY_ON_STATUS,
+            'retry_on_timeout': True
+        })
+        _async_es_client = AsyncElasticsearch(**options)
+    return _async_es_client
+
+
+def resetEsClient():
+    """
+    Drops the shared clients, so that the next call to getEsClient or getAsyncEsClient creates a new one.
+    Called in forked child processes, which must not share the parent's connections.
+    """
+    global _es_client, _es_client_lock, _async_es_client
+    _es_client = None
+    _es_client_lock = threading.Lock()
+    _async_es_client = None
+
+
+os.register_at_fork(after_in_child=resetEsClient)
+
 
 def getHitsHits(res) -> list:
     return res.get('hits').get('hits')
@@ -48,33 +173,154 @@ def getMinScore(queryText: str) -> int:
         return 60
 
 
+def getDeadlineParams(deadline: Optional[Deadline]) -> dict:
+    """
+    Request parameters that bound a search by the deadline: the client gives up after the remaining time
+    (request_timeout) and Elasticsearch stops searching the shards (timeout).
+    Raises DeadlineExceeded if the deadline has already expired.
+    """
+    if deadline is None or deadline.expires_at is None:
+        return {}
+    deadline.check()
+    remaining = deadline.remaining()
+    return {
+        'request_timeout': remaining,
+        'timeout': '{}ms'.format(max(1, int(remaining * 1000)))
+    }
+
+
 def runQuery(index: str = constants.INDEX_SECTIONS,
              query: dict = constants.SAMPLE_QUERY_NESTED_MLT,
-             size: int = constants.MAX_BILLS_SECTION) -> dict:
+             size: int = constants.MAX_BILLS_SECTION,
+             deadline: Optional[Deadline] = None) -> dict:
     """
   See API documentation
   https://elasticsearch-py.readthedocs.io/en/v7.10.1/api.html#elasticsearch.Elasticsearch.search
+  With a deadline, the search is cancelled when the deadline expires (see getDeadlineParams).
   """
-    query = query
-    return es.search(index=index, body=query, size=size)
+    try:
+        return getEsClient().search(index=index,
+                                    body=query,
+                                    size=size,
+                                    **getDeadlineParams(deadline))
+    except exceptions.ConnectionTimeout as e:
+        if deadline is not None and deadline.expired():
+            raise deadline.getError() from e
+        raise
 
 
 def moreLikeThis(queryText: str,
                  index: str = constants.INDEX_SECTIONS,
                  score_mode: str = constants.SCORE_MODE_MAX,
                  size: int = constants.MAX_BILLS_SECTION,
-                 min_score: int = constants.MIN_SCORE_DEFAULT) -> dict:
+                 min_score: int = constants.MIN_SCORE_DEFAULT,
+                 deadline: Optional[Deadline] = None) -> dict:
     if min_score == constants.MIN_SCORE_DEFAULT:
         min_score = getMinScore(queryText)
     query = constants.makeMLTQuery(queryText,
                                    min_score=min_score,
                                    score_mode=score_mode)
-    return runQuery(index=index, query=query, size=size)
+    return runQuery(index=index, query=query, size=size, deadline=deadline)
+
+
+def moreLikeThisBatch(queryTexts: list[str],
+                      index: str = constants.INDEX_SECTIONS,
+                      score_mode: str = constants.SCORE_MODE_MAX,
+                      size: int = constants.MAX_BILLS_SECTION,
+                      min_score: int = constants.MIN_SCORE_DEFAULT,
+                      batch_size: int = constants.MSEARCH_BATCH_SIZE,
+                      deadline: Optional[Deadline] = None) -> list:
+    """
+    Runs a more_like_this query for each of the queryTexts, packing up to batch_size
+    queries into each _msearch request.
+    With a deadline, each request is bounded by the remaining time and no request is made once it expires.
+    See https://elasticsearch-py.readthedocs.io/en/v7.10.1/api.html#elasticsearch.Elasticsearch.msearch
+
+    Args:
+        queryTexts (list[str]): texts to query, e.g. the section texts of a bill.
+        index (str, optional): index to query. Defaults to constants.INDEX_SECTIONS.
+        score_mode (str, optional): score_mode of the nested query. Defaults to constants.SCORE_MODE_MAX.
+        size (int, optional): maximum number of hits per query. Defaults to constants.MAX_BILLS_SECTION.
+        min_score (int, optional): minimum score; if MIN_SCORE_DEFAULT, it is scaled by the length of each text (see getMinScore).
+        batch_size (int, optional): number of queries per _msearch request. Defaults to constants.MSEARCH_BATCH_SIZE.
+        deadline (Deadline, optional): deadline of the search. Defaults to None (no limit).
+
+    Raises:
+        DeadlineExceeded: if the deadline expires before all of the queries are run
+
+    Returns:
+        list: one search response per queryText, in the same order as queryTexts.
+         A query that failed in Elasticsearch returns an empty response.
+    """
+    if batch_size < 1:
+        raise ValueError('batch_size must be at least 1')
+    responses = []
+    for start in range(0, len(queryTexts), batch_size):
+        deadlineParams = getDeadlineParams(deadline)
+        # _msearch takes the search timeout in the body of each search
+        searchTimeout = deadlineParams.pop('timeout', None)
+        body = []
+        for queryText in queryTexts[start:start + batch_size]:
+            body.append({'index': index})
+            query = makeMoreLikeThisQuery(queryText,
+                                          score_mode=score_mode,
+                                          size=size,
+                                          min_score=min_score)
+            if searchTimeout is not None:
+                query['timeout'] = searchTimeout
+            body.append(query)
+        try:
+            res = getEsClient().msearch(body=body,
+                                        index=index,
+                                        **deadlineParams)
+        except exceptions.ConnectionTimeout as e:
+            if deadline is not None and deadline.expired():
+                raise deadline.getError() from e
+            raise
+        for response in res.get('responses', []):
+            if response.get('error'):
+                logger.error('Error in msearch response: {}'.format(
+                    response.get('error')))
+                response = {'hits': {'hits': []}}
+            responses.append(response)
+    return responses
+
+
+def makeMoreLikeThisQuery(queryText: str,
+                          score_mode: str = constants.SCORE_MODE_MAX,
+                          size: int = constants.MAX_BILLS_SECTION,
+                          min_score: int = constants.MIN_SCORE_DEFAULT) -> dict:
+    """
+    Builds the more_like_this query run by moreLikeThisBatch and moreLikeThisAsync, with the size in the query body.
+    """
+    if min_score == constants.MIN_SCORE_DEFAULT:
+        min_score = getMinScore(queryText)
+    query = constants.makeMLTQuery(queryText,
+                                   min_score=min_score,
+                                   score_mode=score_mode)
+    query['size'] = size
+    return query
+
+
+async def moreLikeThisAsync(queryText: str,
+                            index: str = constants.INDEX_SECTIONS,
+                            score_mode: str = constants.SCORE_MODE_MAX,
+                            size: int = constants.MAX_BILLS_SECTION,
+                            min_score: int = constants.MIN_SCORE_DEFAULT) -> dict:
+    """
+    Async version of moreLikeThis, using the shared AsyncElasticsearch client.
+    """
+    query = makeMoreLikeThisQuery(queryText,
+                                  score_mode=score_mode,
+                                  size=size,
+                                  min_score=min_score)
+    return await getAsyncEsClient().search(index=index, body=query)
 
 
 def getBill_es(billnumber: str,
                version: str = '',
-               index: str = constants.INDEX_SECTIONS):
+               index: str = constants.INDEX_SECTIONS,
+               source_excludes: Optional[list[str]] = None):
     """
     Get a bill or bills from Elasticsearch by billnumber or billnumber + version.
     If billnumber + version 
@@ -83,6 +329,7 @@ def getBill_es(billnumber: str,
         billnumber (str): billnumber of the form '116hr2500' 
         version (str, optional): version of the form 'ih', 'eh', 'enr', etc. Defaults to ''.
         index (str, optional): [description]. Defaults to constants.INDEX_SECTIONS.
+        source_excludes (list[str], optional): fields to leave out of the _source, e.g. ['sections.section_xml'].
 
     Returns:
         list of _source document: a list of the [_source] field of the es document, of the form:
@@ -110,11 +357,15 @@ def getBill_es(billnumber: str,
         if version != '':
             logger.debug(f'Getting bill {billnumber} version {version}')
             billnumber_version = billnumber + version
-            res = es.get(index=index, id=billnumber_version)
+            res = getEsClient().get(index=index,
+                                    id=billnumber_version,
+                                    _source_excludes=source_excludes)
         else:
             logger.warning(f'Getting bill {billnumber} without version')
             query = deepcopy(constants.SAMPLE_MATCH_BILLNUMBER_QUERY)
             query['query']['match']['billnumber'] = billnumber
+            if source_excludes:
+                query['_source'] = {'excludes': source_excludes}
             res = runQuery(index=index, query=query)
 
         if res.get('_source'):
@@ -126,11 +377,128 @@ def getBill_es(billnumber: str,
         return None
 
 
-def esSourceToQueryData(source: dict) -> list[QuerySection]:
+async def getBill_esAsync(billnumber: str,
+                          version: str = '',
+                          index: str = constants.INDEX_SECTIONS,
+                          source_excludes: Optional[list[str]] = None):
+    """
+    Async version of getBill_es, using the shared AsyncElasticsearch client.
+    """
+    es = getAsyncEsClient()
+    try:
+        if version != '':
+            logger.debug(f'Getting bill {billnumber} version {version}')
+            res = await es.get(index=index,
+                               id=billnumber + version,
+                               _source_excludes=source_excludes)
+        else:
+            logger.warning(f'Getting bill {billnumber} without version')
+            query = deepcopy(constants.SAMPLE_MATCH_BILLNUMBER_QUERY)
+            query['query']['match']['billnumber'] = billnumber
+            if source_excludes:
+                query['_source'] = {'excludes': source_excludes}
+            res = await es.search(index=index,
+                                  body=query,
+                                  size=constants.MAX_BILLS_SECTION)
+
+        if res.get('_source'):
+            return [res['_source']]
+        else:
+            return [item['_source'] for item in getHitsHits(res)]
+    except exceptions.NotFoundError:
+        logger.error(f'No bill found in Elasticsearch index for {billnumber}')
+        return None
+
+
+def getQuerySourceExcludes(corpus: Optional[SectionCorpus] = None) -> list[str]:
+    """
+    The fields of a bill's _source that esSourceToQueryData does not need: the section XML and, when the texts
+    can be read from the corpus, the section texts.
+    """
+    excludes = ['sections.section_xml']
+    if corpus is not None:
+        excludes.append('sections.section_text')
+    return excludes
+
+
+def hasQueryTexts(querySections: list[QuerySection]) -> bool:
+    """
+    Whether each of the query sections has its text, or a reference to it in the corpus. It does not
+    when the texts were left out of the _source and the corpus does not have the same sections.
+    """
+    return all(
+        querySection.query_text is not None or querySection.text_ref is not None
+        for querySection in querySections)
+
+
+def getBillQueryData_es(
+    billnumber: str,
+    version: str,
+    corpus: Optional[SectionCorpus] = None,
+    index: str = constants.INDEX_SECTIONS
+) -> Optional[tuple[int, list[QuerySection]]]:
+    """
+    The length and query sections of a bill in Elasticsearch, or None if it is not found.
+    With a corpus, the _source is fetched without the section texts, which are read from the corpus;
+    if the corpus does not have the same sections, the _source is fetched again with them.
+    The _source is not kept once the query sections are made.
+    """
+    bill = getBill_es(billnumber=billnumber,
+                      version=version,
+                      index=index,
+                      source_excludes=getQuerySourceExcludes(corpus))
+    if not bill:
+        return None
+    querySections = esSourceToQueryData(bill[0], corpus=corpus)
+    if corpus is not None and not hasQueryTexts(querySections):
+        bill = getBill_es(billnumber=billnumber,
+                          version=version,
+                          index=index,
+                          source_excludes=getQuerySourceExcludes())
+        if not bill:
+            return None
+        querySections = esSourceToQueryData(bill[0])
+    return bill[0].get('length', 0), querySections
+
+
+async def getBillQueryData_esAsync(
+    billnumber: str,
+    version: str,
+    corpus: Optional[SectionCorpus] = None,
+    index: str = constants.INDEX_SECTIONS
+) -> Optional[tuple[int, list[QuerySection]]]:
+    """
+    Async version of getBillQueryData_es.
+    """
+    bill = await getBill_esAsync(billnumber=billnumber,
+                                 version=version,
+                                 index=index,
+                                 source_excludes=getQuerySourceExcludes(corpus))
+    if not bill:
+        return None
+    querySections = esSourceToQueryData(bill[0], corpus=corpus)
+    if corpus is not None and not hasQueryTexts(querySections):
+        bill = await getBill_esAsync(billnumber=billnumber,
+                                     version=version,
+                                     index=index,
+                                     source_excludes=getQuerySourceExcludes())
+        if not bill:
+            return None
+        querySections = esSourceToQueryData(bill[0])
+    return bill[0].get('length', 0), querySections
+
+
+def esSourceToQueryData(source: dict,
+                        corpus: Optional[SectionCorpus] = None
+                       ) -> list[QuerySection]:
     """
     Convert the _source field of an Elasticsearch document to a list of bill sections.
+    With a corpus that has the same sections (section_ids, in order) as the source, the sections refer to their
+    texts in the corpus (text_ref), and the texts of the source, which may have been left out of it, are not used.
+    Otherwise, the texts are those of the source.
     Args:
         source (dict): _source field of an Elasticsearch document.
+        corpus (SectionCorpus, optional): section corpus (see section_store.getSectionCorpus). Defaults to None.
 
     Returns:
         list[QuerySection]: a list of items with SectionMeta and query_text.
@@ -141,12 +509,19 @@ def esSourceToQueryData(source: dict) -> list[QuerySection]:
     sections = source.get('sections')
     if sections is None or len(sections) == 0:
         return []
+    textRefs = None
+    sectionIds = [section.get('section_id', '') for section in sections]
+    if corpus is not None and corpus.store.getSectionIds(
+            billnumber_version) == sectionIds:
+        textRefs = corpus.getSectionTexts(billnumber_version)
     return [
         QuerySection(billnumber_version=billnumber_version,
                      section_id=section.get('section_id', ''),
                      label=section.get('section_number', ''),
                      header=section.get('section_header', ''),
                      length=section.get('section_length', 0),
-                     query_text=section.get('section_text'))
-        for section in sections
+                     query_text=None
+                     if textRefs is not None else section.get('section_text'),
+                     text_ref=textRefs[i] if textRefs is not None else None)
+        for i, section in enumerate(sections)
     ]
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+A manifest of indexed bill files, stored as JSON next to the data directory.
+Each entry records the path, size, mtime and content hash of a bill XML file and when it was indexed,
+so that an update only indexes bills that are new or changed.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import logging
+from datetime import datetime
+from typing import Iterable
+
+from billsim import constants
+from billsim.pymodels import BillPath, ManifestEntry
+from billsim.utils import getBillLengthbyPath, setBillLength
+
+logger = logging.getLogger(constants.LOGGER_NAME)
+logger.addHandler(logging.StreamHandler(sys.stdout))
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def getFileHash(filePath: str) -> str:
+    """
+    Returns the sha256 hex digest of the file contents.
+    """
+    sha = hashlib.sha256()
+    with open(filePath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def loadManifest(
+    manifest_path: str = constants.INDEX_MANIFEST_PATH
+) -> dict[str, ManifestEntry]:
+    """
+    Load the manifest.
+
+    Returns:
+        dict[str, ManifestEntry]: manifest entries keyed by file path. Empty if there is no manifest file.
+    """
+    if not os.path.isfile(manifest_path):
+        logger.info(f'No manifest found at {manifest_path}')
+        return {}
+    with open(manifest_path, 'r') as f:
+        items = json.load(f)
+    manifest = {item['filePath']: ManifestEntry(**item) for item in items}
+    # Bill lengths in the manifest do not need to be counted again
+    for entry in manifest.values():
+        if entry.length is not None:
+            setBillLength(entry.filePath, entry.mtime, entry.length)
+    return manifest
+
+
+def saveManifest(manifest: dict[str, ManifestEntry],
+                 manifest_path: str = constants.INDEX_MANIFEST_PATH):
+    """
+    Save the manifest. Writes to a temporary file first, so an interrupted save does not corrupt the manifest.
+    """
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump([
+            json.loads(entry.json())
+            for entry in sorted(manifest.values(), key=lambda e: e.filePath)
+        ], f)
+    os.replace(tmp_path, manifest_path)
+
+
+def makeManifestEntry(billPath: BillPath,
+                      content_hash: str = None) -> ManifestEntry:
+    stat = os.stat(billPath.filePath)
+    if content_hash is None:
+        content_hash = getFileHash(billPath.filePath)
+    return ManifestEntry(billnumber_version=billPath.billnumber_version,
+                         filePath=billPath.filePath,
+                         size=stat.st_size,
+                         mtime=stat.st_mtime,
+                         content_hash=content_hash,
+                         length=getBillLengthbyPath(billPath.filePath))
+
+
+def markIndexed(manifest: dict[str, ManifestEntry], billPath: BillPath):
+    """
+    Marks the bill as indexed. The entry that diffManifest made before the bill was indexed is kept,
+    so that a file that changed while it was being indexed is found to have changed by the next diffManifest.
+    Without such an entry, the file is hashed now.
+    """
+    entry = manifest.get(billPath.filePath)
+    if entry is None or entry.indexed_at is not None:
+        entry = makeManifestEntry(billPath)
+    elif entry.length is None:
+        entry.length = getBillLengthbyPath(billPath.filePath)
+    entry.indexed_at = datetime.utcnow()
+    manifest[billPath.filePath] = entry
+
+
+def diffManifest(
+    manifest: dict[str, ManifestEntry], billPaths: Iterable[BillPath]
+) -> tuple[list[BillPath], list[ManifestEntry]]:
+    """
+    Compare the bill files on disk with the manifest.
+    A file whose size and mtime match its entry is unchanged; otherwise its content hash is compared.
+    A file with a new mtime and the same content is not reindexed, but its entry is updated.
+    A new or changed file gets an entry that is not marked as indexed, with its size, mtime and content hash
+    as they are before it is indexed; markIndexed marks it once the bill is indexed.
+
+    Args:
+        manifest (dict[str, ManifestEntry]): the manifest, from loadManifest. Updated in place.
+        billPaths (Iterable[BillPath]): the bill files currently on disk, e.g. from utils.iterBillXmlPaths.
+
+    Returns:
+        tuple[list[BillPath], list[ManifestEntry]]: bills that are new or changed, and entries whose files no longer exist
+    """
+    changed = []
+    seen = set()
+    for billPath in billPaths:
+        entry = manifest.get(billPath.filePath)
+        try:
+            stat = os.stat(billPath.filePath)
+        except FileNotFoundError:
+            # The file was removed since it was listed
+            continue
+        seen.add(billPath.filePath)
+        if entry is not None and entry.indexed_at is not None:
+            if stat.st_size == entry.size and stat.st_mtime == entry.mtime:
+                continue
+            content_hash = getFileHash(billPath.filePath)
+            if content_hash == entry.content_hash:
+                entry.size = stat.st_size
+                entry.mtime = stat.st_mtime
+                if entry.length is not None:
+                    setBillLength(entry.filePath, entry.mtime, entry.length)
+                continue
+        else:
+            content_hash = getFileHash(billPath.filePath)
+        manifest[billPath.filePath] = ManifestEntry(
+            billnumber_version=billPath.billnumber_version,
+            filePath=billPath.filePath,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            content_hash=content_hash)
+        changed.append(billPath)
+    removed = [
+        entry for filePath, entry in manifest.items() if filePath not in seen
+    ]
+    return changed, removed
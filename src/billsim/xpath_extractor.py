@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Compiled XPath expressions for the section, enum and header lookups of utils.getSections, getEnum and getHeader.
+element.xpath() compiles its expression (and a namespaces dict) on every call, and these lookups run once per
+section of every bill; SectionExtractor compiles each expression once per (namespace, expression), and is shared
+by all bills. etree.XPath objects are not shared between threads, so each thread compiles its own.
+
+The micro-benchmark compares the cost per section of the lookups with element.xpath() and with the extractor:
+$ python -m billsim.xpath_extractor tests/samples/data/congress/117/bills/hr2000/BILLS-117hr2000ih-uslm.xml
+"""
+
+import sys
+import time
+import argparse
+import threading
+from typing import List
+
+from lxml import etree
+
+# 'ns:' is the prefix of the default namespace; it is removed for bills without a namespace
+XPATH_SECTIONS = '//ns:section[not(ancestor::ns:section) and not(@status="withdrawn")]'
+# NOTE: USLM uses 'num', bill dtd uses 'enum'
+XPATH_ENUM = 'ns:enum | ns:num'
+# NOTE: USLM uses 'heading', bill dtd uses 'header'
+XPATH_HEADER = 'ns:header | ns:heading'
+
+
+def getFirstText(elements) -> str:
+    if elements and elements[0].text is not None:
+        return elements[0].text.strip()
+    return ''
+
+
+class SectionExtractor:
+    """
+    Compiled XPath expressions, by (namespace, expression), for each thread.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def getXPath(self, expression: str, namespace: str = None) -> etree.XPath:
+        xpaths = getattr(self._local, 'xpaths', None)
+        if xpaths is None:
+            xpaths = self._local.xpaths = {}
+        key = (namespace or '', expression)
+        xpath = xpaths.get(key)
+        if xpath is None:
+            if namespace:
+                xpath = etree.XPath(expression, namespaces={'ns': namespace})
+            else:
+                xpath = etree.XPath(expression.replace('ns:', ''))
+            xpaths[key] = xpath
+        return xpath
+
+    def getSections(self, billTree, namespace: str = None) -> List:
+        return self.getXPath(XPATH_SECTIONS, namespace)(billTree)
+
+    def getEnum(self, section, namespace: str = None) -> str:
+        return getFirstText(self.getXPath(XPATH_ENUM, namespace)(section))
+
+    def getHeader(self, section, namespace: str = None) -> str:
+        return getFirstText(self.getXPath(XPATH_HEADER, namespace)(section))
+
+
+SECTION_EXTRACTOR = SectionExtractor()
+
+
+def extractUncompiled(billTree, namespace: str) -> list[tuple[str, str]]:
+    """
+    The lookups as they were made before SectionExtractor, with element.xpath(), for the benchmark.
+    """
+    if namespace:
+        sections = billTree.xpath(XPATH_SECTIONS, namespaces={'ns': namespace})
+        return [(getFirstText(
+            section.xpath(XPATH_ENUM, namespaces={'ns': namespace})),
+                 getFirstText(
+                     section.xpath(XPATH_HEADER,
+                                   namespaces={'ns': namespace})))
+                for section in sections]
+    sections = billTree.xpath(XPATH_SECTIONS.replace('ns:', ''))
+    return [(getFirstText(section.xpath(XPATH_ENUM.replace('ns:', ''))),
+             getFirstText(section.xpath(XPATH_HEADER.replace('ns:', ''))))
+            for section in sections]
+
+
+def extractCompiled(billTree,
+                    namespace: str,
+                    extractor: SectionExtractor = SECTION_EXTRACTOR
+                   ) -> list[tuple[str, str]]:
+    return [(extractor.getEnum(section, namespace),
+             extractor.getHeader(section, namespace))
+            for section in extractor.getSections(billTree, namespace)]
+
+
+def benchmark(filePaths: list[str], repeat: int = 20) -> dict:
+    """
+    Times the section, enum and header lookups of the bills, with element.xpath() and with SECTION_EXTRACTOR.
+
+    Returns:
+        dict: {'sections': number of sections, 'uncompiled_us': and 'compiled_us': microseconds per section}
+    """
+    billTrees = []
+    for filePath in filePaths:
+        billTree = etree.parse(filePath, parser=etree.XMLParser())
+        billTrees.append((billTree, billTree.getroot().nsmap.get(None, '')))
+    numSections = sum(
+        len(extractCompiled(billTree, namespace))
+        for billTree, namespace in billTrees)
+    for billTree, namespace in billTrees:
+        if extractCompiled(billTree, namespace) != extractUncompiled(
+                billTree, namespace):
+            raise ValueError('The compiled and uncompiled lookups differ')
+    results = {'sections': numSections}
+    for name, extract in [('uncompiled_us', extractUncompiled),
+                          ('compiled_us', extractCompiled)]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for billTree, namespace in billTrees:
+                extract(billTree, namespace)
+        elapsed = time.perf_counter() - start
+        results[name] = elapsed * 1e6 / max(1, numSections * repeat)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=
+        'Benchmark the section, enum and header lookups, per section, with and without compiled XPath.'
+    )
+    parser.add_argument('paths', nargs='+', help='bill XML files')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    results = benchmark(args.paths, repeat=args.repeat)
+    print(
+        f"{results['sections']} sections: {results['uncompiled_us']:.1f} us per section with element.xpath(), "
+        f"{results['compiled_us']:.1f} us with SectionExtractor "
+        f"({results['uncompiled_us'] / max(results['compiled_us'], 1e-9):.1f}x)",
+        file=sys.stdout)
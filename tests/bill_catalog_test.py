@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+import os
+import time
+
+from tests.utils_test import CONGRESS_PATH_TEST
+
+
+def test_BillCatalog(tmp_path):
+    from billsim.bill_catalog import BillCatalog
+    catalog = BillCatalog(str(tmp_path / 'bill_catalog.sqlite'))
+    changed, removed = catalog.refresh(congressDataDir=CONGRESS_PATH_TEST,
+                                       pathType='congressdotgov')
+    assert changed == len(catalog) >= 27
+    assert removed == 0
+
+    entry = catalog.get('116hr2004ih')
+    assert entry.fileName == 'BILLS-116hr2004ih-uslm.xml'
+    assert (entry.congress, entry.bill_type, entry.version) == (116, 'hr', 'ih')
+    assert entry.size == os.stat(entry.filePath).st_size
+    assert catalog.getBillPath('116hr2004ih').filePath == entry.filePath
+    assert catalog.get('116hr1ih') is None
+
+    billPaths = list(catalog.iterBillPaths(congresses=[116], bill_types=['hr']))
+    assert billPaths and all(
+        billPath.billnumber_version.startswith('116hr') for billPath in billPaths)
+    assert list(catalog.iterEntries(changed_since=time.time() + 60)) == []
+
+    # Nothing changed since the last refresh
+    assert catalog.refresh(congressDataDir=CONGRESS_PATH_TEST,
+                           pathType='congressdotgov') == (0, 0)
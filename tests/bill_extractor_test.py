@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+from lxml import etree
+
+from tests.xpath_extractor_test import BILL_PATH_DTD, BILL_PATH_USLM
+
+
+def test_extractBill():
+    from billsim.bill_extractor import extractBill
+    from billsim.utils import getBillMeta, getDefaultNamespace, getSectionRecords, parseFilePath
+    for filePath in [BILL_PATH_USLM, BILL_PATH_DTD]:
+        billTree = parseFilePath(filePath)
+        defaultNS = getDefaultNamespace(billTree)
+        extracted = extractBill(billTree, defaultNS, filePath)
+        assert extracted.meta.congress and extracted.meta.legisnum
+        assert extracted.meta == getBillMeta(billTree, defaultNS, filePath)
+        assert extracted.sections and extracted.sections == getSectionRecords(
+            billTree, defaultNS)
+        assert extractBill(billTree, defaultNS, filePath,
+                           withXml=False).sections[0].xml is None
+
+
+def test_extractBill_nested_and_withdrawn():
+    from billsim.bill_extractor import extractBill
+    billTree = etree.fromstring('''<bill>
+<form><congress>117th CONGRESS</congress><session>1st Session</session><legis-num>H. R. 1</legis-num></form>
+<legis-body>
+<section id="s1"><enum>1.</enum><header>Short title</header><text>One
+<quoted-block><section id="q1"><enum>5.</enum><header>Quoted</header></section></quoted-block></text></section>
+<section id="s2" status="withdrawn"><enum>2.</enum><header>Withdrawn</header></section>
+<section id="s3"><text>No enum</text><header>Late header</header></section>
+</legis-body></bill>''').getroottree()
+    extracted = extractBill(billTree)
+    assert extracted.meta.congress == '117' and extracted.meta.session == '1'
+    assert extracted.meta.legisnum == 'H. R. 1'
+    assert extracted.meta.date is None and extracted.meta.dublinCore == ''
+    assert extracted.meta.headers == [
+        'Short title', 'Quoted', 'Withdrawn', 'Late header'
+    ]
+    assert [(section.section_id, section.enum, section.header)
+            for section in extracted.sections] == [('s1', '1.', 'Short title'),
+                                                   ('s3', '', 'Late header')]
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+from billsim import constants
+from billsim.compare_matrix import PairCache, getCompareMatrixFromShingles, getShingleSet
+
+
+def test_getCompareMatrixFromShingles():
+    billnumbers = ['116hr200ih', '116hr200rh', '116hr300ih', '116hr400ih']
+    shingles = [
+        getShingleSet([constants.forestry_programs, constants.beef_label]),
+        getShingleSet([constants.forestry_programs, constants.beef_label]),
+        getShingleSet([constants.forestry_programs]),
+        getShingleSet([constants.quality_date_guidance])
+    ]
+    c = getCompareMatrixFromShingles(billnumbers, shingles)
+    assert len(c) == 4 and all(len(row) == 4 for row in c)
+    assert c[0][1] == {
+        'Score': 1.0,
+        'ScoreOther': 1.0,
+        'Explanation': constants.EXPLANATION_IDENTICAL,
+        'ComparedDocs': '116hr200ih-116hr200rh'
+    }
+    # 116hr200ih includes all of 116hr300ih
+    assert c[0][2]['ScoreOther'] == 1.0 and c[0][2]['Score'] < 1.0
+    assert c[0][2]['Explanation'] == constants.EXPLANATION_INCORPORATES
+    assert c[2][0]['Explanation'] == constants.EXPLANATION_INCORPORATED_BY
+    assert (c[2][0]['Score'], c[2][0]['ScoreOther']) == (c[0][2]['ScoreOther'],
+                                                         c[0][2]['Score'])
+    assert c[3][0]['Explanation'] == constants.EXPLANATION_UNRELATED
+
+
+def test_PairCache():
+    cache = PairCache(max_items=2)
+    a, b, c = ('116hr200ih', 1.0, 4), ('116hr200rh', 1.0, 4), ('116hr300ih', 1.0, 4)
+    cache.put(a, b, (0.5, 1.0))
+    assert cache.get(a, b) == (0.5, 1.0)
+    # The reverse direction has the scores swapped
+    assert cache.get(b, a) == (1.0, 0.5)
+    assert cache.get(a, c) is None
+    cache.put(a, c, (0.1, 0.2))
+    cache.put(b, c, (0.3, 0.4))
+    # The least recently used pair is evicted
+    assert len(cache) == 2
+    assert cache.get(a, b) is None
+    assert cache.get(c, b) == (0.4, 0.3)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import pytest
+from collections import Counter
+from billsim import constants
+from billsim.pymodels import SectionMeta
+
+pytest.importorskip('scipy')
+
+
+def makeBill(billnumber_version: str, sections: list[tuple[str, str]]):
+    from billsim.corpus_similarity import BillSectionTerms
+    from billsim.local_index import tokenize
+    return BillSectionTerms(
+        billnumber_version=billnumber_version,
+        length=sum(len(text) for _, text in sections),
+        sections=[
+            SectionMeta(billnumber_version=billnumber_version,
+                        section_id=section_id,
+                        length=len(text)) for section_id, text in sections
+        ],
+        terms=[Counter(tokenize(text)) for _, text in sections])
+
+
+def test_iterSimilarBillSections():
+    from billsim.corpus_similarity import iterSimilarBillSections
+    bills = [
+        makeBill('116hr200ih', [('A1', constants.forestry_programs),
+                                ('A2', constants.beef_label)]),
+        makeBill('116hr200rh', [('B1', constants.forestry_programs),
+                                ('B2', constants.reporting_requirement)]),
+        makeBill('116hr300ih', [('C1', constants.beef_label),
+                                ('C2', constants.quality_date_guidance),
+                                ('C3', constants.misc_civil_rights)])
+    ]
+    # A block size of 3 puts each bill in its own block
+    billSections = list(iterSimilarBillSections(bills, block_size=3))
+    assert [b.billnumber_version for b in billSections
+           ] == ['116hr200ih', '116hr200rh', '116hr300ih']
+    similar = {
+        section.section_id: sorted(
+            similar_section.section_id
+            for similar_section in section.similar_sections)
+        for b in billSections for section in b.sections
+    }
+    assert similar == {
+        'A1': ['A1', 'B1'],
+        'A2': ['A2', 'C1'],
+        'B1': ['A1', 'B1'],
+        'B2': ['B2'],
+        'C1': ['A2', 'C1'],
+        'C2': ['C2'],
+        'C3': ['C3']
+    }
+    # Cosine similarities, apart from the query scores
+    assert all(
+        0 < similar_section.score <= 1.0001 and similar_section.score_es is None
+        for b in billSections for section in b.sections
+        for similar_section in section.similar_sections)
+
+
+def test_compareCorpus_saved_scores(monkeypatch):
+    from billsim import corpus_similarity
+    from billsim.utils import getBillXmlPaths
+    from billsim.utils_db import get_section_to_section_models
+    from tests.utils_test import CONGRESS_PATH_TEST
+    saved = []
+    monkeypatch.setattr(corpus_similarity, 'batch_save_bill_to_bill_sections',
+                        saved.extend)
+    billPaths = getBillXmlPaths(congressDataDir=CONGRESS_PATH_TEST,
+                                pathType='congressdotgov',
+                                congresses=[116])[:4]
+    assert corpus_similarity.compareCorpus(billPaths,
+                                           workers=1) == len(billPaths)
+    assert saved
+    # The rows that are saved have the cosine similarities as their scores
+    s2s_models = get_section_to_section_models(saved)
+    assert s2s_models and all(0 < model.score <= 1.0001 for model in s2s_models)
+    for b2b_model in saved:
+        assert b2b_model.score_es == pytest.approx(
+            sum(model.score
+                for model in get_section_to_section_models([b2b_model])))
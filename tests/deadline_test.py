@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import time
+import pickle
+import asyncio
+import threading
+
+import pytest
+
+from billsim.deadline import Deadline, DeadlineExceeded, runProcess, runWithTimeout
+
+
+def test_Deadline():
+    assert Deadline().remaining() is None
+    deadline = Deadline(60, 'search')
+    assert 0 < deadline.remaining() <= 60
+    deadline.check()
+    expired = Deadline(0, 'search')
+    assert expired.expired()
+    with pytest.raises(DeadlineExceeded, match='search timed out'):
+        expired.check()
+    # The same deadline in a worker process
+    copy = pickle.loads(pickle.dumps(deadline))
+    assert copy.expires_at == deadline.expires_at
+
+
+def test_runWithTimeout_thread():
+    results = []
+
+    def run():
+        try:
+            runWithTimeout(Deadline(0.1), time.sleep, 5)
+        except DeadlineExceeded:
+            results.append('timed out')
+
+    # Not the main thread, where signal.alarm would not work
+    start = time.time()
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    assert results == ['timed out']
+    assert time.time() - start < 2
+    assert runWithTimeout(Deadline(5), sum, [1, 2]) == 3
+
+
+def test_runProcess():
+    assert runProcess(['echo', 'done'], Deadline(5)).stdout == 'done\n'
+    deadline = Deadline(0.2)
+    start = time.time()
+    with pytest.raises(DeadlineExceeded):
+        runProcess(['sleep', '5'], deadline)
+    assert time.time() - start < 2
+
+
+def test_waitFor():
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(Deadline(0.1).waitFor(asyncio.sleep(5)))
+
+
+def test_moreLikeThisBatch_deadline():
+    from billsim.utils_es import getDeadlineParams, moreLikeThisBatch
+    assert getDeadlineParams(None) == {}
+    params = getDeadlineParams(Deadline(5))
+    assert 0 < params['request_timeout'] <= 5
+    assert params['timeout'].endswith('ms')
+    # No request is made once the deadline has expired
+    with pytest.raises(DeadlineExceeded):
+        moreLikeThisBatch(['Section text'], deadline=Deadline(0, 'search'))
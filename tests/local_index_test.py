@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import pytest
+from billsim import constants
+from tests.utils_test import makeSection
+
+
+def test_moreLikeThis():
+    from billsim.local_index import LocalSectionIndex
+    from billsim.bill_similarity import getSimilarSectionsFromResponse
+    index = LocalSectionIndex()
+    index.addBill('116hr200ih', [
+        makeSection('A1', constants.forestry_programs),
+        makeSection('A2', constants.beef_label)
+    ])
+    index.addBill('116hr200rh', [
+        makeSection('B1', constants.forestry_programs),
+        makeSection('B2', constants.reporting_requirement)
+    ])
+    index.addBill('116hr300ih', [
+        makeSection('C1', constants.beef_label),
+        makeSection('C2', constants.quality_date_guidance)
+    ])
+    assert len(index) == 6
+
+    similar_sections = getSimilarSectionsFromResponse(
+        index.moreLikeThis(constants.forestry_programs, min_score=1))
+    assert sorted((s.billnumber_version, s.section_id)
+                  for s in similar_sections) == [('116hr200ih', 'A1'),
+                                                 ('116hr200rh', 'B1')]
+
+    # Replacing a bill removes its old sections
+    index.addBill('116hr200rh',
+                  [makeSection('B2', constants.reporting_requirement)])
+    assert len(index) == 5
+    similar_sections = getSimilarSectionsFromResponse(
+        index.moreLikeThis(constants.forestry_programs, min_score=1))
+    assert [s.section_id for s in similar_sections] == ['A1']
+
+
+def test_getSimilarQuerySectionItems_local(monkeypatch):
+    from billsim import local_index
+    from billsim.bill_similarity import getSimilarQuerySectionItems, makeQuerySection
+    index = local_index.LocalSectionIndex()
+    index.addBill('116hr200ih', [
+        makeSection('A1', constants.forestry_programs),
+        makeSection('A2', constants.beef_label)
+    ])
+    index.addBill('116hr200rh', [
+        makeSection('B1', constants.forestry_programs),
+        makeSection('B2', constants.reporting_requirement)
+    ])
+    monkeypatch.setattr(constants, 'SIMILARITY_BACKEND',
+                        constants.SIMILARITY_BACKEND_LOCAL)
+    monkeypatch.setattr(local_index, '_local_index', index)
+    querySections = [
+        makeQuerySection(makeSection(section_id, text), '116hr300ih')
+        for section_id, text in [('C1', constants.beef_label),
+                                 ('C2', constants.forestry_programs),
+                                 ('C3', constants.reporting_requirement)]
+    ]
+    # The texts are read one batch at a time; the results are the same for any batch size
+    sections = getSimilarQuerySectionItems(querySections,
+                                           min_score=1,
+                                           batch_size=2)
+    assert [s.section_id for s in sections] == ['C1', 'C2', 'C3']
+    assert [s.similar_sections[0].section_id for s in sections
+           ] in (['A2', 'A1', 'B2'], ['A2', 'B1', 'B2'])
+    assert sections == getSimilarQuerySectionItems(querySections, min_score=1)
+
+
+def test_moreLikeThis_default_min_score():
+    from billsim.local_index import LocalSectionIndex
+    from billsim.utils_es import getMinScore
+    index = LocalSectionIndex()
+    index.addBill('116hr200ih', [
+        makeSection('A1', constants.forestry_programs),
+        makeSection('A2', constants.beef_label)
+    ])
+    index.addBill('116hr200rh', [
+        makeSection('B1',
+                    constants.forestry_programs.replace('120 days', '90 days')),
+        makeSection('B2', constants.reporting_requirement)
+    ])
+    index.addBill('116hr300ih', [
+        makeSection('C1', constants.beef_label),
+        makeSection('C2', constants.quality_date_guidance)
+    ])
+    queryText = constants.forestry_programs
+    scores = {
+        hit['_id']: hit['_score'] for hit in index.moreLikeThis(
+            queryText, min_score=0.001)['hits']['hits']
+    }
+    assert set(scores) == {'116hr200ih', '116hr200rh', '116hr300ih'}
+    # Local scores are far below the Elasticsearch min_score for the same text
+    assert max(scores.values()) < getMinScore(queryText)
+    # The default is relative to the score of an identical section: the copies match, the unrelated bill does not
+    minScore = index.getMinScore(queryText, index.getQueryTerms(queryText))
+    assert minScore == pytest.approx(constants.LOCAL_MIN_SCORE_RATIO *
+                                     scores['116hr200ih'])
+    assert sorted(hit['_id']
+                  for hit in index.moreLikeThis(queryText)['hits']['hits']) == [
+                      '116hr200ih', '116hr200rh'
+                  ]
+
+
+def test_save_compacts(tmp_path):
+    from billsim.local_index import LocalSectionIndex
+    index = LocalSectionIndex()
+    index.addBill('116hr200ih', [
+        makeSection('A1', constants.forestry_programs),
+        makeSection('A2', constants.beef_label)
+    ])
+    index.addBill('116hr300ih', [makeSection('C1', constants.beef_label)])
+    # Re-indexing a bill leaves its old sections as deleted
+    index.addBill('116hr200ih',
+                  [makeSection('A1', constants.forestry_programs)])
+    assert len(index.sections) == 4
+    path = str(tmp_path / 'local_index.pickle')
+    index.save(path)
+
+    saved = LocalSectionIndex.load(path)
+    assert len(saved.sections) == len(saved) == 2
+    assert not saved.deleted
+    assert saved.bills == {'116hr200ih': [1], '116hr300ih': [0]}
+    assert saved.totalLength == index.totalLength
+    assert all(
+        docId < 2 for postings in saved.postings.values() for docId in postings)
+    assert saved.moreLikeThis(constants.forestry_programs,
+                              min_score=1) == index.moreLikeThis(
+                                  constants.forestry_programs, min_score=1)
+
+
+def test_moreLikeThis_all_deleted():
+    from billsim.local_index import LocalSectionIndex
+    index = LocalSectionIndex()
+    index.addBill('116hr200ih',
+                  [makeSection('A1', constants.forestry_programs)])
+    index.removeBill('116hr200ih')
+    assert index.getQueryTerms(constants.forestry_programs) == []
+    assert index.moreLikeThis(constants.forestry_programs)['hits']['hits'] == []
+
+
+def test_moreLikeThis_explicit_min_score():
+    from billsim.local_index import LocalSectionIndex
+    index = LocalSectionIndex()
+    index.addBill('116hr200ih',
+                  [makeSection('A1', constants.forestry_programs)])
+    index.addBill('116hr200rh',
+                  [makeSection('B1', constants.forestry_programs)])
+    index.addBill('116hr300ih', [makeSection('C1', constants.beef_label)])
+    # An explicit min_score of MIN_SCORE_DEFAULT is absolute, not the relative default
+    assert index.moreLikeThis(
+        constants.forestry_programs,
+        min_score=constants.MIN_SCORE_DEFAULT)['hits']['hits'] == []
+    assert len(index.moreLikeThis(
+        constants.forestry_programs)['hits']['hits']) == 2
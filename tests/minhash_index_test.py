@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import os
+import pytest
+from billsim import constants
+from tests.utils_test import makeSection
+
+pytest.importorskip('numpy')
+
+
+def test_minHashIndex(tmp_path):
+    from billsim.minhash_index import MinHashIndex
+    index = MinHashIndex()
+    index.addBill('116hr200ih', [
+        makeSection('A1', constants.forestry_programs),
+        makeSection('A2', constants.beef_label)
+    ])
+    index.addBill('116hr200rh', [
+        makeSection(
+            'B1', constants.forestry_programs.replace('120 days', '90 days')),
+        makeSection('B2', constants.reporting_requirement)
+    ])
+    index.addBill('116hr300ih',
+                  [makeSection('C1', constants.quality_date_guidance)])
+    assert len(index) == 5
+
+    similar_sections = index.getSimilarSections(constants.forestry_programs)
+    assert [(s.billnumber_version, s.section_id) for s in similar_sections
+           ] == [('116hr200ih', 'A1'), ('116hr200rh', 'B1')]
+    assert similar_sections[0].score == 1
+    assert similar_sections[0].score_es is None
+
+    index.removeBill('116hr200rh')
+    assert index.getRemovedCount() == 2
+    index_path = os.path.join(tmp_path, 'minhash_index.pickle')
+    index.save(index_path)
+    index = MinHashIndex.load(index_path)
+    assert len(index) == 3
+    # The sections of the removed bill are not saved
+    assert index.getRemovedCount() == 0 and len(index.sections) == 3
+    assert [
+        s.section_id
+        for s in index.getSimilarSections(constants.forestry_programs)
+    ] == ['A1']
+
+
+def test_mergeNearDuplicates():
+    from billsim.bill_similarity import getBillToBill, mergeNearDuplicates
+    from billsim.pymodels import BillSections, Section, SimilarSection
+    from billsim.utils_db import get_section_to_section_models
+    found = [
+        SimilarSection(billnumber_version='116hr200ih',
+                       section_id='A1',
+                       score_es=40.0),
+        SimilarSection(billnumber_version='116hr300ih',
+                       section_id='C1',
+                       score_es=25.0)
+    ]
+    nearDuplicates = [
+        SimilarSection(billnumber_version='116hr200ih',
+                       section_id='A1',
+                       score=1.0),
+        SimilarSection(billnumber_version='116hr200rh',
+                       section_id='B1',
+                       score=0.9)
+    ]
+    merged = mergeNearDuplicates(found, nearDuplicates)
+    assert [(s.billnumber_version, s.score_es, s.score) for s in merged
+           ] == [('116hr200ih', 40.0, 1.0), ('116hr300ih', 25.0, None),
+                 ('116hr200rh', None, 0.9)]
+    assert mergeNearDuplicates(found, []) == found
+    # The bill to bill scores add up the scores that are saved: the query score, else the similarity
+    b2b = getBillToBill(
+        BillSections(billnumber_version='116hr100ih',
+                     length=100,
+                     sections=[
+                         Section(billnumber_version='116hr100ih',
+                                 section_id='S1',
+                                 similar_sections=merged),
+                         Section(billnumber_version='116hr100ih',
+                                 section_id='S2',
+                                 similar_sections=merged[:1])
+                     ]))
+    assert b2b['116hr200ih'].score_es == 80.0
+    assert b2b['116hr200rh'].score_es == 0.9
+    assert b2b['116hr200rh'].sections_match == 1
+    # Near-duplicates that the query did not find are saved with their similarity
+    assert [(model.bill_number_to, model.section_to_id, model.score)
+            for model in get_section_to_section_models([b2b['116hr200rh']])
+           ] == [('116hr200rh', 'B1', 0.9)]
+
+
+def test_getSimilarSectionItems_shortcircuit(monkeypatch):
+    from billsim import bill_similarity, minhash_index
+    from billsim.pymodels import SectionMeta
+    index = minhash_index.MinHashIndex()
+    index.addBill('116hr200ih', [
+        makeSection('A1', constants.forestry_programs),
+        makeSection('A2', constants.beef_label)
+    ])
+    index.addBill('116hr200rh', [
+        makeSection(
+            'B1', constants.forestry_programs.replace('120 days', '90 days'))
+    ])
+    monkeypatch.setattr(minhash_index, '_minhash_index', index)
+    monkeypatch.setattr(constants, 'SIMILARITY_BACKEND',
+                        constants.SIMILARITY_BACKEND_ES)
+    monkeypatch.setattr(constants, 'MINHASH_SHORTCIRCUIT', True)
+    queried = []
+
+    def moreLikeThisBatch(queryTexts, **kwargs):
+        queried.extend(queryTexts)
+        return [{'hits': {'hits': []}} for _ in queryTexts]
+
+    monkeypatch.setattr(bill_similarity, 'moreLikeThisBatch', moreLikeThisBatch)
+    queryTexts = [
+        constants.forestry_programs, constants.beef_label,
+        constants.reporting_requirement
+    ]
+    sections = bill_similarity.getSimilarSectionItems(queryTexts, [
+        SectionMeta(billnumber_version='116hr200ih', section_id=section_id)
+        for section_id in ['A1', 'A2', 'A3']
+    ])
+    # The section with a near-duplicate in another bill is not queried; a match in its own bill is not enough
+    assert queried == queryTexts[1:]
+    assert [(s.billnumber_version, s.section_id, s.score_es)
+            for s in sections[0].similar_sections
+           ] == [('116hr200ih', 'A1', None), ('116hr200rh', 'B1', None)]
+    assert [s.section_id for s in sections[1].similar_sections] == ['A2']
+    assert sections[2].similar_sections == []
+
+
+def test_getSignature_chunks(monkeypatch):
+    from billsim import minhash_index
+    text = ' '.join([
+        constants.forestry_programs, constants.beef_label,
+        constants.reporting_requirement
+    ])
+    signature = minhash_index.getSignature(text)
+    assert len(minhash_index.getShingles(text)) > 7
+    monkeypatch.setattr(minhash_index, 'SIGNATURE_CHUNK_SIZE', 7)
+    assert (minhash_index.getSignature(text) == signature).all()
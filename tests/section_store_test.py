@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import os
+
+from billsim.pymodels import SectionRecord
+from tests.utils_test import CONGRESS_PATH_TEST
+
+
+def test_SectionStore(tmp_path):
+    from billsim.section_store import SectionStore, addBillPaths
+    from billsim.utils import getBillXmlPaths, parseBill
+    store = SectionStore(str(tmp_path))
+    billPaths = getBillXmlPaths(congressDataDir=CONGRESS_PATH_TEST,
+                                pathType='congressdotgov',
+                                congresses=[116, 117])[:6]
+    assert addBillPaths(store, billPaths) == len(billPaths)
+    for billPath in billPaths:
+        sections = parseBill(billPath.filePath, withXml=False).sections
+        assert store.getSections(billPath.billnumber_version) == sections
+        assert store.getSectionTexts(billPath.billnumber_version) == [
+            section.text for section in sections
+        ]
+    assert set(store.getCongresses()) <= {'116', '117'}
+    assert store.getSections('117hr1ih') is None
+
+    # Appending a bill again replaces it; other processes read the store from its files
+    bnv = billPaths[0].billnumber_version
+    store.addBill(bnv, [
+        SectionRecord(section_id='id1',
+                      enum='1.',
+                      header='Short títle',
+                      text='Ünicode text',
+                      length=12)
+    ])
+    reader = SectionStore(str(tmp_path))
+    assert reader.getSection(bnv, 'id1').text == 'Ünicode text'
+    assert reader.getSections(billPaths[1].billnumber_version) == store.getSections(
+        billPaths[1].billnumber_version)
+    assert sorted(reader.iterBillnumbers()) == sorted(
+        billPath.billnumber_version for billPath in billPaths)
+
+    store.removeBill(bnv)
+    assert bnv not in store
+    assert bnv not in SectionStore(str(tmp_path))
+
+
+def test_SectionStore_interrupted_append(tmp_path):
+    from billsim.section_store import SectionStore
+    store = SectionStore(str(tmp_path))
+    section = SectionRecord(section_id='s1',
+                            enum='1.',
+                            header='Header',
+                            text='Text',
+                            length=4)
+    store.addBill('117hr1ih', [section])
+    # The text of a second bill was written without its offsets or its entry in the index
+    congressDir = os.path.join(str(tmp_path), '117')
+    with open(os.path.join(congressDir, 'text.bin'), 'ab') as f:
+        f.write(b'partial')
+    with open(os.path.join(congressDir, 'header.idx'), 'ab') as f:
+        f.write(b'\x01\x00\x00')
+    writer = SectionStore(str(tmp_path))
+    writer.addBill('117hr2ih', [section, section._replace(section_id='s2')])
+    assert writer.getSections('117hr1ih') == [section]
+    assert [s.section_id for s in writer.getSections('117hr2ih')] == ['s1', 's2']
+
+
+def test_SectionCorpus(tmp_path):
+    import pickle
+    from billsim.section_store import SectionCorpus, SectionStore
+    from billsim.utils_es import esSourceToQueryData
+    from billsim.bill_similarity import getCorpusQuerySections
+    store = SectionStore(str(tmp_path))
+    sections = [
+        SectionRecord(section_id='s1',
+                      enum='1.',
+                      header='Short title',
+                      text='This Act may be cited as the Ünicode Act.',
+                      length=41),
+        SectionRecord(section_id='s2', enum='', header='', text='', length=0)
+    ]
+    store.addBill('117hr1ih', sections)
+    corpus = SectionCorpus(store)
+    assert corpus.getSectionCount('117hr1ih') == 2
+    view = corpus.getMemoryView('117hr1ih', 0)
+    assert isinstance(view, memoryview) and view.readonly
+    assert bytes(view) == sections[0].text.encode('utf-8')
+    assert corpus.getText('117hr1ih', 1) == ''
+    textRef = corpus.getSectionText('117hr1ih', 0)
+    assert pickle.loads(pickle.dumps(textRef)).getText() == sections[0].text
+
+    querySections = getCorpusQuerySections('117hr1ih', corpus)
+    assert [q.query_text for q in querySections] == [None, None]
+    assert [q.getQueryText() for q in querySections] == [s.text for s in sections]
+    assert querySections[0].label == '1.' and querySections[1].label is None
+
+    source = {
+        'billnumber': '117hr1',
+        'billversion': 'ih',
+        'sections': [{
+            'section_id': section.section_id,
+            'section_text': section.text
+        } for section in sections]
+    }
+    fromSource = esSourceToQueryData(source, corpus=corpus)
+    assert [q.text_ref for q in fromSource] == corpus.getSectionTexts('117hr1ih')
+    assert fromSource[0].getQueryText() == sections[0].text
+    # Without the corpus, or when the corpus has another version of the bill, the texts of the source are used
+    assert esSourceToQueryData(source)[0].query_text == sections[0].text
+    source['sections'] = source['sections'][:1]
+    assert esSourceToQueryData(source, corpus=corpus)[0].text_ref is None
+    # The same number of sections, with other section_ids
+    assert store.getSectionIds('117hr1ih') == ['s1', 's2']
+    source['sections'] = [{
+        'section_id': section_id,
+        'section_text': 'Another version'
+    } for section_id in ['s1', 's3']]
+    assert [q.getQueryText() for q in esSourceToQueryData(source, corpus=corpus)
+           ] == ['Another version', 'Another version']
+
+
+def test_SectionStore_compact(tmp_path):
+    from billsim.section_store import SectionCorpus, SectionStore
+    store = SectionStore(str(tmp_path))
+    sections = [
+        SectionRecord(section_id=f's{i}',
+                      enum=f'{i}.',
+                      header=f'Header {i}',
+                      text=f'Text of section {i}',
+                      length=17) for i in range(3)
+    ]
+    store.addBill('117hr1ih', sections)
+    store.addBill('117hr2ih', sections[:2])
+    store.addBill('117hr3ih', [])
+    reader = SectionStore(str(tmp_path))
+    assert reader.getSections('117hr2ih') == sections[:2]
+    # Replaced and removed bills leave their rows in the files until the store is compacted
+    for _ in range(3):
+        store.addBill('117hr1ih', sections[1:])
+    store.removeBill('117hr2ih')
+    congressStore = store.getCongressStore('117')
+    textPath = congressStore.columns['text'].dataPath
+    size = os.path.getsize(textPath)
+    assert congressStore.getUnusedRows() == 3 + 2 * 3
+    assert store.compact() == 3 + 2 * 3
+    assert congressStore.getUnusedRows() == 0 and store.compact() == 0
+    assert os.path.getsize(textPath) == size * 2 // 11
+    assert store.getSections('117hr1ih') == sections[1:]
+    assert store.getSections('117hr3ih') == []
+    assert SectionCorpus(store).getText('117hr1ih', 1) == sections[2].text
+
+    # Bills appended after the compaction, and readers that were open before it, use the new files
+    store.addBill('117hr4ih', sections[:1])
+    assert reader.getSections('117hr2ih') == sections[:2]
+    reader.getCongressStore('117').refresh()
+    assert reader.getSections('117hr2ih') is None
+    assert reader.getSections('117hr1ih') == sections[1:]
+    assert reader.getSections('117hr4ih') == sections[:1]
+    assert sorted(SectionStore(str(tmp_path)).iterBillnumbers()) == [
+        '117hr1ih', '117hr3ih', '117hr4ih'
+    ]
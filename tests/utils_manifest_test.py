@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import os
+from billsim.pymodels import BillPath
+
+
+def test_diffManifest(tmp_path):
+    from billsim.utils_manifest import diffManifest, loadManifest, markIndexed, saveManifest
+    billPaths = []
+    for billnumber_version in ['116hr200ih', '116hr2001ih', '116hr2002ih']:
+        filePath = os.path.join(tmp_path, f'BILLS-{billnumber_version}-uslm.xml')
+        with open(filePath, 'w') as f:
+            f.write(f'<bill>{billnumber_version}</bill>')
+        billPaths.append(
+            BillPath(billnumber_version=billnumber_version,
+                     fileName=os.path.basename(filePath),
+                     filePath=filePath))
+
+    manifest = {}
+    changed, removed = diffManifest(manifest, billPaths)
+    assert changed == billPaths
+    assert removed == []
+
+    for billPath in billPaths:
+        markIndexed(manifest, billPath)
+    manifest_path = os.path.join(tmp_path, 'index_manifest.json')
+    saveManifest(manifest, manifest_path)
+    manifest = loadManifest(manifest_path)
+    assert len(manifest) == 3
+
+    # Touched, but unchanged
+    os.utime(billPaths[0].filePath, (0, 0))
+    # Changed
+    with open(billPaths[1].filePath, 'w') as f:
+        f.write('<bill>changed bill text</bill>')
+    # Removed
+    changed, removed = diffManifest(manifest, billPaths[:2])
+    assert [billPath.billnumber_version for billPath in changed
+           ] == ['116hr2001ih']
+    assert [entry.billnumber_version for entry in removed] == ['116hr2002ih']
+    assert manifest[billPaths[0].filePath].mtime == 0
+
+
+def test_markIndexed_changed_while_indexing(tmp_path):
+    from billsim.utils_manifest import diffManifest, getFileHash, markIndexed
+    filePath = os.path.join(tmp_path, 'BILLS-116hr200ih-uslm.xml')
+    with open(filePath, 'w') as f:
+        f.write('<bill>116hr200ih</bill>')
+    billPath = BillPath(billnumber_version='116hr200ih',
+                        fileName=os.path.basename(filePath),
+                        filePath=filePath)
+    manifest = {}
+    content_hash = getFileHash(filePath)
+    assert diffManifest(manifest, [billPath])[0] == [billPath]
+    assert manifest[filePath].indexed_at is None
+
+    # The file changes after it is read for indexing
+    with open(filePath, 'w') as f:
+        f.write('<bill>116hr200ih, changed while indexing</bill>')
+    markIndexed(manifest, billPath)
+    assert manifest[filePath].indexed_at is not None
+    assert manifest[filePath].content_hash == content_hash
+    assert diffManifest(manifest, [billPath])[0] == [billPath]
+
+
+def test_diffManifest_removed_after_listing(tmp_path):
+    from billsim.utils_manifest import diffManifest, markIndexed
+    filePath = os.path.join(tmp_path, 'BILLS-116hr200ih-uslm.xml')
+    with open(filePath, 'w') as f:
+        f.write('<bill>116hr200ih</bill>')
+    billPath = BillPath(billnumber_version='116hr200ih',
+                        fileName=os.path.basename(filePath),
+                        filePath=filePath)
+    manifest = {}
+    diffManifest(manifest, [billPath])
+    markIndexed(manifest, billPath)
+
+    # The file is listed, but removed before it is stat'ed
+    os.remove(filePath)
+    changed, removed = diffManifest(manifest, [billPath])
+    assert changed == []
+    assert [entry.billnumber_version for entry in removed] == ['116hr200ih']
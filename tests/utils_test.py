@@ -6,12 +6,20 @@ from re import S
 from lxml import etree
 from pathlib import Path
 from billsim import constants
-from billsim.pymodels import BillPath
+from billsim.pymodels import BillPath, SectionRecord
 from tests.constants_test import TEST_DIR
 
 CONGRESS_PATH_TEST = os.path.join(TEST_DIR, 'samples', 'data', 'congress')
 
 
+def makeSection(section_id: str, text: str) -> SectionRecord:
+    return SectionRecord(section_id=section_id,
+                         enum='1.',
+                         header='Header',
+                         text=text,
+                         length=len(text))
+
+
 def test_deep_get():
     from billsim.utils import deep_get
     d = {
@@ -132,9 +140,167 @@ def test_getBillXmlPaths(congressDataDir=CONGRESS_PATH_TEST):
     assert found116hr2004ih
 
 
+def test_iterBillXmlPaths(congressDataDir=CONGRESS_PATH_TEST):
+    from billsim.utils import getBillXmlPaths, iterBillXmlPaths
+    billPaths = iterBillXmlPaths(congressDataDir=congressDataDir,
+                                 pathType='congressdotgov',
+                                 workers=4)
+    # A generator: the first bill is available before the scan is complete
+    first = next(billPaths)
+    assert first.fileName.endswith('-uslm.xml')
+    found = [first] + list(billPaths)
+    assert sorted(billPath.filePath for billPath in found) == sorted(
+        billPath.filePath for billPath in getBillXmlPaths(
+            congressDataDir=congressDataDir, pathType='congressdotgov'))
+
+
+def test_iterBillXmlPaths_congresses(congressDataDir=CONGRESS_PATH_TEST):
+    from billsim.utils import getBillXmlPaths, iterBillXmlPaths
+    allPaths = getBillXmlPaths(congressDataDir=congressDataDir,
+                               pathType='congressdotgov')
+    billPaths = list(
+        iterBillXmlPaths(congressDataDir=congressDataDir,
+                         pathType='congressdotgov',
+                         congresses=[116]))
+    # Only the directory of the 116th Congress is scanned
+    assert billPaths and all(
+        billPath.filePath.startswith(os.path.join(congressDataDir, '116', ''))
+        for billPath in billPaths)
+    assert len(billPaths) == len([
+        billPath for billPath in allPaths
+        if billPath.billnumber_version.startswith('116')
+    ]) < len(allPaths)
+    both = getBillXmlPaths(congressDataDir=congressDataDir,
+                           pathType='congressdotgov',
+                           congresses=[116, 117, 99])
+    assert sorted(billPath.filePath for billPath in both) == sorted(
+        billPath.filePath for billPath in allPaths)
+
+
+streaming_bill = """<bill{xmlns}>
+<metadata><title>Streaming</title></metadata>
+<legis-body>
+<section id="s1"><enum>1.</enum><header>First</header><text>One</text>
+<subsection><section id="nested"><enum>(a)</enum><text>Nested</text></section></subsection>
+</section>
+<section id="s2" status="withdrawn"><enum>2.</enum><header>Withdrawn</header></section>
+<title><section id="s3"><num>3.</num><heading>Third</heading><text>Three</text></section></title>
+</legis-body>
+</bill>"""
+
+
+def test_iterSectionRecords(tmp_path):
+    from billsim.utils import getDefaultNamespace, getSectionRecords, iterSectionRecords, parseFilePath
+    for xmlns in ['', ' xmlns="http://schemas.gpo.gov/xml/uslm"']:
+        filePath = str(tmp_path / 'bill.xml')
+        with open(filePath, 'w') as f:
+            f.write(streaming_bill.format(xmlns=xmlns))
+        billTree = parseFilePath(filePath)
+        records = getSectionRecords(billTree, getDefaultNamespace(billTree))
+        assert [record.section_id for record in records] == ['s1', 's3']
+        assert list(iterSectionRecords(filePath)) == records
+        assert [record.header for record in iterSectionRecords(filePath, withXml=False)] == ['First', 'Third']
+
+
+def test_parseBill_stream(monkeypatch):
+    from billsim import utils
+    from tests.xpath_extractor_test import BILL_PATH_DTD
+    filePaths = [
+        billPath.filePath for billPath in utils.getBillXmlPaths(
+            congressDataDir=CONGRESS_PATH_TEST, pathType='congressdotgov')
+    ] + [BILL_PATH_DTD]
+    parsedBills = [utils.parseBill(filePath) for filePath in filePaths]
+    assert parsedBills[-1].meta.dublinCore
+    # Every file is parsed as a stream
+    monkeypatch.setattr(utils, 'PARSE_STREAM_MIN_BYTES', 0)
+    for filePath, parsedBill in zip(filePaths, parsedBills):
+        assert utils.parseBill(filePath) == parsedBill
+    # The full text is only extracted from the tree
+    assert utils.parseBill(BILL_PATH_DTD, withText=True).text
+
+
 def test_getBillnumberVersionParts():
     from billsim.utils import getBillnumberversionParts
 
     parts = getBillnumberversionParts('117hr2222enr')
 
     assert parts == {'billnumber': '117hr2222', 'version': 'enr'}
+
+
+def test_getSectionRecords():
+    from billsim.utils import getSectionRecords
+    billTree = etree.ElementTree(
+        etree.fromstring('<bill><legis-body>' + section_data +
+                         '<section status="withdrawn"><enum>3.</enum></section>'
+                         '</legis-body></bill>',
+                         parser=etree.XMLParser()))
+    records = getSectionRecords(billTree)
+    assert len(records) == 1
+    record = records[0]
+    assert record.section_id == "H93C64B1CB03F40CD8666BB62DA698757"
+    assert record.enum == "2."
+    assert record.header == "National Intersection and Interchange Safety Construction Program"
+    assert record.length == len(record.text)
+    assert record.xml.startswith('<section')
+    assert getSectionRecords(billTree, withXml=False)[0].xml is None
+
+
+def test_getParsedBill():
+    from billsim.utils import BillCache, getParsedBill
+    from tests.constants_test import SAMPLE_BILL_PATH, SAMPLE_BILL_PATH_117HR2001
+    cache = BillCache()
+    parsedBill = getParsedBill(SAMPLE_BILL_PATH.filePath, cache=cache)
+    with open(SAMPLE_BILL_PATH.filePath, 'r') as f:
+        assert parsedBill.length == len(f.read())
+    assert len(parsedBill.sections) > 0
+    assert parsedBill.meta.congress == '117'
+    assert getParsedBill(SAMPLE_BILL_PATH.filePath, cache=cache) is parsedBill
+    # Full text was not cached, so the bill is parsed again
+    withText = getParsedBill(SAMPLE_BILL_PATH.filePath,
+                             withText=True,
+                             cache=cache)
+    assert withText is not parsedBill
+    assert withText.text
+    assert len(cache) == 1
+
+    # The least recently used bill is evicted
+    from billsim.utils import getParsedBillSize, parseBill
+    sizes = [
+        getParsedBillSize(parseBill(billPath.filePath))
+        for billPath in [SAMPLE_BILL_PATH, SAMPLE_BILL_PATH_117HR2001]
+    ]
+    cache = BillCache(max_bytes=max(sizes) + 1)
+    getParsedBill(SAMPLE_BILL_PATH.filePath, cache=cache)
+    parsedBill2001 = getParsedBill(SAMPLE_BILL_PATH_117HR2001.filePath,
+                                   cache=cache)
+    assert len(cache) == 1
+    assert getParsedBill(SAMPLE_BILL_PATH_117HR2001.filePath,
+                         cache=cache) is parsedBill2001
+
+
+def test_getBillLengthbyPath(tmp_path):
+    from billsim.utils import BILL_LENGTHS, countFileChars, getBillLengthbyPath
+    from tests.constants_test import SAMPLE_BILL_PATH
+    with open(SAMPLE_BILL_PATH.filePath, 'r') as f:
+        length = len(f.read())
+    assert countFileChars(SAMPLE_BILL_PATH.filePath) == length
+    assert getBillLengthbyPath(SAMPLE_BILL_PATH.filePath) == length
+    assert BILL_LENGTHS[SAMPLE_BILL_PATH.filePath] == (os.stat(
+        SAMPLE_BILL_PATH.filePath).st_mtime, length)
+    assert getBillLengthbyPath(
+        SAMPLE_BILL_PATH.filePath,
+        byteLength=True) == os.path.getsize(SAMPLE_BILL_PATH.filePath)
+
+    crlf_path = os.path.join(tmp_path, 'crlf.xml')
+    with open(crlf_path, 'wb') as f:
+        f.write('<bill>\r\n§ 1.\r\n</bill>'.encode('utf-8'))
+    with open(crlf_path, 'r') as f:
+        assert countFileChars(crlf_path) == len(f.read())
+
+    # A changed file replaces the length of its earlier version
+    assert getBillLengthbyPath(crlf_path) == 19
+    with open(crlf_path, 'ab') as f:
+        f.write(b'\n')
+    os.utime(crlf_path, (0, os.stat(crlf_path).st_mtime + 10))
+    assert getBillLengthbyPath(crlf_path) == 20
+    assert BILL_LENGTHS[crlf_path] == (os.stat(crlf_path).st_mtime, 20)
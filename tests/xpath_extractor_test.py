@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+
+from lxml import etree
+
+from tests.utils_test import CONGRESS_PATH_TEST
+
+BILL_PATH_USLM = os.path.join(CONGRESS_PATH_TEST, '117', 'bills', 'hr2000',
+                              'BILLS-117hr2000ih-uslm.xml')
+BILL_PATH_DTD = os.path.join(CONGRESS_PATH_TEST, '117', 'bills', 'hr2000',
+                             'BILLS-117hr2000ih.xml')
+
+
+def test_SectionExtractor():
+    from billsim.xpath_extractor import SectionExtractor, extractCompiled, extractUncompiled
+    extractor = SectionExtractor()
+    for filePath in [BILL_PATH_USLM, BILL_PATH_DTD]:
+        billTree = etree.parse(filePath, parser=etree.XMLParser())
+        namespace = billTree.getroot().nsmap.get(None, '')
+        sections = extractCompiled(billTree, namespace, extractor=extractor)
+        assert sections and sections == extractUncompiled(billTree, namespace)
+
+    # Compiled once per (namespace, expression), in each thread
+    xpath = extractor.getXPath('ns:enum', 'http://schemas.gpo.gov/xml/uslm')
+    assert extractor.getXPath('ns:enum',
+                              'http://schemas.gpo.gov/xml/uslm') is xpath
+    other = []
+    thread = threading.Thread(target=lambda: other.append(
+        extractor.getXPath('ns:enum', 'http://schemas.gpo.gov/xml/uslm')))
+    thread.start()
+    thread.join()
+    assert other[0] is not xpath
+
+
+def test_benchmark():
+    from billsim.xpath_extractor import benchmark
+    results = benchmark([BILL_PATH_USLM, BILL_PATH_DTD], repeat=1)
+    assert results['sections'] > 0
+    assert results['compiled_us'] > 0 and results['uncompiled_us'] > 0